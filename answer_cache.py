@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+class AnswerCache:
+    """Per-document cache of chat answers with exact and semantic lookup.
+
+    Entries are grouped by document id. A question first matches on its normalized
+    text; failing that, the cached question whose embedding has the highest cosine
+    similarity is used if it reaches ``similarity_threshold``. Each document keeps at
+    most ``max_entries_per_doc`` answers (LRU) for ``ttl_seconds``, and at most
+    ``max_docs`` documents are cached. A document's entries are dropped when it is
+    invalidated or when the caller passes a different ingest ``generation``.
+
+    Only touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 3600,
+                 max_entries_per_doc: int = 256, max_docs: int = 1024):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_doc = max_entries_per_doc
+        self.max_docs = max_docs
+        self._docs: "OrderedDict[str, dict]" = OrderedDict()
+        self.metrics = {"exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                        "evictions": 0, "invalidations": 0}
+
+    def _doc_entries(self, doc_id: str, generation=None, create: bool = False) -> Optional["OrderedDict"]:
+        doc = self._docs.get(doc_id)
+        if doc is not None and doc["generation"] != generation:
+            # the document was re-ingested since these answers were cached
+            del self._docs[doc_id]
+            self.metrics["invalidations"] += 1
+            doc = None
+        if doc is None:
+            if not create:
+                return None
+            doc = {"generation": generation, "entries": OrderedDict()}
+            self._docs[doc_id] = doc
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+                self.metrics["evictions"] += 1
+        self._docs.move_to_end(doc_id)
+
+        now = time.monotonic()
+        expired = [key for key, entry in doc["entries"].items() if entry["expires_at"] <= now]
+        for key in expired:
+            del doc["entries"][key]
+        return doc["entries"]
+
+    def lookup_exact(self, doc_id: str, question: str, generation=None) -> Optional[dict]:
+        entries = self._doc_entries(doc_id, generation)
+        entry = entries.get(normalize_question(question)) if entries else None
+        if entry is None:
+            return None
+        entries.move_to_end(normalize_question(question))
+        self.metrics["exact_hits"] += 1
+        return entry["answer"]
+
+    def lookup_similar(self, doc_id: str, embedding: List[float], generation=None) -> Optional[dict]:
+        entries = self._doc_entries(doc_id, generation)
+        if not entries:
+            self.metrics["misses"] += 1
+            return None
+        keys = list(entries.keys())
+        matrix = np.stack([entries[key]["embedding"] for key in keys])
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        similarities = matrix @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            self.metrics["misses"] += 1
+            return None
+        entries.move_to_end(keys[best])
+        self.metrics["semantic_hits"] += 1
+        return entries[keys[best]]["answer"]
+
+    def store(self, doc_id: str, question: str, embedding: List[float], answer: dict,
+              generation=None) -> None:
+        entries = self._doc_entries(doc_id, generation, create=True)
+        vector = np.asarray(embedding, dtype=np.float32)
+        entries[normalize_question(question)] = {
+            "embedding": vector / (np.linalg.norm(vector) or 1.0),
+            "answer": answer,
+            "expires_at": time.monotonic() + self.ttl_seconds,
+        }
+        entries.move_to_end(normalize_question(question))
+        while len(entries) > self.max_entries_per_doc:
+            entries.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def invalidate(self, doc_id: str) -> None:
+        if self._docs.pop(doc_id, None) is not None:
+            self.metrics["invalidations"] += 1
+
+    def stats(self) -> dict:
+        hits = self.metrics["exact_hits"] + self.metrics["semantic_hits"]
+        lookups = hits + self.metrics["misses"]
+        return {
+            **self.metrics,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "documents": len(self._docs),
+            "entries": sum(len(doc["entries"]) for doc in self._docs.values()),
+            "similarity_threshold": self.similarity_threshold,
+        }
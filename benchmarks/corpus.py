@@ -0,0 +1,97 @@
+"""Synthetic, seeded TXT and PDF documents for benchmarks."""
+import os
+import random
+import textwrap
+from typing import Dict, List, Tuple
+
+# pages per document size
+SIZES = {"small": 5, "medium": 50, "large": 300}
+
+LINES_PER_PAGE = 50
+LINE_WIDTH = 90
+
+_WORDS = (
+    "pump valve housing seal torque bracket inspect replace assembly pressure "
+    "flow rate sensor calibrate warranty clause section manual operator install "
+    "maintenance schedule filter gasket bearing shaft motor voltage circuit fuse "
+    "safety warning procedure tighten remove lubricate check record interval"
+).split()
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 18))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), f"PN-{rng.randint(1000, 9999)}")
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), f"clause {rng.randint(1, 40)}.{rng.randint(1, 9)}")
+    sentence = " ".join(words)
+    return sentence[0].upper() + sentence[1:] + "."
+
+
+def page_lines(rng: random.Random, page_number: int) -> List[str]:
+    text = f"Section {page_number + 1}. " + " ".join(_sentence(rng) for _ in range(40))
+    return textwrap.wrap(text, LINE_WIDTH)[:LINES_PER_PAGE]
+
+
+def generate_pages(pages: int, seed: int) -> List[List[str]]:
+    rng = random.Random(seed)
+    return [page_lines(rng, n) for n in range(pages)]
+
+
+def write_txt(path: str, pages: List[List[str]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join("\n".join(lines) for lines in pages))
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[List[str]]) -> None:
+    """Write a plain PDF 1.4 file with one Helvetica text stream per page"""
+    objects: List[Tuple[int, str]] = []
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    for lines in pages:
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td\n" + "".join(f"({_pdf_escape(line)}) Tj T*\n" for line in lines) + "ET"
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects.append((content_id, f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream"))
+        objects.append((page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                                 f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"))
+        page_ids.append(page_id)
+
+    objects = [
+        (1, "<< /Type /Catalog /Pages 2 0 R >>"),
+        (2, f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"),
+        (font_id, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"),
+    ] + objects
+    objects.sort(key=lambda obj: obj[0])
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for obj_id in range(1, len(objects) + 1):
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def build_corpus(directory: str, sizes: List[str], seed: int = 42) -> List[Dict]:
+    """One TXT and one PDF per size; returns [{name, size, kind, path, pages, bytes}]"""
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for index, size in enumerate(sizes):
+        pages = generate_pages(SIZES[size], seed + index)
+        for kind, writer in (("txt", write_txt), ("pdf", write_pdf)):
+            path = os.path.join(directory, f"{size}.{kind}")
+            writer(path, pages)
+            corpus.append({"name": f"{size}.{kind}", "size": size, "kind": kind, "path": path,
+                           "pages": len(pages), "bytes": os.path.getsize(path)})
+    return corpus
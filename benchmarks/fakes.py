@@ -0,0 +1,48 @@
+"""Deterministic stand-ins for the OpenAI models so benchmarks run offline."""
+import hashlib
+import re
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def hashing_embedding(text: str, dimensions: int = 256) -> List[float]:
+    """Feature-hashed bag of words, L2-normalized.
+
+    Identical texts always get identical vectors and texts sharing words are close,
+    so retrieval results are stable and still meaningful.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[bucket] += sign
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+class HashingEmbeddings(Embeddings):
+    """Drop-in replacement for ``OpenAIEmbeddings`` (the embedding cache keys on ``model``)"""
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [hashing_embedding(text, self.dimensions) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return hashing_embedding(text, self.dimensions)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
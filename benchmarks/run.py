@@ -0,0 +1,283 @@
+"""Offline benchmark of the ingest and chat paths.
+
+Runs against a local mongod (``MONGO_URI``, a throwaway database is created and
+dropped), a stub OpenAI-compatible server and deterministic embeddings, then writes
+a JSON report::
+
+    python -m benchmarks.run --sizes small medium --chat-requests 200 --output bench.json
+
+tiktoken needs its encodings once; set ``TIKTOKEN_CACHE_DIR`` to a pre-filled
+directory to run without network access.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from benchmarks.corpus import SIZES, build_corpus
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.stub_openai import StubServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p95/p99 plus mean and max, in milliseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(rank(50) * 1000, 2),
+        "p95_ms": round(rank(95) * 1000, 2),
+        "p99_ms": round(rank(99) * 1000, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def rss_mb() -> Dict[str, float]:
+    current = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return {"rss_mb": round(current, 1) if current else None, "peak_rss_mb": round(peak_mb, 1)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+async def bench_vectorizer(corpus: List[dict], workdir: str) -> dict:
+    """Ingest every corpus file straight through AsyncDocumentVectorizer"""
+    from lexical_index import LexicalIndex
+    from maintenance import directory_size
+    from vectorizer import AsyncDocumentVectorizer, get_chroma_collections
+
+    persist_directory = os.path.join(workdir, "vectorizer_chroma")
+    vectorizer = AsyncDocumentVectorizer(
+        openai_api_key="bench",
+        persist_directory=persist_directory,
+        lexical_index=LexicalIndex(os.path.join(workdir, "vectorizer_lexical")),
+    )
+    vectorizer.embeddings = HashingEmbeddings()
+
+    ingest, lookups = [], []
+    loop = asyncio.get_event_loop()
+    try:
+        for item in corpus:
+            document_id = str(uuid.uuid4())
+            started = time.perf_counter()
+            result = await vectorizer.vectorize_document_async(item["path"], "bench", document_id)
+            elapsed = time.perf_counter() - started
+            if not result["success"]:
+                raise RuntimeError(f"Ingesting {item['name']} failed: {result['error']}")
+            ingest.append({
+                "file": item["name"],
+                "pages": item["pages"],
+                "bytes": item["bytes"],
+                "chunks": result["chunks_created"],
+                "seconds": round(elapsed, 3),
+                "chunks_per_second": round(result["chunks_created"] / elapsed, 1),
+                **rss_mb(),
+            })
+
+            samples = []
+            for _ in range(20):
+                started = time.perf_counter()
+                await loop.run_in_executor(
+                    vectorizer.executor, get_chroma_collections, "bench", document_id, vectorizer.chroma
+                )
+                samples.append(time.perf_counter() - started)
+            lookups.append({"file": item["name"], **percentiles(samples)})
+    finally:
+        vectorizer.shutdown()
+
+    return {
+        "ingest": ingest,
+        "get_chroma_collections": lookups,
+        "chroma_disk_bytes": directory_size(persist_directory),
+    }
+
+
+async def _wait_for_ingest(client, headers, doc_id: str, timeout: float) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        resp = await client.get(f"/api/documents/{doc_id}/status", headers=headers)
+        body = resp.json()
+        if body.get("status") in ("completed", "dead"):
+            return body
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"Document {doc_id} was not ingested within {timeout}s")
+
+
+async def bench_api(corpus: List[dict], chat_requests: int, concurrency: int, stream: bool) -> dict:
+    """Drive the FastAPI app in-process: upload, wait for ingestion, then chat"""
+    import httpx
+    import main
+    from database import mongo
+    from maintenance import directory_size
+
+    main.vectorizer.embeddings = HashingEmbeddings()
+    transport = httpx.ASGITransport(app=main.app)
+    report = {"uploads": [], "chat": {}}
+
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            credentials = {"username": "bench", "email": "bench@example.com", "password": "bench-password"}
+            await client.post("/auth/register", json=credentials)
+            token = (await client.post("/auth/login", json=credentials)).json()["token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            doc_ids = []
+            for item in corpus:
+                content_type = "application/pdf" if item["kind"] == "pdf" else "text/plain"
+                with open(item["path"], "rb") as f:
+                    data = f.read()
+                started = time.perf_counter()
+                resp = await client.post("/api/documents/upload", headers=headers,
+                                         files={"file": (item["name"], data, content_type)})
+                upload_seconds = time.perf_counter() - started
+                resp.raise_for_status()
+                doc_id = resp.json()["id"]
+                status = await _wait_for_ingest(client, headers, doc_id, timeout=600)
+                ingest_seconds = time.perf_counter() - started
+                doc_ids.append(doc_id)
+                report["uploads"].append({
+                    "file": item["name"],
+                    "upload_ms": round(upload_seconds * 1000, 2),
+                    "ingest_seconds": round(ingest_seconds, 3),
+                    "status": status["status"],
+                    "chunks": (status.get("result") or {}).get("chunks_created"),
+                })
+
+            # distinct questions so every request misses the answer cache
+            questions = [f"What does section {i % 50 + 1} say about PN-{1000 + i} and clause {i % 40 + 1}.2?"
+                         for i in range(chat_requests)]
+            slots = asyncio.Semaphore(concurrency)
+            latencies, errors = [], 0
+            chat_headers = {**headers, "Accept": "text/event-stream"} if stream else headers
+
+            async def ask(i: int):
+                nonlocal errors
+                async with slots:
+                    started = time.perf_counter()
+                    resp = await client.post(f"/api/chat/{doc_ids[i % len(doc_ids)]}", headers=chat_headers,
+                                             json={"role": "user", "text": questions[i]})
+                    await resp.aread()
+                    if resp.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(ask(i) for i in range(chat_requests)))
+            wall = time.perf_counter() - started
+            report["chat"] = {
+                "concurrency": concurrency,
+                "stream": stream,
+                "errors": errors,
+                "requests_per_second": round(len(latencies) / wall, 1) if wall else None,
+                **percentiles(latencies),
+            }
+
+            for doc_id in doc_ids:
+                await client.delete(f"/api/documents/{doc_id}", headers=headers)
+
+        report["chroma_disk_bytes"] = directory_size(main.vectorizer.persist_directory)
+        report.update(rss_mb())
+        await mongo.async_db.client.drop_database(mongo.db_name)
+    return report
+
+
+async def run(args, workdir: str) -> dict:
+    corpus = build_corpus(os.path.join(workdir, "corpus"), args.sizes, seed=args.seed)
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": {size: SIZES[size] for size in args.sizes},
+            "chat_requests": args.chat_requests,
+            "concurrency": args.concurrency,
+            "stub_first_token_ms": args.first_token_ms,
+            "stub_token_ms": args.token_ms,
+        },
+        "vectorizer": await bench_vectorizer(corpus, workdir),
+    }
+    if not args.skip_api:
+        results["api"] = await bench_api(corpus, args.chat_requests, args.concurrency, args.stream)
+    results.update(rss_mb())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingest and chat benchmarks")
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZES), default=["small", "medium"])
+    parser.add_argument("--chat-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stream", action="store_true", help="measure the SSE chat path")
+    parser.add_argument("--first-token-ms", type=float, default=0.0, help="stub model delay before answering")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="stub model delay per streamed word")
+    parser.add_argument("--skip-api", action="store_true", help="only benchmark the vectorizer (no Mongo needed)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    with StubServer(args.first_token_ms, args.token_ms) as base_url:
+        # main.py reads its configuration at import time, so set it before importing
+        os.environ.update({
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": base_url,
+            "MONGO_DB_NAME": f"bench_{uuid.uuid4().hex[:8]}",
+            "JWT_SECRET_KEY": "bench-secret",
+            "ALGORITHM": "HS256",
+            "INGEST_EMBEDDED_WORKERS": os.environ.get("INGEST_EMBEDDED_WORKERS", "2"),
+            "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite"),
+            "LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical_index"),
+        })
+        # the app keeps Chroma in ./chroma_db
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_ROOT)
+        try:
+            results = asyncio.run(run(args, workdir))
+        finally:
+            os.chdir(REPO_ROOT)
+            if not args.keep_workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
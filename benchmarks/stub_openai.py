@@ -0,0 +1,121 @@
+"""Minimal OpenAI-compatible server for chat completions and embeddings.
+
+Answers are canned and delays are configurable, so chat latency measurements
+reflect the app rather than a remote model. Point the app at it with
+``OPENAI_BASE_URL=http://127.0.0.1:<port>/v1``.
+"""
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from benchmarks.fakes import hashing_embedding
+
+ANSWER = ("Based on the document, the requested section describes the procedure, "
+          "the part numbers involved and the clauses that apply.")
+
+
+def create_app(first_token_ms: float = 0.0, token_ms: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    words = ANSWER.split(" ")
+
+    def completion_chunk(model: str, delta: dict, finish_reason=None) -> str:
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        await asyncio.sleep(first_token_ms / 1000)
+
+        if body.get("stream"):
+            async def stream():
+                yield completion_chunk(model, {"role": "assistant", "content": ""})
+                for i, word in enumerate(words):
+                    if token_ms:
+                        await asyncio.sleep(token_ms / 1000)
+                    yield completion_chunk(model, {"content": word if i == 0 else " " + word})
+                yield completion_chunk(model, {}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        await asyncio.sleep(token_ms * len(words) / 1000)
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or 256
+        data = [
+            {"object": "embedding", "index": i,
+             "embedding": hashing_embedding(item if isinstance(item, str) else " ".join(map(str, item)), dimensions)}
+            for i, item in enumerate(inputs)
+        ]
+        return {"object": "list", "data": data, "model": body.get("model", "stub"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubServer:
+    """Runs the stub in a background thread: ``with StubServer() as base_url: ...``"""
+
+    def __init__(self, first_token_ms: float = 0.0, token_ms: float = 0.0, port: int = None):
+        self.port = port or _free_port()
+        config = uvicorn.Config(create_app(first_token_ms, token_ms), host="127.0.0.1",
+                                port=self.port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def __enter__(self) -> str:
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self.base_url
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the stub OpenAI API")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--first-token-ms", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.first_token_ms, args.token_ms), host="127.0.0.1", port=args.port)
@@ -0,0 +1,175 @@
+"""Recall against memory for truncated and quantized embeddings.
+
+Chunks a local corpus with the collection chunkers, embeds it once at full width
+and then, for every dimension and quantization setting, measures recall@k of the
+compact search against exact full-precision search, with and without rescoring,
+next to the bytes stored per vector::
+
+    python -m benchmarks.vector_eval docs/ --dimensions 0 1024 512 256 --output vectors.json
+
+Without paths a synthetic corpus is generated. ``--offline`` uses hashing embeddings
+instead of text-embedding-3-large; those aren't trained for truncation, so use them
+to exercise the code, not to pick settings. Chroma's HNSW search is approximated
+by exact search over the stored vectors.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.run import percentiles
+from chunking import STRATEGIES, ChunkingConfig, _corpus_files, _load_documents, build_chunker, split_sentences
+from compact_vectors import QUANTIZATIONS, VectorConfig, VectorSegment, VectorSegmentBuilder, truncate
+
+FULL_DIMENSIONS = 3072
+
+
+def load_chunks(paths: List[str], config: ChunkingConfig) -> List[str]:
+    chunker = build_chunker(config)
+    texts = []
+    for path in _corpus_files(paths):
+        texts.extend(chunk.page_content for chunk in chunker.split_documents(_load_documents(path)))
+    return list(dict.fromkeys(texts))
+
+
+def sample_queries(texts: List[str], count: int, seed: int) -> List[str]:
+    """Sentences picked from the chunks, standing in for questions about them"""
+    rng = random.Random(seed)
+    sentences = [s for text in texts for s in split_sentences(text) if len(s.split()) >= 5]
+    return rng.sample(sentences, min(count, len(sentences)))
+
+
+def embed(texts: List[str], offline: bool, batch_size: int = 256) -> np.ndarray:
+    if offline:
+        return np.asarray(HashingEmbeddings(FULL_DIMENSIONS).embed_documents(texts), dtype=np.float32)
+
+    from langchain_openai import OpenAIEmbeddings
+
+    from embedding_cache import EmbeddingCache
+
+    model = OpenAIEmbeddings(model="text-embedding-3-large")
+    cache = EmbeddingCache(path=os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite"))
+    keys = [EmbeddingCache.key(model.model, text) for text in texts]
+    cached = cache.get_many(keys)
+    missing = [(key, text) for key, text in zip(keys, texts) if key not in cached]
+    for start in range(0, len(missing), batch_size):
+        part = missing[start:start + batch_size]
+        fresh = dict(zip([key for key, _ in part], model.embed_documents([text for _, text in part])))
+        cache.put_many(fresh)
+        cached.update(fresh)
+    return np.asarray([cached[key] for key in keys], dtype=np.float32)
+
+
+def top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> List[int]:
+    # unit vectors: largest dot product is smallest squared L2 distance
+    scores = vectors @ query
+    return np.argsort(-scores, kind="stable")[:k].tolist()
+
+
+def recall(found: List[List[int]], truth: List[List[int]]) -> float:
+    return round(float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])), 4)
+
+
+def segment_bytes(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def stored_bytes(config: VectorConfig) -> Dict[str, int]:
+    """Bytes per vector in Chroma (float32) and in the scanned codes"""
+    dimensions = config.dimensions or FULL_DIMENSIONS
+    codes = {"none": 0, "int8": dimensions + 4, "binary": dimensions // 8}[config.quantization]
+    return {"index_bytes": dimensions * 4, "code_bytes": codes}
+
+
+def evaluate(vectors: np.ndarray, queries: np.ndarray, config: VectorConfig, k: int, workdir: str) -> dict:
+    ids = [str(i) for i in range(len(vectors))]
+    path = os.path.join(workdir, f"{config.dimensions}-{config.quantization}")
+    builder = VectorSegmentBuilder(config)
+    builder.add(ids, vectors)
+    builder.write(path)
+    segment = VectorSegment(path)
+
+    truth = [top_k(vectors, query, k) for query in queries]
+    stored = truncate(vectors, config.dimensions)
+    approx, rescored, timings = [], [], []
+    for query in queries:
+        started = time.perf_counter()
+        if segment.codes is not None:
+            hits = segment.search(query, k, config.rescore_factor)
+            timings.append(time.perf_counter() - started)
+            rescored.append([int(chunk_id) for chunk_id, _ in hits])
+            # one candidate per result: the codes alone decide which chunks are found
+            approx.append([int(chunk_id) for chunk_id, _ in segment.search(query, k, rescore_factor=1)])
+        else:
+            candidates = top_k(stored, truncate(query, config.dimensions), k * config.rescore_factor)
+            distances = segment.rescore(query, [ids[i] for i in candidates])
+            rescored.append([candidates[i] for i in np.argsort(distances, kind="stable")[:k]])
+            timings.append(time.perf_counter() - started)
+            approx.append(candidates[:k])
+
+    resident = stored.nbytes if segment.codes is None else segment.codes.nbytes + \
+        (segment.scales.nbytes if segment.scales is not None else 0)
+    return {
+        "dimensions": config.dimensions or FULL_DIMENSIONS,
+        "quantization": config.quantization,
+        "rescore_factor": config.rescore_factor,
+        f"recall@{k}": recall(approx, truth),
+        f"recall@{k}_rescored": recall(rescored, truth),
+        **stored_bytes(config),
+        "resident_mb": round(resident / 1e6, 3),
+        "sidecar_disk_mb": round(segment_bytes(path) / 1e6, 3),
+        "query": percentiles(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and memory of compact vector settings")
+    parser.add_argument("paths", nargs="*", help="PDF/TXT files or directories (default: synthetic corpus)")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="recursive")
+    parser.add_argument("--dimensions", nargs="+", type=int, default=[0, 1024, 512, 256])
+    parser.add_argument("--quantization", nargs="+", choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--offline", action="store_true", help="hashing embeddings instead of OpenAI")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="vector-eval-results.json")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="vector-eval-")
+    try:
+        paths = args.paths or [os.path.join(workdir, "corpus")]
+        if not args.paths:
+            build_corpus(paths[0], ["small", "medium"], seed=args.seed)
+        texts = load_chunks(paths, ChunkingConfig.for_strategy(args.strategy))
+        queries = sample_queries(texts, args.queries, args.seed)
+        vectors = truncate(embed(texts, args.offline))
+        query_vectors = truncate(embed(queries, args.offline))
+
+        results = []
+        for dimensions in args.dimensions:
+            for quantization in args.quantization:
+                if quantization == "binary" and dimensions % 8:
+                    continue
+                config = VectorConfig(dimensions, quantization, args.rescore_factor)
+                results.append(evaluate(vectors, query_vectors, config, args.k, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"chunks": len(texts), "queries": len(queries), "k": args.k,
+              "embeddings": "hashing" if args.offline else "text-embedding-3-large", "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""Chunking strategies and their per-collection configuration.
+
+Strategies:
+
+- ``recursive``: character-length recursive splitting (the original behaviour;
+  ``chunk_size``/``chunk_overlap`` are characters)
+- ``token``: recursive splitting measured in o200k_base tokens
+- ``pdf_section``: keeps each page's sections, paragraphs and tables whole, packs
+  small sections together up to ``chunk_size`` tokens and never crosses a page
+- ``sentence_window``: embeds short runs of sentences and stores ``window``
+  neighbouring sentences on each side in the ``window`` metadata field, which the
+  context builder sends to the model instead of the matched sentences
+
+A collection's configuration is stored in its Chroma metadata, so every document
+in it is chunked the same way and re-ingestion keeps stable chunk ids. Compare
+strategies on a corpus before changing one::
+
+    python chunking.py report docs/ --strategy recursive token pdf_section
+    python chunking.py set tenant_ab12cd34ef56ab78_0 --strategy pdf_section
+"""
+import argparse
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+STRATEGIES = ("recursive", "token", "pdf_section", "sentence_window")
+
+# (chunk_size, chunk_overlap) per strategy when not configured
+DEFAULT_SIZES = {
+    "recursive": (1000, 200),
+    "token": (512, 64),
+    "pdf_section": (512, 64),
+    "sentence_window": (128, 0),
+}
+
+METADATA_PREFIX = "chunking_"
+
+_token_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count for the chat model (gpt-4o family uses o200k_base)"""
+    global _token_encoding
+    if _token_encoding is None:
+        _token_encoding = tiktoken.get_encoding("o200k_base")
+    return len(_token_encoding.encode(text))
+
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|\n|$)")
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """(start, end) of every non-blank sentence, with surrounding whitespace excluded"""
+    spans = []
+    for match in _SENTENCE_RE.finditer(text):
+        start, end = match.span()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def split_sentences(text: str) -> List[str]:
+    return [text[start:end] for start, end in sentence_spans(text)]
+
+
+@dataclass(frozen=True)
+class ChunkingConfig:
+    strategy: str = "recursive"
+    chunk_size: int = 1000
+    chunk_overlap: int = 200
+    window: int = 3
+
+    def __post_init__(self):
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy {self.strategy!r}; use one of {', '.join(STRATEGIES)}")
+        if self.chunk_size < 1:
+            raise ValueError(f"Chunk size must be positive, got {self.chunk_size}")
+        if not 0 <= self.chunk_overlap < self.chunk_size:
+            raise ValueError(f"Chunk overlap must be at least 0 and smaller than the chunk size "
+                             f"({self.chunk_size}), got {self.chunk_overlap}")
+        if self.window < 0:
+            raise ValueError(f"Window must be at least 0, got {self.window}")
+
+    @classmethod
+    def for_strategy(cls, strategy: str, chunk_size: Optional[int] = None,
+                     chunk_overlap: Optional[int] = None, window: Optional[int] = None) -> "ChunkingConfig":
+        default_size, default_overlap = DEFAULT_SIZES.get(strategy, (None, None))
+        chunk_size = chunk_size or default_size
+        if chunk_overlap is None and default_overlap is not None:
+            # smaller chunks than the default keep the default's share of overlap
+            chunk_overlap = min(default_overlap, default_overlap * chunk_size // default_size)
+        return cls(
+            strategy=strategy,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            window=3 if window is None else window,
+        )
+
+    @classmethod
+    def from_env(cls) -> "ChunkingConfig":
+        """Configuration for collections that don't have one yet"""
+        size, overlap, window = (os.getenv(name) for name in ("CHUNK_SIZE", "CHUNK_OVERLAP", "CHUNK_WINDOW"))
+        return cls.for_strategy(
+            os.getenv("CHUNK_STRATEGY", "recursive"),
+            chunk_size=int(size) if size else None,
+            chunk_overlap=int(overlap) if overlap else None,
+            window=int(window) if window else None,
+        )
+
+    @classmethod
+    def from_metadata(cls, metadata: Optional[dict]) -> Optional["ChunkingConfig"]:
+        if not metadata or f"{METADATA_PREFIX}strategy" not in metadata:
+            return None
+        return cls(**{field: metadata[f"{METADATA_PREFIX}{field}"] for field in asdict(cls()).keys()
+                      if f"{METADATA_PREFIX}{field}" in metadata})
+
+    def to_metadata(self) -> dict:
+        return {f"{METADATA_PREFIX}{field}": value for field, value in asdict(self).items()}
+
+
+# collections that already hold chunks but predate per-collection settings
+LEGACY_CHUNKING = ChunkingConfig()
+
+
+def _recursive_splitter(config: ChunkingConfig, by_tokens: bool) -> RecursiveCharacterTextSplitter:
+    if by_tokens:
+        return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name="o200k_base",
+            chunk_size=config.chunk_size,
+            chunk_overlap=config.chunk_overlap,
+            add_start_index=True,
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=config.chunk_size,
+        chunk_overlap=config.chunk_overlap,
+        length_function=len,
+        # start_index lets the context builder merge overlapping neighbours by position
+        add_start_index=True,
+    )
+
+
+_NUMBERED_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.)\s+[A-Z]")
+_KEYWORD_HEADING_RE = re.compile(r"^(?i:chapter|section|part|appendix|article|annex)\s+(?:\d+|[IVXLC]+|[A-Z])\b")
+_TABLE_LINE_RE = re.compile(r"\S(?: {2,}|\t)\S.*\S(?: {2,}|\t)\S|\|.*\|")
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    if not 3 <= len(line) <= 100:
+        return False
+    if _KEYWORD_HEADING_RE.match(line):
+        return True
+    if line.endswith((".", ",", ";", ":")):
+        return False
+    if _NUMBERED_HEADING_RE.match(line):
+        return True
+    return line.isupper() and any(ch.isalpha() for ch in line)
+
+
+def is_table_line(line: str) -> bool:
+    return bool(_TABLE_LINE_RE.search(line))
+
+
+class SectionChunker:
+    """Page- and section-aware chunks for PDFs (plain text works too).
+
+    Each page is cut into blocks: paragraphs, runs of table rows and headings,
+    which start a new section. Consecutive sections are packed into one chunk while
+    they fit ``chunk_size`` tokens; a longer section is packed block by block, and a
+    block longer than a whole chunk falls back to token splitting.
+    """
+
+    def __init__(self, config: ChunkingConfig):
+        self.config = config
+        self._fallback = _recursive_splitter(config, by_tokens=True)
+
+    def _blocks(self, text: str) -> List[dict]:
+        """Split a page into paragraph, table and heading blocks with their offsets"""
+        blocks = []
+        offset = 0
+        for line in text.splitlines(keepends=True):
+            start, end = offset, offset + len(line)
+            offset = end
+            stripped = line.strip()
+            if not stripped:
+                if blocks:
+                    blocks[-1]["closed"] = True
+                continue
+            kind = "heading" if is_heading(stripped) else "table" if is_table_line(line) else "text"
+            previous = blocks[-1] if blocks else None
+            if (previous is not None and not previous["closed"] and previous["kind"] == kind
+                    and kind != "heading"):
+                previous["end"] = start + len(line.rstrip())
+                continue
+            blocks.append({"start": start + (len(line) - len(line.lstrip())), "end": start + len(line.rstrip()),
+                           "kind": kind, "closed": kind == "heading"})
+        return blocks
+
+    def _sections(self, text: str) -> List[dict]:
+        sections = []
+        for block in self._blocks(text):
+            if block["kind"] == "heading" or not sections:
+                heading = text[block["start"]:block["end"]] if block["kind"] == "heading" else None
+                sections.append({"heading": heading, "blocks": []})
+            sections[-1]["blocks"].append(block)
+        return sections
+
+    def _emit(self, page: Document, text: str, start: int, end: int, section: Optional[str],
+              chunks: List[Document]) -> None:
+        content = text[start:end]
+        if count_tokens(content) <= self.config.chunk_size:
+            metadata = {**page.metadata, "start_index": start}
+            if section:
+                metadata["section"] = section
+            chunks.append(Document(page_content=content, metadata=metadata))
+            return
+        for piece in self._fallback.split_documents([Document(page_content=content, metadata=page.metadata)]):
+            piece.metadata["start_index"] += start
+            if section:
+                piece.metadata["section"] = section
+            chunks.append(piece)
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks: List[Document] = []
+        limit = self.config.chunk_size
+        for page in documents:
+            text = page.page_content
+            # pending run of text: (start, end, tokens, section heading)
+            run: Optional[list] = None
+            for section in self._sections(text):
+                start, end = section["blocks"][0]["start"], section["blocks"][-1]["end"]
+                tokens = count_tokens(text[start:end])
+                if run is not None and run[2] + tokens <= limit:
+                    run[1], run[2] = end, run[2] + tokens
+                    continue
+                if run is not None:
+                    self._emit(page, text, run[0], run[1], run[3], chunks)
+                    run = None
+                if tokens <= limit:
+                    run = [start, end, tokens, section["heading"]]
+                    continue
+                # a long section: pack its blocks, keeping paragraphs and tables whole
+                for block in section["blocks"]:
+                    block_tokens = count_tokens(text[block["start"]:block["end"]])
+                    if run is not None and run[2] + block_tokens <= limit:
+                        run[1], run[2] = block["end"], run[2] + block_tokens
+                        continue
+                    if run is not None:
+                        self._emit(page, text, run[0], run[1], run[3], chunks)
+                    run = [block["start"], block["end"], block_tokens, section["heading"]]
+            if run is not None:
+                self._emit(page, text, run[0], run[1], run[3], chunks)
+        return chunks
+
+
+class SentenceWindowChunker:
+    """Chunks of consecutive sentences up to ``chunk_size`` tokens.
+
+    Each chunk carries the surrounding ``window`` sentences on either side in its
+    ``window`` metadata (and their offset in ``window_start``): the small chunk
+    gives a precise embedding, the window gives the model enough context.
+    """
+
+    def __init__(self, config: ChunkingConfig):
+        self.config = config
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks: List[Document] = []
+        for page in documents:
+            text = page.page_content
+            spans = sentence_spans(text)
+            first = 0
+            while first < len(spans):
+                last, tokens = first, count_tokens(text[spans[first][0]:spans[first][1]])
+                while last + 1 < len(spans):
+                    next_tokens = count_tokens(text[spans[last + 1][0]:spans[last + 1][1]])
+                    if tokens + next_tokens > self.config.chunk_size:
+                        break
+                    last, tokens = last + 1, tokens + next_tokens
+                window_first = max(0, first - self.config.window)
+                window_last = min(len(spans) - 1, last + self.config.window)
+                chunks.append(Document(
+                    page_content=text[spans[first][0]:spans[last][1]],
+                    metadata={
+                        **page.metadata,
+                        "start_index": spans[first][0],
+                        "window": text[spans[window_first][0]:spans[window_last][1]],
+                        "window_start": spans[window_first][0],
+                    },
+                ))
+                first = last + 1
+        return chunks
+
+
+def build_chunker(config: ChunkingConfig):
+    """Object with ``split_documents(documents) -> chunks`` for ``config``"""
+    if config.strategy == "recursive":
+        return _recursive_splitter(config, by_tokens=False)
+    if config.strategy == "token":
+        return _recursive_splitter(config, by_tokens=True)
+    if config.strategy == "pdf_section":
+        return SectionChunker(config)
+    return SentenceWindowChunker(config)
+
+
+# text-embedding-3-large list price and vector width
+EMBEDDING_PRICE_PER_MILLION = float(os.getenv("EMBEDDING_PRICE_PER_MILLION", "0.13"))
+EMBEDDING_DIMENSIONS = 3072
+
+
+def _load_documents(path: Path) -> List[Document]:
+    if path.suffix.lower() == ".pdf":
+        from pdf_pages import extract_page_range, pdf_page_count
+        total_pages = pdf_page_count(str(path))
+        return [Document(page_content=text, metadata={"source": str(path), "page": page_number,
+                                                      "total_pages": total_pages})
+                for page_number, text in extract_page_range(str(path), 0, total_pages)]
+    return [Document(page_content=path.read_text(encoding="utf-8"), metadata={"source": str(path)})]
+
+
+def _corpus_files(paths: List[str]) -> List[Path]:
+    files = []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in (".pdf", ".txt")))
+        else:
+            files.append(path)
+    return files
+
+
+def _distribution(values: List[int]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p: float) -> int:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {"min": ordered[0], "p50": rank(50), "p95": rank(95), "max": ordered[-1],
+            "mean": round(sum(ordered) / len(ordered), 1)}
+
+
+def chunk_report(paths: List[str], configs: List[ChunkingConfig],
+                 price_per_million: float = EMBEDDING_PRICE_PER_MILLION) -> List[dict]:
+    """Chunk count, token distribution and embedding cost of a corpus under each config"""
+    documents = {path: _load_documents(path) for path in _corpus_files(paths)}
+    reports = []
+    for config in configs:
+        chunker = build_chunker(config)
+        sizes, distinct = [], set()
+        for pages in documents.values():
+            for chunk in chunker.split_documents([Document(page_content=p.page_content, metadata=dict(p.metadata))
+                                                  for p in pages]):
+                sizes.append(count_tokens(chunk.page_content))
+                distinct.add(chunk.page_content)
+        embedded_tokens = sum(sizes)
+        reports.append({
+            "config": asdict(config),
+            "files": len(documents),
+            "chunks": len(sizes),
+            # identical chunk texts share one embedding through the embedding cache
+            "distinct_chunks": len(distinct),
+            "chunk_tokens": _distribution(sizes),
+            "embedded_tokens": embedded_tokens,
+            "estimated_cost_usd": round(embedded_tokens / 1_000_000 * price_per_million, 4),
+            "estimated_vector_bytes": len(sizes) * EMBEDDING_DIMENSIONS * 4,
+        })
+    return reports
+
+
+def _print_reports(reports: List[dict]) -> None:
+    header = f"{'strategy':<16}{'size':>6}{'overlap':>8}{'chunks':>9}{'p50 tok':>9}{'p95 tok':>9}" \
+             f"{'tokens':>11}{'cost $':>10}{'vectors MB':>12}"
+    print(header)
+    for report in reports:
+        config, dist = report["config"], report["chunk_tokens"]
+        print(f"{config['strategy']:<16}{config['chunk_size']:>6}{config['chunk_overlap']:>8}"
+              f"{report['chunks']:>9}{dist.get('p50', 0):>9}{dist.get('p95', 0):>9}"
+              f"{report['embedded_tokens']:>11}{report['estimated_cost_usd']:>10.4f}"
+              f"{report['estimated_vector_bytes'] / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Compare chunking strategies and manage collection settings")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report_cmd = commands.add_parser("report", help="chunk a corpus and estimate embedding cost")
+    report_cmd.add_argument("paths", nargs="+", help="PDF/TXT files or directories")
+    report_cmd.add_argument("--strategy", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+    report_cmd.add_argument("--json", action="store_true")
+
+    show_cmd = commands.add_parser("show", help="print a collection's chunking settings")
+    show_cmd.add_argument("collection")
+
+    set_cmd = commands.add_parser("set", help="store chunking settings on a collection")
+    set_cmd.add_argument("collection")
+    set_cmd.add_argument("--strategy", choices=STRATEGIES, required=True)
+
+    for cmd in (show_cmd, set_cmd):
+        cmd.add_argument("--chroma-path", default="./chroma_db")
+
+    for cmd in (report_cmd, set_cmd):
+        cmd.add_argument("--chunk-size", type=int)
+        cmd.add_argument("--chunk-overlap", type=int)
+        cmd.add_argument("--window", type=int)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        try:
+            configs = [ChunkingConfig.for_strategy(s, args.chunk_size, args.chunk_overlap, args.window)
+                       for s in args.strategy]
+        except ValueError as e:
+            parser.error(str(e))
+        reports = chunk_report(args.paths, configs)
+        if args.json:
+            print(json.dumps(reports, indent=2))
+        else:
+            _print_reports(reports)
+    else:
+        from vectorizer import get_chroma_registry
+
+        if args.command == "set":
+            # validate before anything is written to the collection
+            try:
+                new_config = ChunkingConfig.for_strategy(args.strategy, args.chunk_size, args.chunk_overlap,
+                                                         args.window)
+            except ValueError as e:
+                parser.error(str(e))
+        chroma = get_chroma_registry(args.chroma_path)
+        if args.command == "set":
+            chroma.set_chunking_config(args.collection, new_config)
+        config = chroma.get_chunking_config(args.collection)
+        print(json.dumps(asdict(config) if config else None, indent=2))
+        chroma.close()
@@ -0,0 +1,245 @@
+"""Compact vector storage: Matryoshka-truncated and quantized embeddings.
+
+text-embedding-3 vectors keep most of their quality when cut to a prefix and
+rescaled to unit length, so a collection can keep e.g. 256 of the 3072 dimensions
+in Chroma (1 KB instead of 12 KB per chunk, and a smaller, faster HNSW graph).
+Precision is recovered by rescoring: the full vectors of every document are kept
+in a sidecar segment ``{root}/{collection}/{document_id}/`` and only the rows of the
+top candidates are read.
+
+With quantization the segment also holds int8 or binary codes of the stored
+vectors, and per-document search scans the codes instead of querying Chroma:
+
+- ``vectors.npy``: full-dimension float32 vectors (memory-mapped, read for candidates only)
+- ``codes.npy``: int8 codes, or sign bits packed 8 per byte for binary
+- ``scales.npy``: per-vector scale of the int8 codes
+- ``meta.json``: chunk ids in row order, dimensions and quantization
+"""
+import json
+import os
+import threading
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lexical_index import SegmentStore, swap_directory
+
+QUANTIZATIONS = ("none", "int8", "binary")
+
+METADATA_PREFIX = "vectors_"
+
+
+@dataclass(frozen=True)
+class VectorConfig:
+    dimensions: int = 0  # 0 keeps every dimension
+    quantization: str = "none"
+    rescore_factor: int = 4  # candidates fetched per result before full-precision rescoring
+
+    def __post_init__(self):
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {self.quantization!r}; use one of {', '.join(QUANTIZATIONS)}")
+        if self.quantization == "binary" and self.dimensions % 8:
+            raise ValueError("Binary quantization needs a dimension count divisible by 8")
+
+    @property
+    def compact(self) -> bool:
+        return self.dimensions > 0 or self.quantization != "none"
+
+    @classmethod
+    def from_env(cls) -> "VectorConfig":
+        """Configuration for collections that don't have one yet"""
+        return cls(
+            dimensions=int(os.getenv("VECTOR_DIMENSIONS", "0")),
+            quantization=os.getenv("VECTOR_QUANTIZATION", "none"),
+            rescore_factor=int(os.getenv("VECTOR_RESCORE_FACTOR", "4")),
+        )
+
+    @classmethod
+    def from_metadata(cls, metadata: Optional[dict]) -> Optional["VectorConfig"]:
+        if not metadata or f"{METADATA_PREFIX}dimensions" not in metadata:
+            return None
+        return cls(**{field: metadata[f"{METADATA_PREFIX}{field}"] for field in asdict(cls()).keys()
+                      if f"{METADATA_PREFIX}{field}" in metadata})
+
+    def to_metadata(self) -> dict:
+        return {f"{METADATA_PREFIX}{field}": value for field, value in asdict(self).items()}
+
+
+def truncate(vectors, dimensions: int = 0) -> np.ndarray:
+    """Keep the first ``dimensions`` values (all when 0) and rescale to unit length"""
+    array = np.asarray(vectors, dtype=np.float32)
+    if dimensions:
+        array = array[..., :dimensions]
+    norms = np.linalg.norm(array, axis=-1, keepdims=True)
+    return array / np.where(norms == 0, 1, norms)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 codes and the scale that maps them back"""
+    scales = np.abs(vectors).max(axis=-1) / 127
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    codes = np.round(vectors / scales[..., None]).astype(np.int8)
+    return codes, scales
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    return np.packbits(vectors > 0, axis=-1)
+
+
+def squared_l2(vectors: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Squared L2 distances, the metric Chroma collections use"""
+    diff = np.asarray(vectors, dtype=np.float32) - query
+    return np.einsum("ij,ij->i", diff, diff)
+
+
+class VectorSegmentBuilder:
+    """Collects full vectors during ingestion and writes them as one segment"""
+
+    def __init__(self, config: VectorConfig):
+        self.config = config
+        self.chunk_ids: List[str] = []
+        self._vectors: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def add(self, chunk_ids: List[str], vectors) -> None:
+        """Thread-safe: ingestion adds embedded batches from several executor threads"""
+        rows = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self.chunk_ids.extend(chunk_ids)
+            self._vectors.extend(rows)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def write(self, path: str) -> None:
+        """Write the segment to ``path``, replacing an existing one atomically"""
+        vectors = np.stack(self._vectors) if self._vectors else np.empty((0, 0), dtype=np.float32)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+        if self.config.quantization != "none" and len(vectors):
+            stored = truncate(vectors, self.config.dimensions)
+            if self.config.quantization == "int8":
+                codes, scales = quantize_int8(stored)
+                np.save(os.path.join(tmp_path, "scales.npy"), scales)
+            else:
+                codes = quantize_binary(stored)
+            np.save(os.path.join(tmp_path, "codes.npy"), codes)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({
+                "chunk_ids": self.chunk_ids,
+                "dimensions": self.config.dimensions,
+                "quantization": self.config.quantization,
+            }, f)
+        swap_directory(tmp_path, path)
+
+
+class VectorSegment:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.chunk_ids: List[str] = meta["chunk_ids"]
+        self.dimensions: int = meta["dimensions"]
+        self.quantization: str = meta["quantization"]
+        self.rows: Dict[str, int] = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.codes = self.scales = None
+        if self.quantization != "none" and self.chunk_ids:
+            # the codes are what a search scans, so they are loaded into memory
+            self.codes = np.load(os.path.join(path, "codes.npy"))
+            if self.quantization == "int8":
+                self.scales = np.load(os.path.join(path, "scales.npy"))
+
+    def _full_rows(self, rows: List[int]) -> np.ndarray:
+        order = np.argsort(rows)
+        block = np.asarray(self.vectors[np.asarray(rows)[order]], dtype=np.float32)
+        return block[np.argsort(order)]
+
+    def search(self, query_embedding, k: int, rescore_factor: int = 4) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, squared L2 distance) pairs: scan the codes, then rescore in full precision"""
+        if self.codes is None or k <= 0:
+            return []
+        query = truncate(query_embedding, self.dimensions)
+        if self.quantization == "int8":
+            # larger dot product means closer for unit vectors
+            approx = -(self.codes.astype(np.float32) @ query) * self.scales
+        else:
+            approx = np.unpackbits(np.bitwise_xor(self.codes, quantize_binary(query)), axis=-1).sum(axis=-1)
+        n_candidates = min(len(self.chunk_ids), k * max(1, rescore_factor))
+        candidates = np.argpartition(approx, n_candidates - 1)[:n_candidates] \
+            if n_candidates < len(self.chunk_ids) else np.arange(len(self.chunk_ids))
+        return self._rank(candidates.tolist(), query_embedding, k)
+
+    def rescore(self, query_embedding, chunk_ids: List[str]) -> List[Optional[float]]:
+        """Full-precision distances for ``chunk_ids`` (None for ids not in the segment)"""
+        rows = [self.rows.get(chunk_id) for chunk_id in chunk_ids]
+        known = [row for row in rows if row is not None]
+        if not known:
+            return [None] * len(chunk_ids)
+        distances = dict(zip(known, squared_l2(self._full_rows(known), truncate(query_embedding)).tolist()))
+        return [distances[row] if row is not None else None for row in rows]
+
+    def _rank(self, rows: List[int], query_embedding, k: int) -> List[Tuple[str, float]]:
+        distances = squared_l2(self._full_rows(rows), truncate(query_embedding))
+        best = np.argsort(distances, kind="stable")[:k]
+        return [(self.chunk_ids[rows[i]], float(distances[i])) for i in best]
+
+    def vectors_for(self, chunk_ids: List[str]) -> List[List[float]]:
+        return self._full_rows([self.rows[chunk_id] for chunk_id in chunk_ids]).tolist()
+
+    def all_vectors(self) -> Dict[str, np.ndarray]:
+        if not self.chunk_ids:
+            return {}
+        vectors = np.asarray(self.vectors, dtype=np.float32)
+        return {chunk_id: vectors[row] for chunk_id, row in self.rows.items()}
+
+
+class VectorIndex(SegmentStore):
+    """Full-precision (and optionally quantized) vectors of every compact document"""
+
+    segment_class = VectorSegment
+
+    def __init__(self, root: str = "./vector_index", max_open_segments: int = 256):
+        super().__init__(root, max_open_segments)
+
+    def load_vectors(self, collection_name: str, document_id: str) -> Dict[str, np.ndarray]:
+        """chunk id -> full vector of a document's current segment (empty if it has none)"""
+        segment = self.get(collection_name, document_id)
+        return segment.all_vectors() if segment else {}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Show or store a collection's vector settings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show_cmd = commands.add_parser("show", help="print a collection's vector settings")
+    set_cmd = commands.add_parser("set", help="store vector settings on a collection")
+    set_cmd.add_argument("--dimensions", type=int, default=0)
+    set_cmd.add_argument("--quantization", choices=QUANTIZATIONS, default="none")
+    set_cmd.add_argument("--rescore-factor", type=int, default=4)
+    for cmd in (show_cmd, set_cmd):
+        cmd.add_argument("collection")
+        cmd.add_argument("--chroma-path", default="./chroma_db")
+    args = parser.parse_args()
+
+    from vectorizer import get_chroma_registry
+
+    chroma = get_chroma_registry(args.chroma_path)
+    try:
+        if args.command == "set":
+            chroma.set_vector_config(
+                args.collection, VectorConfig(args.dimensions, args.quantization, args.rescore_factor)
+            )
+        config = chroma.get_vector_config(args.collection)
+        print(json.dumps(asdict(config) if config else None, indent=2))
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        chroma.close()
@@ -0,0 +1,201 @@
+"""Assemble the document context of a chat prompt within a token budget.
+
+Retrieved chunks overlap (the splitter repeats up to 200 characters between
+neighbours) and often repeat each other. ``ContextBuilder.build`` merges
+overlapping chunks of the same page back into one passage, drops passages that are
+near-duplicates of a more relevant one, and then adds passages in relevance order
+until the budget is used up. With ``compress`` enabled each passage is first cut
+down to its sentences that share the most terms with the question.
+"""
+import os
+from typing import Dict, List, Optional, Set
+
+from chunking import count_tokens, split_sentences
+from lexical_index import tokenize
+
+# shortest suffix/prefix match treated as splitter overlap when chunks have no start_index
+MIN_TEXT_OVERLAP = 20
+MAX_TEXT_OVERLAP = 400
+
+
+def _page_key(metadata: dict):
+    return metadata.get("document_id"), metadata.get("page")
+
+
+def _position(metadata: dict) -> Optional[int]:
+    if metadata.get("window"):
+        return metadata.get("window_start")
+    return metadata.get("start_index")
+
+
+def _shingles(text: str, size: int = 3) -> Set[tuple]:
+    words = tokenize(text)
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _containment(a: Set[tuple], b: Set[tuple]) -> float:
+    """Share of the smaller shingle set that also occurs in the other"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _text_overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of ``left`` that starts ``right``"""
+    for size in range(min(len(left), len(right), MAX_TEXT_OVERLAP), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def compress_text(text: str, query_terms: Set[str], max_tokens: int) -> str:
+    """Keep the sentences sharing most terms with the query, in their original order.
+
+    Sentences are taken by descending overlap (earlier first on ties) until
+    ``max_tokens`` is reached; at least one sentence is always kept.
+    """
+    sentences = split_sentences(text)
+    if len(sentences) <= 1:
+        return text
+    scored = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(query_terms.intersection(tokenize(sentences[i]))), i),
+    )
+    kept, used = [], 0
+    for i in scored:
+        tokens = count_tokens(sentences[i])
+        if kept and used + tokens > max_tokens:
+            continue
+        kept.append(i)
+        used += tokens
+    return " ".join(sentences[i] for i in sorted(kept))
+
+
+class ContextBuilder:
+    """Turns ranked retrieval hits into a deduplicated, budgeted prompt context"""
+
+    def __init__(self, token_budget: int = 2000, duplicate_threshold: float = 0.8,
+                 compress: bool = False, compression_ratio: float = 0.5):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.compress = compress
+        self.compression_ratio = compression_ratio
+
+    @classmethod
+    def from_env(cls) -> "ContextBuilder":
+        return cls(
+            token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000")),
+            duplicate_threshold=float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8")),
+            compress=os.getenv("CONTEXT_COMPRESSION", "false").lower() == "true",
+            compression_ratio=float(os.getenv("CONTEXT_COMPRESSION_RATIO", "0.5")),
+        )
+
+    def merge_overlapping(self, chunks: List[dict]) -> List[dict]:
+        """Join chunks that overlap on the same page into passages.
+
+        ``chunks`` are in relevance order. A passage keeps the rank of its best chunk
+        and lists every chunk it was built from. Chunks with a ``start_index`` are
+        merged by position; passages are then joined wherever the end of one
+        matches the start of another, which also covers chunks stored before
+        ``start_index`` was recorded.
+        """
+        by_page: Dict[tuple, List[dict]] = {}
+        for rank, chunk in enumerate(chunks):
+            by_page.setdefault(_page_key(chunk["metadata"]), []).append({**chunk, "rank": rank})
+
+        passages = []
+        for group in by_page.values():
+            positioned = [c for c in group if _position(c["metadata"]) is not None]
+            unpositioned = [c for c in group if _position(c["metadata"]) is None]
+
+            positioned.sort(key=lambda c: _position(c["metadata"]))
+            pending, current = [], None
+            for chunk in positioned:
+                start = _position(chunk["metadata"])
+                if current is not None and start <= current["end"]:
+                    end = start + len(chunk["content"])
+                    if end > current["end"]:
+                        current["content"] += chunk["content"][current["end"] - start:]
+                        current["end"] = end
+                    current["rank"] = min(current["rank"], chunk["rank"])
+                    current["chunks"].append(chunk)
+                    continue
+                current = {"content": chunk["content"], "rank": chunk["rank"], "chunks": [chunk],
+                           "end": start + len(chunk["content"])}
+                pending.append(current)
+
+            pending += [{"content": c["content"], "rank": c["rank"], "chunks": [c]} for c in unpositioned]
+            merged = True
+            while merged and len(pending) > 1:
+                merged = False
+                for left in pending:
+                    for right in pending:
+                        if left is right:
+                            continue
+                        overlap = _text_overlap(left["content"], right["content"])
+                        if overlap:
+                            left["content"] += right["content"][overlap:]
+                            left["rank"] = min(left["rank"], right["rank"])
+                            left["chunks"].extend(right["chunks"])
+                            pending.remove(right)
+                            merged = True
+                            break
+                    if merged:
+                        break
+            passages.extend(pending)
+
+        passages.sort(key=lambda p: p["rank"])
+        return passages
+
+    def drop_duplicates(self, passages: List[dict]) -> List[dict]:
+        """Remove passages mostly contained in a more relevant passage"""
+        kept, kept_shingles = [], []
+        for passage in passages:
+            shingles = _shingles(passage["content"])
+            if any(_containment(shingles, other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+            kept.append(passage)
+            kept_shingles.append(shingles)
+        return kept
+
+    def build(self, chunks: List[dict], query: str, token_budget: Optional[int] = None) -> dict:
+        """Return ``{full_content, chunks, context_tokens, input_tokens}`` for the ranked ``chunks``.
+
+        ``chunks`` are retrieval hits (``content`` and ``metadata``) in relevance order;
+        the returned ``chunks`` are the hits that made it into the context. Hits from
+        sentence-window collections contribute their surrounding window.
+        """
+        budget = token_budget or self.token_budget
+        chunks = [{**c, "content": c["metadata"]["window"]} if c["metadata"].get("window") else c
+                  for c in chunks]
+        input_tokens = sum(count_tokens(c["content"]) for c in chunks)
+        passages = self.drop_duplicates(self.merge_overlapping(chunks))
+        query_terms = set(tokenize(query))
+
+        texts, used_chunks, used_tokens = [], [], 0
+        for passage in passages:
+            text = passage["content"]
+            tokens = count_tokens(text)
+            if self.compress:
+                text = compress_text(text, query_terms, max(1, int(tokens * self.compression_ratio)))
+                tokens = count_tokens(text)
+            if used_tokens + tokens > budget:
+                if texts:
+                    continue
+                # the most relevant passage alone is over budget: keep its best sentences
+                text = compress_text(text, query_terms, budget)
+                tokens = count_tokens(text)
+            texts.append(text)
+            used_chunks.extend(sorted(passage["chunks"], key=lambda c: c["rank"]))
+            used_tokens += tokens
+
+        for chunk in used_chunks:
+            chunk.pop("rank", None)
+        return {
+            "full_content": "\n\n".join(texts),
+            "chunks": used_chunks,
+            "context_tokens": used_tokens,
+            "input_tokens": input_tokens,
+        }
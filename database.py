@@ -1,15 +1,120 @@
-from pymongo import MongoClient
+import logging
+import os
+import threading
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.database import Database
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+
+logger = logging.getLogger("database")
+
+
+def _client_options() -> dict:
+    """Pool and timeout settings shared by the async and compatibility sync clients"""
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000")),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+    }
+
+
+class MongoManager:
+    """Application-scoped MongoDB clients.
+
+    The async client serves the FastAPI handlers without blocking the event loop
+    and is created once (normally from the app lifespan) and reused by every
+    request. A sync client is only created on first use of ``db``, which is kept
+    for the ``connec_db`` compatibility wrapper.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def uri(self) -> str:
+        return os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+
+    @property
+    def db_name(self) -> str:
+        return os.getenv("MONGO_DB_NAME", "test")
+
+    def connect(self) -> None:
+        """Create the async client; connections are opened lazily by the pool"""
+        self.async_db
+
+    @property
+    def db(self) -> Database:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = MongoClient(self.uri, **_client_options())
+        return self._client[self.db_name]
+
+    @property
+    def async_db(self) -> AsyncDatabase:
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = AsyncMongoClient(self.uri, **_client_options())
+        return self._async_client[self.db_name]
+
+    # Typed collection accessors (async, for request handlers)
+    @property
+    def users(self) -> AsyncCollection:
+        return self.async_db["users"]
+
+    @property
+    def user_documents(self) -> AsyncCollection:
+        return self.async_db["user_documents"]
+
+    @property
+    def chat_history(self) -> AsyncCollection:
+        return self.async_db["chat_history"]
+
+    @property
+    def ingest_jobs(self) -> AsyncCollection:
+        return self.async_db["ingest_jobs"]
+
+    @property
+    def upload_sessions(self) -> AsyncCollection:
+        return self.async_db["upload_sessions"]
+
+    @property
+    def maintenance_reports(self) -> AsyncCollection:
+        return self.async_db["maintenance_reports"]
+
+    async def ping(self) -> bool:
+        try:
+            await self.async_db.command("ping")
+            return True
+        except Exception as e:
+            logger.error(f"MongoDB connection failed: {e}")
+            return False
+
+    async def close(self) -> None:
+        with self._lock:
+            client, async_client = self._client, self._async_client
+            self._client = None
+            self._async_client = None
+        if async_client is not None:
+            await async_client.close()
+        if client is not None:
+            client.close()
+
+
+mongo = MongoManager()
+
 
 def connec_db():
+    """Shared synchronous database handle (kept for existing callers)"""
     try:
-        # Replace with your MongoDB URI
-        client = MongoClient("mongodb://localhost:27017/")  
-        
-        # Select database
-        db = client["test"]
-        
-        print("✅ MongoDB connection successful")
-        return db
+        return mongo.db
     except Exception as e:
-        print(f"❌ MongoDB connection failed: {e}")
-        return None
\ No newline at end of file
+        logger.error(f"MongoDB connection failed: {e}")
+        return None
@@ -0,0 +1,159 @@
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from pymongo.asynchronous.collection import AsyncCollection
+
+from jobs import QUEUED, RUNNING, COMPLETED, DEAD
+from metrics import stage
+from routing import LEGACY_COLLECTION
+
+REGISTRY_FIELDS = {
+    "_id": 0, "document_id": 1, "user_id": 1, "filename": 1, "path": 1,
+    "collection": 1, "status": 1, "chunk_count": 1, "upload_date": 1,
+}
+
+
+def _with_defaults(record: dict) -> dict:
+    # rows written before the registry have no collection or status
+    record.setdefault("collection", LEGACY_COLLECTION)
+    record.setdefault("status", COMPLETED)
+    record.setdefault("chunk_count", None)
+    return record
+
+
+class DocumentRegistry:
+    """Authoritative doc_id -> owner/path/collection/status map backed by ``user_documents``.
+
+    Lookups hit a bounded in-process cache first, so existence and ownership checks
+    don't scan anything. Only documents whose ingestion has finished are cached, and
+    entries expire after ``ttl_seconds`` so deletes made by other processes are seen.
+    """
+
+    def __init__(self, collection: AsyncCollection, ttl_seconds: float = 30, max_entries: int = 10000):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls, collection: AsyncCollection) -> "DocumentRegistry":
+        return cls(
+            collection,
+            ttl_seconds=float(os.getenv("DOC_REGISTRY_TTL_SECONDS", "30")),
+            max_entries=int(os.getenv("DOC_REGISTRY_MAX_ENTRIES", "10000")),
+        )
+
+    def _remember(self, record: dict) -> None:
+        self._entries[record["document_id"]] = (time.time() + self.ttl_seconds, record)
+        self._entries.move_to_end(record["document_id"])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, doc_id: str) -> None:
+        self._entries.pop(doc_id, None)
+
+    async def get(self, doc_id: str) -> Optional[dict]:
+        cached = self._entries.get(doc_id)
+        if cached is not None:
+            expires_at, record = cached
+            if expires_at > time.time():
+                self._entries.move_to_end(doc_id)
+                return record
+            del self._entries[doc_id]
+        with stage("mongo.document_lookup"):
+            record = await self.collection.find_one({"document_id": doc_id}, REGISTRY_FIELDS)
+        if record is None:
+            return None
+        record = _with_defaults(record)
+        # in-flight statuses change under us, so only settled documents are cached
+        if record["status"] in (COMPLETED, DEAD):
+            self._remember(record)
+        return record
+
+    async def require(self, doc_id: str, user_id: str) -> dict:
+        """The user's document; 404 when it doesn't exist or belongs to someone else"""
+        record = await self.get(doc_id)
+        if record is None or record["user_id"] != user_id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+        return record
+
+    async def recent_collections(self, limit: int, scan: int = 1000) -> List[str]:
+        """Collections of the most recently uploaded documents, most recent first"""
+        names: List[str] = []
+        cursor = self.collection.find({}, {"_id": 0, "collection": 1}, sort=[("upload_date", -1)], limit=scan)
+        async for record in cursor:
+            name = record.get("collection", LEGACY_COLLECTION)
+            if name not in names:
+                names.append(name)
+                if len(names) >= limit:
+                    break
+        return names
+
+    async def register(self, doc_id: str, user_id: str, filename: str, path: str, collection_name: str) -> dict:
+        record = {
+            "id": str(uuid.uuid4()),
+            "document_id": doc_id,
+            "user_id": user_id,
+            "filename": filename,
+            "path": path,
+            "collection": collection_name,
+            "status": QUEUED,
+            "chunk_count": None,
+            "upload_date": datetime.now(),
+        }
+        await self.collection.insert_one(dict(record))
+        record.pop("id")
+        return record
+
+    async def remove(self, doc_id: str, user_id: str) -> Optional[dict]:
+        """Delete the user's row and return it, or None if there was nothing to delete"""
+        self.invalidate(doc_id)
+        record = await self.collection.find_one_and_delete({"document_id": doc_id, "user_id": user_id})
+        return _with_defaults(record) if record else None
+
+    async def replace_file(self, doc_id: str, filename: str, path: str, requeue: bool = True) -> None:
+        """Point the document at an updated upload and (by default) mark it for re-ingestion"""
+        update = {"filename": filename, "path": path}
+        if requeue:
+            update.update({"status": QUEUED, "status_updated_at": datetime.now()})
+        self.invalidate(doc_id)
+        await self.collection.update_one({"document_id": doc_id}, {"$set": update})
+
+    async def restore(self, record: dict, replaced_path: str) -> None:
+        """Undo ``replace_file`` with the earlier ``record``, unless the file was replaced again since"""
+        self.invalidate(record["document_id"])
+        await self.collection.update_one(
+            {"document_id": record["document_id"], "path": replaced_path},
+            {"$set": {"filename": record["filename"], "path": record.get("path"),
+                      "status": record["status"], "chunk_count": record["chunk_count"]}},
+        )
+
+    async def set_status(self, doc_id: str, new_status: str, chunk_count: Optional[int] = None,
+                         error: Optional[str] = None) -> bool:
+        """Record ingest progress; returns False when the document was deleted meanwhile"""
+        update = {"status": new_status, "status_updated_at": datetime.now()}
+        if chunk_count is not None:
+            update["chunk_count"] = chunk_count
+        if error is not None:
+            update["error"] = error
+        self.invalidate(doc_id)
+        resp = await self.collection.update_one({"document_id": doc_id}, {"$set": update})
+        return resp.matched_count == 1
+
+
+def is_ready(record: dict) -> bool:
+    # an updated document keeps serving its previous chunks while it is re-ingested
+    return record["status"] == COMPLETED or bool(record.get("chunk_count"))
+
+
+def not_ready_detail(record: dict) -> str:
+    if record["status"] == DEAD:
+        return "Document processing failed"
+    if record["status"] in (QUEUED, RUNNING):
+        return "Document is still being processed"
+    return f"Document is {record['status']}"
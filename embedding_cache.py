@@ -0,0 +1,119 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache stored in SQLite.
+
+    Keys are a hash of the model name and the chunk text, so identical chunks are
+    only embedded once per model. The file is shared by every process pointing at
+    the same path (WAL mode). The size is checked every ``evict_every`` inserted
+    vectors, and the least recently used rows are evicted once the cache holds more
+    than ``max_entries``.
+    """
+
+    def __init__(self, path: str = "./embedding_cache.sqlite", max_entries: int = 200_000,
+                 evict_every: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._local = threading.local()
+        # counters are updated from the vectorizer's worker threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # start due, so a cache left oversized by an earlier run is trimmed on the first insert
+        self._inserted = evict_every
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        conn = self._connection()
+        found: Dict[str, List[float]] = {}
+        # stay well below SQLite's bound parameter limit
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                             [(now, key) for key in found])
+            conn.commit()
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        conn = self._connection()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()],
+        )
+        conn.commit()
+        with self._lock:
+            self._inserted += len(items)
+            due = self._inserted >= self.evict_every
+            if due:
+                self._inserted = 0
+        if due:
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            conn.commit()
+
+    def stats(self) -> dict:
+        (count,) = self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {"entries": count, "max_entries": self.max_entries, "hits": hits, "misses": misses}
+
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
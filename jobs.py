@@ -0,0 +1,181 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.errors import DuplicateKeyError
+
+# Job states. "dead" is the dead-letter state for jobs that ran out of attempts.
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+DEAD = "dead"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobAlreadyActive(Exception):
+    """The document already has a queued or running ingest job"""
+
+
+class IngestJobQueue:
+    """Durable ingestion queue stored in the ``ingest_jobs`` Mongo collection.
+
+    Workers claim jobs atomically with ``find_one_and_update`` (highest priority
+    first, then oldest) and hold a lease that they renew while the job runs. A job
+    whose worker died is picked up again once its lease expires. Failures are
+    retried with exponential backoff until ``max_attempts`` is reached, after which
+    the job is parked in the dead-letter state.
+
+    A queued or running job carries ``active: true``, and a unique partial index on
+    ``document_id`` allows one such job per document, so two ingestions of the same
+    document never run at once.
+    """
+
+    def __init__(self, collection: AsyncCollection, max_attempts: int = 5,
+                 lease_seconds: int = 600, retry_base_seconds: int = 30):
+        self.collection = collection
+        self.max_attempts = max_attempts
+        self.lease = timedelta(seconds=lease_seconds)
+        self.retry_base_seconds = retry_base_seconds
+
+    async def enqueue(self, document_id: str, user_id: str, file_path: str, filename: str,
+                      collection_name: str = "default", priority: int = 0,
+                      file_hash: Optional[str] = None) -> dict:
+        now = _now()
+        job = {
+            "_id": str(uuid.uuid4()),
+            "document_id": document_id,
+            "user_id": user_id,
+            "file_path": file_path,
+            "filename": filename,
+            "collection": collection_name,
+            "file_hash": file_hash,
+            "priority": priority,
+            "status": QUEUED,
+            "active": True,
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "available_at": now,
+            "lease_expires_at": None,
+            "worker_id": None,
+            "created_at": now,
+            "updated_at": now,
+            "errors": [],
+        }
+        try:
+            await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            raise JobAlreadyActive(document_id)
+        return job
+
+    async def active_for_document(self, document_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"document_id": document_id, "status": {"$in": [QUEUED, RUNNING]}})
+
+    async def claim(self, worker_id: str) -> Optional[dict]:
+        """Atomically take the next runnable job, or a running job whose lease expired"""
+        now = _now()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "available_at": {"$lte": now}},
+                {"status": RUNNING, "lease_expires_at": {"$lt": now}},
+            ]},
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + self.lease,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", DESCENDING), ("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def renew_lease(self, job_id: str, worker_id: str) -> bool:
+        now = _now()
+        resp = await self.collection.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": RUNNING},
+            {"$set": {"lease_expires_at": now + self.lease, "updated_at": now}},
+        )
+        return resp.modified_count == 1
+
+    async def release(self, job_id: str, worker_id: str) -> bool:
+        """Hand a job this worker holds back to the queue at once, without counting the attempt"""
+        now = _now()
+        resp = await self.collection.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": RUNNING},
+            {"$set": {"status": QUEUED, "available_at": now, "lease_expires_at": None,
+                      "worker_id": None, "updated_at": now},
+             "$inc": {"attempts": -1}},
+        )
+        return resp.modified_count == 1
+
+    async def complete(self, job_id: str, result: dict) -> None:
+        await self.collection.update_one(
+            {"_id": job_id},
+            {"$set": {
+                "status": COMPLETED,
+                "result": {
+                    "chunks_created": result.get("chunks_created"),
+                    "collection": result.get("collection"),
+                    "reused_from": result.get("reused_from"),
+                    "chunks_embedded": result.get("chunks_embedded"),
+                    "chunks_removed": result.get("chunks_removed"),
+                    "chunks_per_second": result.get("chunks_per_second"),
+                },
+                "lease_expires_at": None,
+                "completed_at": _now(),
+                "updated_at": _now(),
+            }, "$unset": {"active": ""}},
+        )
+
+    async def fail(self, job: dict, error: str) -> str:
+        """Schedule a retry with backoff, or dead-letter the job; returns the new status"""
+        now = _now()
+        if job["attempts"] >= job.get("max_attempts", self.max_attempts):
+            new_status = DEAD
+            available_at = None
+        else:
+            new_status = QUEUED
+            available_at = now + timedelta(seconds=self.retry_base_seconds * 2 ** (job["attempts"] - 1))
+        update = {
+            "$set": {
+                "status": new_status,
+                "available_at": available_at,
+                "lease_expires_at": None,
+                "last_error": error,
+                "updated_at": now,
+            },
+            "$push": {"errors": {"attempt": job["attempts"], "error": error, "at": now}},
+        }
+        if new_status == DEAD:
+            update["$unset"] = {"active": ""}
+        await self.collection.update_one({"_id": job["_id"]}, update)
+        return new_status
+
+    async def get_for_document(self, document_id: str) -> Optional[dict]:
+        return await self.collection.find_one(
+            {"document_id": document_id}, sort=[("created_at", DESCENDING)]
+        )
+
+    async def completed_documents(self, file_hash: str, limit: int = 20) -> List[str]:
+        """Documents whose latest ingest job was for ``file_hash`` and completed"""
+        doc_ids = await self.collection.distinct("document_id", {"file_hash": file_hash, "status": COMPLETED})
+        completed = []
+        for doc_id in doc_ids[:limit]:
+            # a later job means the document was updated since, or is being re-ingested
+            latest = await self.get_for_document(doc_id)
+            if latest and latest["status"] == COMPLETED and latest.get("file_hash") == file_hash:
+                completed.append(doc_id)
+        return completed
+
+    async def counts(self) -> dict:
+        counts = {QUEUED: 0, RUNNING: 0, COMPLETED: 0, DEAD: 0}
+        async for row in await self.collection.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["n"]
+        return counts
@@ -0,0 +1,227 @@
+"""BM25 inverted index stored next to Chroma, one immutable segment per document.
+
+A segment is a directory ``{root}/{collection}/{document_id}/`` of flat numpy arrays:
+
+- ``terms.npy``: sorted uint64 term hashes
+- ``offsets.npy``: start of each term's postings (len(terms) + 1)
+- ``postings.npy``: chunk index of every posting (uint32)
+- ``freqs.npy``: term frequency of every posting (uint16)
+- ``lengths.npy``: token count of every chunk (uint32)
+- ``meta.json``: chunk ids in index order and the average chunk length
+
+The arrays are opened with ``mmap_mode="r"``, so a lookup is a binary search over
+``terms`` plus a scan of the matching postings, and only the pages touched are read.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words; compound tokens like ``AB-123.4`` are kept whole and split"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part)
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _hash_tokens(tokens: List[str]) -> np.ndarray:
+    return np.fromiter((term_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+
+
+class SegmentBuilder:
+    """Collects chunks during ingestion and writes them as one segment"""
+
+    def __init__(self):
+        self.chunk_ids: List[str] = []
+        self._hashes: List[np.ndarray] = []
+        self._lengths: List[int] = []
+        self._lock = threading.Lock()
+
+    def add(self, chunk_ids: List[str], texts: List[str]) -> None:
+        """Thread-safe: ingestion adds embedded batches from several executor threads"""
+        hashed = [_hash_tokens(tokenize(text)) for text in texts]
+        with self._lock:
+            for chunk_id, hashes in zip(chunk_ids, hashed):
+                self.chunk_ids.append(chunk_id)
+                self._hashes.append(hashes)
+                self._lengths.append(len(hashes))
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def write(self, path: str) -> None:
+        """Write the segment to ``path``, replacing an existing one atomically"""
+        hashes = np.concatenate(self._hashes) if self._hashes else np.empty(0, dtype=np.uint64)
+        if len(hashes):
+            chunks = np.repeat(np.arange(len(self._hashes), dtype=np.uint64), self._lengths)
+            # one posting per distinct (term, chunk) pair, sorted by term then chunk
+            pairs, freqs = np.unique(np.stack([hashes, chunks], axis=1), axis=0, return_counts=True)
+        else:
+            pairs, freqs = np.empty((0, 2), dtype=np.uint64), np.empty(0, dtype=np.int64)
+        terms, starts = np.unique(pairs[:, 0], return_index=True)
+        offsets = np.append(starts, len(pairs)).astype(np.int64)
+
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "terms.npy"), terms.astype(np.uint64))
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_path, "postings.npy"), pairs[:, 1].astype(np.uint32))
+        np.save(os.path.join(tmp_path, "freqs.npy"), np.minimum(freqs, np.iinfo(np.uint16).max).astype(np.uint16))
+        np.save(os.path.join(tmp_path, "lengths.npy"), np.asarray(self._lengths, dtype=np.uint32))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({
+                "chunk_ids": self.chunk_ids,
+                "avg_length": float(np.mean(self._lengths)) if self._lengths else 0.0,
+            }, f)
+        swap_directory(tmp_path, path)
+
+
+def swap_directory(tmp_path: str, path: str) -> None:
+    """Move a fully written segment directory into place, replacing an existing one"""
+    old_path = None
+    if os.path.exists(path):
+        old_path = f"{path}.old-{uuid.uuid4().hex}"
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if old_path:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+class Segment:
+    def __init__(self, path: str):
+        self.path = path
+        self.terms = np.load(os.path.join(path, "terms.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.postings = np.load(os.path.join(path, "postings.npy"), mmap_mode="r")
+        self.freqs = np.load(os.path.join(path, "freqs.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(path, "lengths.npy"), mmap_mode="r")
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.chunk_ids: List[str] = meta["chunk_ids"]
+        self.avg_length: float = meta["avg_length"] or 1.0
+
+    def search(self, query: str, k: int, k1: float = 1.2, b: float = 0.75) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, bm25 score) pairs for the query"""
+        n_chunks = len(self.chunk_ids)
+        if n_chunks == 0 or len(self.terms) == 0:
+            return []
+        query_hashes = np.unique(_hash_tokens(tokenize(query)))
+        positions = np.searchsorted(self.terms, query_hashes)
+        scores = np.zeros(n_chunks, dtype=np.float32)
+        norm = k1 * (1 - b + b * np.asarray(self.lengths, dtype=np.float32) / self.avg_length)
+        for term, pos in zip(query_hashes, positions):
+            if pos >= len(self.terms) or self.terms[pos] != term:
+                continue
+            start, end = int(self.offsets[pos]), int(self.offsets[pos + 1])
+            chunks = np.asarray(self.postings[start:end], dtype=np.int64)
+            tf = np.asarray(self.freqs[start:end], dtype=np.float32)
+            df = end - start
+            idf = np.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            scores[chunks] += idf * tf * (k1 + 1) / (tf + norm[chunks])
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.chunk_ids[i], float(scores[i])) for i in hits]
+
+
+class SegmentStore:
+    """Segments on disk plus a small LRU of opened (memory-mapped) segments.
+
+    Segments are written by the ingest workers and read by the API process, so a
+    cached segment is reopened when its ``meta.json`` changes on disk.
+    """
+
+    segment_class = None
+
+    def __init__(self, root: str, max_open_segments: int = 256):
+        self.root = root
+        self.max_open_segments = max_open_segments
+        self._open: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def segment_path(self, collection_name: str, document_id: str) -> str:
+        return os.path.join(self.root, collection_name, document_id)
+
+    def write(self, collection_name: str, document_id: str, builder) -> None:
+        path = self.segment_path(collection_name, document_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        builder.write(path)
+        self._forget(path)
+
+    def get(self, collection_name: str, document_id: str):
+        path = self.segment_path(collection_name, document_id)
+        try:
+            stat = os.stat(os.path.join(path, "meta.json"))
+        except FileNotFoundError:
+            self._forget(path)
+            return None
+        # a rewritten segment is a new meta.json file
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._open.get(path)
+            if cached and cached[0] == version:
+                self._open.move_to_end(path)
+                return cached[1]
+        segment = self.segment_class(path)
+        with self._lock:
+            self._open[path] = (version, segment)
+            self._open.move_to_end(path)
+            while len(self._open) > self.max_open_segments:
+                self._open.popitem(last=False)
+        return segment
+
+    def delete(self, collection_name: str, document_id: str) -> int:
+        """Remove a document's segment; returns the bytes freed"""
+        path = self.segment_path(collection_name, document_id)
+        self._forget(path)
+        freed = 0
+        if os.path.isdir(path):
+            freed = sum(entry.stat().st_size for entry in os.scandir(path))
+            shutil.rmtree(path, ignore_errors=True)
+        return freed
+
+    def _forget(self, path: str) -> None:
+        with self._lock:
+            self._open.pop(path, None)
+
+
+class LexicalIndex(SegmentStore):
+    """BM25 segments of every document"""
+
+    segment_class = Segment
+
+    def __init__(self, root: str = "./lexical_index", max_open_segments: int = 256):
+        super().__init__(root, max_open_segments)
+
+    def search(self, collection_name: str, document_id: str, query: str, k: int) -> List[Tuple[str, float]]:
+        segment = self.get(collection_name, document_id)
+        return segment.search(query, k) if segment else []
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> Dict[str, float]:
+    """Fuse ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return fused
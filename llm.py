@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_openai import ChatOpenAI
+
+from metrics import LLM_IN_FLIGHT
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    model: str
+    temperature: float
+    max_tokens: int
+
+
+# Profiles used by the app; one pooled client is kept per profile
+DOC_CHAT = ModelProfile(model="gpt-4o-mini", temperature=0.1, max_tokens=500)
+GENERAL_CHAT = ModelProfile(model="gpt-4o-mini", temperature=0.7, max_tokens=500)
+# Rolling summaries of older conversation turns
+SUMMARY = ModelProfile(model="gpt-4o-mini", temperature=0.0, max_tokens=300)
+
+
+class ChatModelRegistry:
+    """Shared ChatOpenAI clients backed by pooled httpx connections.
+
+    All profiles reuse the same keep-alive connection pools. ``slot()`` bounds the
+    number of in-flight completions and each profile can be rate limited on its own.
+    Point ``base_url`` at an OpenAI-compatible server to run against a local fake.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_connections: int = 100, max_keepalive_connections: int = 20,
+                 max_concurrency: int = 32, requests_per_second: Optional[float] = None,
+                 timeout: float = 60.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.timeout = timeout
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        self._models: Dict[ModelProfile, ChatOpenAI] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ChatModelRegistry":
+        rps = os.getenv("LLM_REQUESTS_PER_SECOND")
+        return cls(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            requests_per_second=float(rps) if rps else None,
+            timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
+        )
+
+    def start(self) -> None:
+        """Create the connection pools (called from the app lifespan)"""
+        with self._lock:
+            if self._http_async_client is None:
+                self._http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+                self._http_async_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def get(self, profile: ModelProfile) -> ChatOpenAI:
+        model = self._models.get(profile)
+        if model is None:
+            self.start()
+            with self._lock:
+                model = self._models.get(profile)
+                if model is None:
+                    rate_limiter = None
+                    if self.requests_per_second:
+                        rate_limiter = InMemoryRateLimiter(
+                            requests_per_second=self.requests_per_second,
+                            max_bucket_size=max(1, int(self.requests_per_second)),
+                        )
+                    model = ChatOpenAI(
+                        model=profile.model,
+                        temperature=profile.temperature,
+                        max_tokens=profile.max_tokens,
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        http_client=self._http_client,
+                        http_async_client=self._http_async_client,
+                        rate_limiter=rate_limiter,
+                    )
+                    self._models[profile] = model
+        return model
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the ``max_concurrency`` completion slots"""
+        self.start()
+        async with self._semaphore:
+            LLM_IN_FLIGHT.inc()
+            try:
+                yield
+            finally:
+                LLM_IN_FLIGHT.dec()
+
+    async def aclose(self) -> None:
+        with self._lock:
+            http_client, http_async_client = self._http_client, self._http_async_client
+            self._http_client = None
+            self._http_async_client = None
+            self._models.clear()
+        if http_async_client is not None:
+            await http_async_client.aclose()
+        if http_client is not None:
+            http_client.close()
@@ -1,49 +1,122 @@
-from fastapi import FastAPI,Request, UploadFile, File, HTTPException, status, BackgroundTasks, WebSocket, WebSocketDisconnect,WebSocketException
+from fastapi import FastAPI,Request, Response, Query, Depends, UploadFile, File, HTTPException, status, WebSocket, WebSocketDisconnect
 import json
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional
 from langchain_openai import ChatOpenAI
-from datetime import datetime
-from langchain_core.messages import HumanMessage,SystemMessage, AIMessage
+from llm import ChatModelRegistry, DOC_CHAT, GENERAL_CHAT, SUMMARY
+from datetime import datetime, timedelta
+from langchain_core.messages import HumanMessage,SystemMessage
 from dotenv import load_dotenv
-import inspect
-from vectorizer import AsyncDocumentVectorizer, get_chroma_collections
+from vectorizer import AsyncDocumentVectorizer
 import uuid
 import os
 import asyncio
-import shutil
-from database import connec_db
+import time
+from database import mongo
+from security import decode_token, validate_token, load_auth_settings
+from schema import ensure_schema
+from pagination import keyset_filter, page_cursor, ndjson_lines, wants_ndjson
+from worker import build_job_queue, run_worker
+from jobs import JobAlreadyActive
+from uploads import (UploadLimitMiddleware, UploadTooLarge, write_stream, iter_upload_file, part_path,
+                     file_size, stored_size, remove_quietly)
+from embedding_cache import file_sha256
+from answer_cache import AnswerCache
+from routing import CollectionRouter, LEGACY_COLLECTION
+from maintenance import delete_document_data
+from document_registry import DocumentRegistry, is_ready, not_ready_detail
+from memory import ConversationMemory
+from context_builder import ContextBuilder
+from metrics import (configure_logging, configure_tracing, observe, render, set_ingest_job_counts, stage,
+                     track_executor)
 from router.auth import router
-import jwt 
+from contextlib import asynccontextmanager
+from prometheus_client import CONTENT_TYPE_LATEST
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # JWT settings are read once
+    load_auth_settings()
+
+    # One Mongo client pool for the whole app
+    mongo.connect()
+    if await mongo.ping():
+        logger.info("MongoDB connection successful")
+        ran = await ensure_schema(mongo.async_db)
+        if ran:
+            logger.info(f"Applied schema migrations: {ran}")
+
+    # Document registry: existence, ownership, location and ingest status of every upload
+    app.state.document_registry = DocumentRegistry.from_env(mongo.user_documents)
+
+    # Durable ingestion queue, optionally with in-process workers for single-process setups
+    app.state.ingest_queue = build_job_queue()
+    stop_workers = asyncio.Event()
+    embedded_worker = None
+    if INGEST_EMBEDDED_WORKERS > 0:
+        embedded_worker = asyncio.create_task(
+            run_worker(vectorizer, app.state.ingest_queue, concurrency=INGEST_EMBEDDED_WORKERS, stop=stop_workers,
+                       registry=app.state.document_registry)
+        )
 
+    # Pooled OpenAI connections shared by all chat requests
+    llm.start()
 
-app = FastAPI()
+    # Open the shared Chroma client once and load the recently used tenant collections before serving
+    try:
+        warm = await app.state.document_registry.recent_collections(CHROMA_WARM_COLLECTIONS)
+    except Exception as e:
+        logger.warning(f"Could not list recent collections to warm up: {str(e)}")
+        warm = []
+    loop = asyncio.get_event_loop()
+    warmed = await loop.run_in_executor(vectorizer.executor, vectorizer.chroma.warm_up,
+                                        warm or [LEGACY_COLLECTION])
+    logger.info(f"Chroma warmed up: {warmed}")
+    yield
+    stop_workers.set()
+    if embedded_worker is not None:
+        await embedded_worker
+    vectorizer.shutdown()
+    vectorizer.chroma.close()
+    await llm.aclose()
+    await mongo.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
-# logging for debugging
 import logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("app")
 
-# allow local testing from other origins if needed
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 load_dotenv()  # Load environment variables from .env file
+
+# LOG_LEVEL / LOG_FORMAT control verbosity; spans are exported when OTEL_EXPORTER_OTLP_ENDPOINT is set
+configure_logging()
+configure_tracing("rag-api")
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-# Simple in-memory stores (replace with DB for production)
-documents: Dict[str, Dict[str, Any]] = {}
-chats: Dict[str, List[Dict[str, Any]]] = {}
+# Retrieval settings for document chat
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+# upper bound for the per-message k a client may ask for
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "20"))
+RETRIEVAL_USE_MMR = os.getenv("RETRIEVAL_USE_MMR", "false").lower() == "true"
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.5"))
+# Fuse BM25 hits with vector hits so exact terms (part numbers, names, clause ids) are found
+RETRIEVAL_HYBRID = os.getenv("RETRIEVAL_HYBRID", "true").lower() == "true"
+# Chroma collections of the latest uploads opened at startup
+CHROMA_WARM_COLLECTIONS = int(os.getenv("CHROMA_WARM_COLLECTIONS", "8"))
+
+# Conversation memory: recent turns kept in the prompt, older ones folded into a summary
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+MEMORY_MAX_LOADED_TURNS = int(os.getenv("MEMORY_MAX_LOADED_TURNS", "50"))
+# chat_history scope of the all-documents conversation
+ALL_DOCUMENTS_SCOPE = "all_documents"
 
 
 class DocumentOut(BaseModel):
@@ -56,6 +129,9 @@ class DocumentOut(BaseModel):
 class ChatMessageIn(BaseModel):
     role: str  # e.g., 'user' or 'assistant'
     text: str
+    k: Optional[int] = Field(None, ge=1, le=RETRIEVAL_MAX_K)  # number of chunks to retrieve, defaults to RETRIEVAL_K
+    use_mmr: Optional[bool] = None  # diversify retrieved chunks, defaults to RETRIEVAL_USE_MMR
+    hybrid: Optional[bool] = None  # add BM25 hits, defaults to RETRIEVAL_HYBRID
 
 
 app.include_router(router, prefix="/auth", tags=["authentication"])
@@ -66,266 +142,639 @@ async def read_root():
     return {"Hello": "World"}
 
 
+@app.get("/health")
+async def health():
+    loop = asyncio.get_event_loop()
+    chroma_health = await loop.run_in_executor(vectorizer.executor, vectorizer.chroma.health)
+    mongo_ok = await mongo.ping()
+    overall = "ok" if chroma_health["status"] == "ok" and mongo_ok else "error"
+    return {"status": overall, "chroma": chroma_health, "mongo": {"status": "ok" if mongo_ok else "error"}}
+
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    try:
+        set_ingest_job_counts(await request.app.state.ingest_queue.counts())
+    except Exception as e:
+        # still serve the in-process metrics when Mongo is unreachable
+        logger.warning(f"Could not count ingest jobs: {e}")
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/cache/stats")
+async def cache_stats(decoded_token: dict = Depends(validate_token)):
+    loop = asyncio.get_event_loop()
+    embedding_stats = await loop.run_in_executor(vectorizer.executor, vectorizer.embedding_cache.stats)
+    return {"answers": answer_cache.stats(), "embeddings": embedding_stats}
+
+
+ALLOWED_CONTENT_TYPES = ["text/plain", "application/pdf"]
+
+
 def _validate_file(file: UploadFile) -> None:
     # Basic validation: allow common doc types
-    allowed = ["text/plain", "application/pdf"]
-    if file.content_type not in allowed:
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=f"Unsupported file type: {file.content_type}")
 
 
-document_status = {}
-vectorizer = AsyncDocumentVectorizer(openai_api_key=openai_api_key, persist_directory="./chroma_db")
+vectorizer = AsyncDocumentVectorizer.from_env(persist_directory="./chroma_db")
+llm = ChatModelRegistry.from_env()
+collection_router = CollectionRouter.from_env()
+track_executor("vectorizer", vectorizer.executor)
+# Merges overlapping chunks, drops near-duplicates and fits the rest to CONTEXT_TOKEN_BUDGET;
+# retrieval stops collecting chunks at the same budget
+context_builder = ContextBuilder.from_env()
+answer_cache = AnswerCache(
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+    max_entries_per_doc=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES_PER_DOC", "256")),
+    max_docs=int(os.getenv("ANSWER_CACHE_MAX_DOCS", "1024")),
+)
 
+# Ingestion runs in worker.py processes; set this above 0 to also run workers inside the API process
+INGEST_EMBEDDED_WORKERS = int(os.getenv("INGEST_EMBEDDED_WORKERS", "0"))
+SMALL_FILE_BYTES = 1024 * 1024
 
-async def convert_to_vector(file_path: str, filename: str, document_id: str):
-    """Background vectorization function"""
-    try:
-        # Update status
-        # ensure the document_status entry exists (upload should create it, but be defensive)
-        document_status.setdefault(document_id, {})
-        document_status[document_id]["status"] = "processing"
-
-        # Vectorize document — the vectorizer API may be sync or async; handle both
-        maybe_result = vectorizer.vectorize_document_async(
-            file_path=file_path,
-            collection_name="default",
-            document_id=document_id
-        )
-
-        if inspect.isawaitable(maybe_result):
-            result = await maybe_result
-        else:
-            result = maybe_result
-        
-        # Update final status
-        if result["success"]:
-            document_status[document_id]["status"] = "completed"
-            document_status[document_id]["metadata"] = result
-        else:
-            document_status[document_id]["status"] = "failed"
-            document_status[document_id]["error"] = result["error"]
-            
-    except Exception as e:
-        document_status[document_id]["status"] = "failed"
-        document_status[document_id]["error"] = str(e)
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_LOCK_SECONDS = 600
 
+# Size and token checks on upload routes run before the body is read; 64 KiB covers the multipart framing
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES + 64 * 1024,
+    routes=[("POST", r"/api/documents/upload"), ("PUT", r"/api/documents/[^/]+"), ("PUT", r"/api/uploads/[^/]+")],
+    check_token=decode_token,
+)
 
-def validate_token(request: Request):
-    try:
-        db = connec_db()
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing Authorization header")
+# allow local testing from other origins if needed
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
-        parts = auth_header.split()
-        if len(parts) != 2 or parts[0].lower() != "bearer":
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Authorization header")
 
-        token = parts[1]
+async def _register_upload(request: Request, user_id: str, doc_id: str, original_name: str,
+                           content_type: str, dest_path: str, size: int, file_hash: str) -> None:
+    """Record a fully written upload and queue it for ingestion"""
+    filename = os.path.basename(dest_path)
+    collection_name = collection_router.for_document(user_id, doc_id)
 
-        decoded_token = {}
-        try:
-            decoded_token = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
-        except jwt.ExpiredSignatureError:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-        except jwt.InvalidTokenError as e:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {str(e)}")
-
-        user = db.users.find_one({"id": decoded_token["user_id"]})
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-        return decoded_token
-        
-    except HTTPException:
-        raise  HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token validation failed")
-        
+    try:
+        await request.app.state.document_registry.register(
+            doc_id, user_id, filename.split("_",1)[1], dest_path, collection_name
+        )
 
+        # Hand the file to the ingest workers; small files jump ahead of large ones
+        await request.app.state.ingest_queue.enqueue(
+            document_id=doc_id,
+            user_id=user_id,
+            file_path=str(dest_path),
+            filename=filename,
+            collection_name=collection_name,
+            priority=1 if size < SMALL_FILE_BYTES else 0,
+            file_hash=file_hash,
+        )
+    except Exception as e:
+        logger.exception(f"Could not register upload {doc_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @app.post("/api/documents/upload", response_model=DocumentOut)
-async def upload_document(request: Request ,file: UploadFile = File(...), 
-                          background_tasks: BackgroundTasks = BackgroundTasks()):
+async def upload_document(request: Request ,file: UploadFile = File(...),
+                          decoded_token: dict = Depends(validate_token)):
     _validate_file(file)
 
     doc_id = str(uuid.uuid4())
     filename = f"{doc_id}_{os.path.basename(file.filename)}"
     dest_path = os.path.join(UPLOAD_DIR, filename)
-    db = connec_db()
-    decoded_token = validate_token(request)
 
     try:
-        with open(dest_path, "wb") as out_f:
-            shutil.copyfileobj(file.file, out_f)
-    finally:
-        file.file.close()
-
-    size = os.path.getsize(dest_path)
+        size, file_hash = await write_stream(
+            iter_upload_file(file, UPLOAD_CHUNK_SIZE), dest_path, MAX_UPLOAD_BYTES
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
 
-    # initialize document status before scheduling the background task
-    document_status[doc_id] = {"status": "pending", "path": dest_path}
+    await _register_upload(request, decoded_token["user_id"], doc_id, file.filename,
+                           file.content_type, dest_path, size, file_hash)
 
-    background_tasks.add_task(
-        convert_to_vector,
-        str(dest_path),
-        filename,
-        doc_id,
-    )
+    return DocumentOut(id=doc_id, filename=file.filename, content_type=file.content_type, size=size)
 
 
-    documents[doc_id] = {
-        "id": doc_id,
-        "filename": filename,
-        "original_name": file.filename,
-        "content_type": file.content_type,
-        "size": size,
-        "path": dest_path,
-    }
+@app.put("/api/documents/{doc_id}", response_model=DocumentOut)
+async def update_document(request: Request, doc_id: str, file: UploadFile = File(...),
+                          decoded_token: dict = Depends(validate_token)):
+    """Replace a document's file and re-ingest it incrementally.
 
-    # initialize chat history for this doc
-    chats[doc_id] = []
+    Chunk ids are derived from the chunk content, so only new or changed chunks are
+    embedded, removed chunks are deleted and unchanged chunks keep their ids.
+    """
+    registry = request.app.state.document_registry
+    queue = request.app.state.ingest_queue
+    record = await registry.require(doc_id, decoded_token["user_id"])
+    _validate_file(file)
+    busy = HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Document is still being processed")
+    if await queue.active_for_document(doc_id):
+        raise busy
+
+    # every version gets its own path, so a job never reads a file that is being replaced;
+    # the current file stays in place until the new one is fully written and queued
+    name = os.path.basename(file.filename)
+    filename = f"{doc_id}_{uuid.uuid4().hex[:8]}_{name}"
+    dest_path = os.path.join(UPLOAD_DIR, filename)
+    try:
+        size, file_hash = await write_stream(
+            iter_upload_file(file, UPLOAD_CHUNK_SIZE), dest_path, MAX_UPLOAD_BYTES
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
 
+    loop = asyncio.get_event_loop()
     try:
-        db.user_documents.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": decoded_token["user_id"],
-            "filename": filename.split("_",1)[1],
-            "upload_date": datetime.now(),
-            "document_id": doc_id
-        })
+        await registry.replace_file(doc_id, name, dest_path)
+        await queue.enqueue(
+            document_id=doc_id,
+            user_id=decoded_token["user_id"],
+            file_path=dest_path,
+            filename=filename,
+            collection_name=record["collection"],
+            priority=1 if size < SMALL_FILE_BYTES else 0,
+            file_hash=file_hash,
+        )
     except Exception as e:
-        print(e)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
+        # put the previous file and status back so the document isn't left queued without a job
+        await registry.restore(record, dest_path)
+        await loop.run_in_executor(None, remove_quietly, dest_path)
+        if isinstance(e, JobAlreadyActive):
+            # another update got its job in first
+            raise busy
+        raise
+    if record.get("path") and record["path"] != dest_path:
+        await loop.run_in_executor(None, remove_quietly, record["path"])
+    answer_cache.invalidate(doc_id)
     return DocumentOut(id=doc_id, filename=file.filename, content_type=file.content_type, size=size)
 
 
+class UploadSessionIn(BaseModel):
+    filename: str
+    content_type: str
+    size: Optional[int] = None  # expected total size, checked against MAX_UPLOAD_BYTES
+
+
+async def _get_upload_session(upload_id: str, user_id: str) -> dict:
+    session = await mongo.upload_sessions.find_one({"_id": upload_id, "user_id": user_id})
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return session
+
+
+@app.post("/api/uploads")
+async def create_upload(request: Request, upload: UploadSessionIn,
+                        decoded_token: dict = Depends(validate_token)):
+    """Start a resumable upload; send the bytes with PUT /api/uploads/{upload_id}?offset=N"""
+    if upload.content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unsupported file type: {upload.content_type}")
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte limit")
+
+    upload_id = str(uuid.uuid4())
+    now = datetime.now()
+    await mongo.upload_sessions.insert_one({
+        "_id": upload_id,
+        "user_id": decoded_token["user_id"],
+        "filename": os.path.basename(upload.filename),
+        "content_type": upload.content_type,
+        "size": upload.size,
+        "received": 0,
+        "writing": False,
+        "created_at": now,
+        "updated_at": now,
+    })
+    return {"upload_id": upload_id, "offset": 0, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+
+@app.get("/api/uploads/{upload_id}")
+async def get_upload(request: Request, upload_id: str, decoded_token: dict = Depends(validate_token)):
+    session = await _get_upload_session(upload_id, decoded_token["user_id"])
+    return {"upload_id": upload_id, "offset": session["received"], "size": session["size"]}
+
+
+@app.put("/api/uploads/{upload_id}")
+async def put_upload_chunk(request: Request, upload_id: str, offset: int,
+                           decoded_token: dict = Depends(validate_token)):
+    """Append the raw request body at ``offset``, streaming it straight to disk"""
+    # claim the session so two requests can't write the same file at once;
+    # a claim left behind by a crashed process goes stale after UPLOAD_LOCK_SECONDS
+    now = datetime.now()
+    session = await mongo.upload_sessions.find_one_and_update(
+        {
+            "_id": upload_id,
+            "user_id": decoded_token["user_id"],
+            "received": offset,
+            "$or": [{"writing": False}, {"updated_at": {"$lt": now - timedelta(seconds=UPLOAD_LOCK_SECONDS)}}],
+        },
+        {"$set": {"writing": True, "updated_at": now}},
+    )
+    if not session:
+        current = await _get_upload_session(upload_id, decoded_token["user_id"])
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail={"message": "Offset mismatch or upload busy", "offset": current["received"]})
+
+    path = part_path(UPLOAD_DIR, upload_id)
+    loop = asyncio.get_event_loop()
+    try:
+        await write_stream(request.stream(), path, MAX_UPLOAD_BYTES, offset=offset, keep_partial=True)
+    except UploadTooLarge as e:
+        await mongo.upload_sessions.delete_one({"_id": upload_id})
+        await loop.run_in_executor(None, remove_quietly, path)
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    finally:
+        # whatever reached the disk counts, so an interrupted chunk resumes where it stopped
+        received = await loop.run_in_executor(None, file_size, path)
+        await mongo.upload_sessions.update_one(
+            {"_id": upload_id},
+            {"$set": {"writing": False, "received": received, "updated_at": datetime.now()}},
+        )
+    return {"upload_id": upload_id, "offset": received}
+
+
+@app.post("/api/uploads/{upload_id}/complete", response_model=DocumentOut)
+async def complete_upload(request: Request, upload_id: str, decoded_token: dict = Depends(validate_token)):
+    session_filter = {"_id": upload_id, "user_id": decoded_token["user_id"], "writing": False}
+    session = await mongo.upload_sessions.find_one(session_filter)
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    if session["size"] is not None and session["received"] != session["size"]:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail={"message": "Upload incomplete", "offset": session["received"]})
+
+    # check the data on disk before giving up the session, so a lost part file can still be re-sent
+    source = part_path(UPLOAD_DIR, upload_id)
+    loop = asyncio.get_event_loop()
+    on_disk = await loop.run_in_executor(None, stored_size, source)
+    if on_disk != session["received"]:
+        logger.warning(f"Upload {upload_id} has {on_disk} bytes on disk, expected {session['received']}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Uploaded data is missing or incomplete, please upload the file again")
+    if not await mongo.upload_sessions.find_one_and_delete(session_filter):
+        # a concurrent request completed (or cancelled) the upload first
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    doc_id = str(uuid.uuid4())
+    dest_path = os.path.join(UPLOAD_DIR, f"{doc_id}_{session['filename']}")
+    await loop.run_in_executor(None, os.replace, source, dest_path)
+    file_hash = await loop.run_in_executor(None, file_sha256, dest_path)
+
+    await _register_upload(request, decoded_token["user_id"], doc_id, session["filename"],
+                           session["content_type"], dest_path, session["received"], file_hash)
+
+    return DocumentOut(id=doc_id, filename=session["filename"],
+                       content_type=session["content_type"], size=session["received"])
+
+
+
+DOCUMENT_FIELDS = {"_id": 1, "id": 1, "user_id": 1, "filename": 1, "upload_date": 1, "document_id": 1,
+                   "status": 1, "chunk_count": 1}
+
 
 @app.get("/api/documents")
-async def list_documents(request: Request):
-    decoded_token = validate_token(request)
-    db = connec_db()
+async def list_documents(request: Request, response: Response, limit: int = Query(100, ge=1, le=500),
+                         after: Optional[str] = None, format: Optional[str] = None,
+                         decoded_token: dict = Depends(validate_token)):
+    """Newest uploads first. The cursor for the next page is returned in the X-Next-Cursor header."""
     try:
-        user_docs_cursor = db.user_documents.find({"user_id": decoded_token["user_id"]}, {"_id": 0})
-        try:
-            user_docs = list(user_docs_cursor)
-        except Exception:
-            try:
-                user_docs = user_docs_cursor.to_list(length=None)
-            except Exception:
-                user_docs = []
+        query = {"user_id": decoded_token["user_id"], **keyset_filter("upload_date", after, older=True)}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    sort = [("upload_date", -1), ("_id", -1)]
+
+    try:
+        if wants_ndjson(request, format):
+            cursor = mongo.user_documents.find(query, DOCUMENT_FIELDS, sort=sort, batch_size=200)
+            return StreamingResponse(ndjson_lines(cursor), media_type="application/x-ndjson")
+
+        cursor = mongo.user_documents.find(query, DOCUMENT_FIELDS, sort=sort, limit=limit + 1)
+        user_docs = await cursor.to_list(length=limit + 1)
+        if len(user_docs) > limit:
+            user_docs = user_docs[:limit]
+            response.headers["X-Next-Cursor"] = page_cursor(user_docs[-1], "upload_date")
+        for doc in user_docs:
+            doc.pop("_id")
         return user_docs
     except Exception as e:
-        print(e)
+        logger.exception(f"Could not list documents: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
    
 
 
+@app.get("/api/documents/{doc_id}/status")
+async def get_document_status(request: Request, doc_id: str, decoded_token: dict = Depends(validate_token)):
+    record = await request.app.state.document_registry.require(doc_id, decoded_token["user_id"])
+    job = await request.app.state.ingest_queue.get_for_document(doc_id)
+    if not job:
+        return {"document_id": doc_id, "status": record["status"], "chunk_count": record["chunk_count"]}
+    return {
+        "document_id": doc_id,
+        "status": job["status"],
+        "chunk_count": record["chunk_count"],
+        "attempts": job["attempts"],
+        "error": job.get("last_error"),
+        "result": job.get("result"),
+        "updated_at": job["updated_at"],
+    }
+
+
 @app.delete("/api/documents/{doc_id}")
-async def delete_document(request: Request, doc_id: str):
-   try:
-       db = connec_db()
-       decoded_token = validate_token(request);
-       if not decoded_token:
-           raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-       resp = db.user_documents.delete_one({"document_id": doc_id, "user_id": decoded_token["user_id"]})
-       if resp.deleted_count == 0:
+async def delete_document(request: Request, doc_id: str, decoded_token: dict = Depends(validate_token)):
+    """Delete the document row, then its vectors, BM25 segment, file, chat history and jobs.
+
+    Removing the row first makes the document disappear immediately; anything a failed
+    step leaves behind is reclaimed by the garbage collector in maintenance.py.
+    """
+    deleted = await request.app.state.document_registry.remove(doc_id, decoded_token["user_id"])
+    if deleted is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
-       files = os.scandir(UPLOAD_DIR)
-       for f in files:
-           if f.name.startswith(doc_id+"_"):
-               os.remove(f.path)
-               break
-       return {"detail": "Document deleted successfully"}
-   except Exception as e:
-       print("Some exception occured")
 
+    answer_cache.invalidate(doc_id)
+    report = await delete_document_data(vectorizer, deleted)
+    if report["errors"]:
+        logger.warning(f"Document {doc_id} deleted with pending cleanup: {report['errors']}")
+    return {"detail": "Document deleted successfully", **report}
+
+
+def _wants_event_stream(request: Request) -> bool:
+    """SSE is opt-in so existing JSON clients keep working"""
+    return ("text/event-stream" in request.headers.get("accept", "")
+            or request.query_params.get("stream", "").lower() == "true")
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _summarize_turns(previous_summary: str, turns: List[dict]) -> str:
+    transcript = "\n".join(f"User: {t['user_message']}\nAssistant: {t['ai_response']}" for t in turns)
+    messages = [
+        SystemMessage(content="Update the running summary of a conversation. Keep names, facts, decisions "
+                              "and open questions; drop small talk. Reply with the summary only."),
+        HumanMessage(content=f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"),
+    ]
+    async with llm.slot():
+        response = await llm.get(SUMMARY).ainvoke(messages)
+    return response.content
+
+
+async def _astream_timed(client: ChatOpenAI, messages: list):
+    """Stream model chunks inside a completion slot, recording slot wait, first token and total time"""
+    queued = time.perf_counter()
+    async with llm.slot():
+        started = time.perf_counter()
+        observe("llm.slot_wait", started - queued)
+        first_token = True
+        async for chunk in client.astream(messages):
+            if first_token:
+                observe("llm.first_token", time.perf_counter() - started)
+                first_token = False
+            yield chunk
+        observe("llm.total", time.perf_counter() - started)
+
+
+async def _ainvoke_timed(client: ChatOpenAI, messages: list):
+    async with llm.slot():
+        with stage("llm.total"):
+            return await client.ainvoke(messages)
+
+
+async def _load_memory(turn_filter: dict, session_key: str) -> ConversationMemory:
+    memory = ConversationMemory(
+        mongo.chat_history,
+        turn_filter=turn_filter,
+        session_key=session_key,
+        summarize=_summarize_turns,
+        token_budget=MEMORY_TOKEN_BUDGET,
+        max_loaded_turns=MEMORY_MAX_LOADED_TURNS,
+    )
+    return await memory.load()
 
 
+async def _doc_memory(doc_id: str, user_id: str) -> ConversationMemory:
+    return await _load_memory({"doc_id": doc_id, "user_id": user_id}, f"doc:{doc_id}:{user_id}")
 
 
-@app.post("/api/chat/{doc_id}")
-async def post_chat(request: Request ,doc_id: str, msg: ChatMessageIn):
+async def _stream_doc_chat(client: ChatOpenAI, llm_messages: list, doc_id: Optional[str], memory: ConversationMemory,
+                           user_message: str, sources: list, query_embedding: list, generation,
+                           cache_answer: bool = False):
+    """Relay model tokens as server-sent events.
+
+    When the client disconnects Starlette cancels this generator, which closes the
+    upstream OpenAI stream; partial answers are not saved.
+    """
+    full_response = ""
     try:
-        db = connec_db()
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing Authorization header")
+        async for chunk in _astream_timed(client, llm_messages):
+            if not chunk.content:
+                continue
+            full_response += chunk.content
+            yield _sse_event("token", {"content": chunk.content})
+    except asyncio.CancelledError:
+        logger.info(f"Chat stream for {doc_id} cancelled by client")
+        raise
+    except Exception as e:
+        yield _sse_event("error", {"message": str(e)})
+        return
 
-        parts = auth_header.split()
-        if len(parts) != 2 or parts[0].lower() != "bearer":
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Authorization header")
+    await memory.add_turn(user_message, full_response)
+    answer = {"response": full_response, "sources": sources}
+    if cache_answer:
+        answer_cache.store(doc_id, user_message, query_embedding, answer, generation=generation)
+    yield _sse_event("done", answer)
 
-        token = parts[1]
 
-        decoded_token = {}
-        try:
-            decoded_token = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
-        except jwt.ExpiredSignatureError:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-        except jwt.InvalidTokenError as e:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {str(e)}")
-
-        user = db.users.find_one({"id": decoded_token["user_id"]})
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-
-        client = ChatOpenAI(
-            model="gpt-4o-mini",
-            api_key=os.getenv("OPENAI_API_KEY"),
-            max_tokens=500,
-            temperature=0.1
-        )
-        
-        documents_lst = os.scandir(UPLOAD_DIR)
-        document_ids = [d.name.split("_")[0] for d in documents_lst]
-        if doc_id not in document_ids:  # Use your existing documents dict
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
-        
+async def _stream_cached_answer(answer: dict):
+    yield _sse_event("token", {"content": answer["response"]})
+    yield _sse_event("done", {**answer, "cached": True})
 
-        doc_data = get_chroma_collections("default",doc_id)
-        print(doc_data)  # Use the function from previous examples
-        
+
+async def _cached_answer_response(request: Request, memory: ConversationMemory,
+                                  user_message: str, answer: dict):
+    await memory.add_turn(user_message, answer["response"])
+    if _wants_event_stream(request):
+        return StreamingResponse(_stream_cached_answer(answer), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+    return {**answer, "cached": True}
+
+
+@app.post("/api/chat")
+async def post_chat_all(request: Request, msg: ChatMessageIn, decoded_token: dict = Depends(validate_token)):
+    """Answer a question over all of the user's documents.
+
+    The user's collections are queried in parallel and the hits merged by distance.
+    Documents from before per-tenant collections are filtered by id in the legacy
+    collection.
+    """
+    try:
+        user_id = decoded_token["user_id"]
+        client = llm.get(DOC_CHAT)
+        user_message = msg.text
+
+        targets: Dict[str, Optional[dict]] = {}
+        legacy_ids = []
+        async for doc in mongo.user_documents.find({"user_id": user_id}, {"document_id": 1, "collection": 1}):
+            collection_name = doc.get("collection", LEGACY_COLLECTION)
+            if collection_name == LEGACY_COLLECTION:
+                legacy_ids.append(doc["document_id"])
+            else:
+                targets[collection_name] = None
+        if legacy_ids:
+            targets[LEGACY_COLLECTION] = {"document_id": {"$in": legacy_ids}}
+        if not targets:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No documents found")
+
+        # scoped by the authenticated user, never by a client-supplied session id
+        memory = await _load_memory({"user_id": user_id, "scope": ALL_DOCUMENTS_SCOPE}, f"all:{user_id}")
+
+        with stage("embed.query"):
+            query_embedding = await vectorizer.embeddings.aembed_query(user_message)
+        with stage("retrieval", collections=len(targets)):
+            doc_data = await vectorizer.search_collections_async(
+                targets,
+                query=user_message,
+                query_embedding=query_embedding,
+                k=RETRIEVAL_K if msg.k is None else msg.k,
+                max_context_tokens=context_builder.token_budget,
+            )
         if not doc_data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document content not found")
+
+        with stage("context.build"):
+            context = context_builder.build(doc_data["chunks"], user_message)
+        logger.debug(f"Context {context['context_tokens']} tokens from {context['input_tokens']} retrieved")
+
+        prompt_context = f"""Based on the following chunks from the user's documents, answer the user's question.
+                    Document Chunks:{context["full_content"]}
+                    Question: {user_message}
+                    Answer based on document context:"""
+        llm_messages = [
+            SystemMessage(content="You are a helpful AI assistant that answers questions based on provided document context."),
+            *memory.messages(),
+            HumanMessage(content=prompt_context)
+        ]
+        sources = [
+            {"document_id": c["metadata"].get("document_id"), "chunk_id": c["chunk_id"],
+             "score": c["score"], "page": c["metadata"].get("page")}
+            for c in context["chunks"]
+        ]
+
+        if _wants_event_stream(request):
+            return StreamingResponse(
+                _stream_doc_chat(client, llm_messages, None, memory, user_message,
+                                 sources, query_embedding, None),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        response = await _ainvoke_timed(client, llm_messages)
+        await memory.add_turn(user_message, response.content)
+        return {"response": response.content, "sources": sources}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@app.post("/api/chat/{doc_id}")
+async def post_chat(request: Request ,doc_id: str, msg: ChatMessageIn,
+                    decoded_token: dict = Depends(validate_token)):
+    try:
+        client = llm.get(DOC_CHAT)
         
+        record = await request.app.state.document_registry.require(doc_id, decoded_token["user_id"])
+        if not is_ready(record):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=not_ready_detail(record))
+        collection_name = record["collection"]
         
+
         user_message = msg.text  
+        memory = await _doc_memory(doc_id, decoded_token["user_id"])
+
+        # Repeated questions are answered from the cache; re-ingestion starts a new generation.
+        # Only opening questions are cached: a follow-up's answer depends on the earlier turns
+        cacheable = memory.empty
+        with stage("mongo.ingest_job"):
+            ingest_job = await request.app.state.ingest_queue.get_for_document(doc_id)
+        generation = ingest_job.get("completed_at") if ingest_job else None
+        cached = answer_cache.lookup_exact(doc_id, user_message, generation=generation) if cacheable else None
+        if cached:
+            return await _cached_answer_response(request, memory, user_message, cached)
+
+        # Embed the question once for both the semantic cache lookup and retrieval
+        with stage("embed.query"):
+            query_embedding = await vectorizer.embeddings.aembed_query(user_message)
+        cached = answer_cache.lookup_similar(doc_id, query_embedding, generation=generation) if cacheable else None
+        if cached:
+            return await _cached_answer_response(request, memory, user_message, cached)
+
+        with stage("retrieval"):
+            doc_data = await vectorizer.similarity_search_async(
+                collection_name=collection_name,
+                document_id=doc_id,
+                query=user_message,
+                query_embedding=query_embedding,
+                k=RETRIEVAL_K if msg.k is None else msg.k,
+                use_mmr=RETRIEVAL_USE_MMR if msg.use_mmr is None else msg.use_mmr,
+                fetch_k=RETRIEVAL_FETCH_K,
+                lambda_mult=RETRIEVAL_MMR_LAMBDA,
+                max_context_tokens=context_builder.token_budget,
+                hybrid=RETRIEVAL_HYBRID if msg.hybrid is None else msg.hybrid,
+            )
+        
+        if not doc_data:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document content not found")
+
+        with stage("context.build"):
+            context = context_builder.build(doc_data["chunks"], user_message)
+        logger.debug(f"Context {context['context_tokens']} tokens from {context['input_tokens']} retrieved")
         
         prompt_context = f"""Based on the following document chunks, answer the user's question.
-                    Document Chunks:{doc_data["full_content"]}
+                    Document Chunks:{context["full_content"]}
                     Question: {user_message}
                     Answer based on document context:"""
         
-        response = client.invoke([
+        llm_messages = [
             SystemMessage(content="You are a helpful AI assistant that answers questions based on provided document context."),
+            *memory.messages(),
             HumanMessage(content=prompt_context)
-        ])
-        
+        ]
+        sources = [
+            {"chunk_id": c["chunk_id"], "score": c["score"], "page": c["metadata"].get("page")}
+            for c in context["chunks"]
+        ]
+
+        if _wants_event_stream(request):
+            return StreamingResponse(
+                _stream_doc_chat(client, llm_messages, doc_id, memory, user_message,
+                                 sources, query_embedding, generation, cache_answer=cacheable),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        response = await _ainvoke_timed(client, llm_messages)
         ai_response = response.content 
-        
-        # Store chat history
-        if doc_id not in chats:
-            chats[doc_id] = []
-        
-        chats[doc_id].append({
-            "user_message": user_message,
-            "ai_response": ai_response,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        
-        try:
-            db.chat_history.insert_one({
-                "doc_id": doc_id,
-                "user_id": decoded_token["user_id"],  # Add user_id if available
-                "user_message": user_message,
-                "ai_response": ai_response,
-                "timestamp": datetime.now()
-            })
-        except Exception as e:
-            print(f"❌ Error saving chat history to DB: {str(e)}")
-        return {"response": ai_response}
+        await memory.add_turn(user_message, ai_response)
+        answer = {"response": ai_response, "sources": sources}
+        if cacheable:
+            answer_cache.store(doc_id, user_message, query_embedding, answer, generation=generation)
+        return answer
         
     except HTTPException:
         raise  # Re-raise HTTP exceptions
@@ -337,61 +786,129 @@ async def post_chat(request: Request ,doc_id: str, msg: ChatMessageIn):
 
 
 
-@app.get("/api/chat/{doc_id}")
-def get_chat_history(doc_id: str, request: Request):
-    db = connec_db()
-    try:
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing Authorization header")
-
-        parts = auth_header.split()
-        if len(parts) != 2 or parts[0].lower() != "bearer":
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Authorization header")
-
-        token = parts[1]
+CHAT_FIELDS = {"_id": 1, "user_message": 1, "ai_response": 1, "timestamp": 1}
 
-        decoded_token = {}
-        try:
-            decoded_token = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
-        except jwt.ExpiredSignatureError:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-        except jwt.InvalidTokenError as e:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {str(e)}")
-
-        user = db.users.find_one({"id": decoded_token["user_id"]})
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-        
 
-        query = {"doc_id": doc_id, "user_id": decoded_token.get("user_id")}
-        cursor = db.chat_history.find(query, {"_id": 0})
-        try:
-            messages = list(cursor)
-        except Exception:
-            try:
-                messages = cursor.to_list(length=None)
-            except Exception:
-                messages = []
+@app.get("/api/chat/{doc_id}")
+async def get_chat_history(doc_id: str, request: Request, limit: int = Query(50, ge=1, le=200),
+                           before: Optional[str] = None, after: Optional[str] = None,
+                           format: Optional[str] = None, decoded_token: dict = Depends(validate_token)):
+    """Chat turns in chronological order, one page at a time.
+
+    Without a cursor the most recent ``limit`` turns are returned. Pass the returned
+    ``before`` cursor to page back through older turns, or ``after`` to fetch newer
+    ones. ``format=ndjson`` streams every matching turn instead of a single page.
+    """
+    if before and after:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either before or after")
+    await request.app.state.document_registry.require(doc_id, decoded_token["user_id"])
+    try:
+        query = {"doc_id": doc_id, "user_id": decoded_token["user_id"]}
+        query.update(keyset_filter("timestamp", after, older=False) if after
+                     else keyset_filter("timestamp", before, older=True))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-        return {"doc_id": doc_id, "messages": messages}
+    try:
+        if wants_ndjson(request, format):
+            cursor = mongo.chat_history.find(query, CHAT_FIELDS, sort=[("timestamp", 1), ("_id", 1)],
+                                             batch_size=200)
+            return StreamingResponse(ndjson_lines(cursor), media_type="application/x-ndjson")
+
+        # newest-first when paging backwards, then flipped to chronological order
+        direction = 1 if after else -1
+        cursor = mongo.chat_history.find(query, CHAT_FIELDS, sort=[("timestamp", direction), ("_id", direction)],
+                                         limit=limit + 1)
+        messages = await cursor.to_list(length=limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if direction == -1:
+            messages.reverse()
+
+        page = {
+            "doc_id": doc_id,
+            "messages": messages,
+            "before": page_cursor(messages[0], "timestamp") if messages else before,
+            "after": page_cursor(messages[-1], "timestamp") if messages else after,
+            "has_more": has_more,
+        }
+        for message in messages:
+            message.pop("_id")
+        return page
         
     except Exception as e:
-        print(f"❌ Error retrieving chat history from DB: {str(e)}")
+        logger.exception(f"Error retrieving chat history from DB: {str(e)}")
         return {"doc_id": doc_id, "messages": []}
 
 
 
+async def _read_socket(websocket: WebSocket, inbox: asyncio.Queue, interrupt: asyncio.Event):
+    """Read client frames while a reply streams so cancel/disconnect is seen immediately"""
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                message_data = json.loads(data)
+            except json.JSONDecodeError:
+                message_data = None
+            if not isinstance(message_data, dict):
+                await websocket.send_text(json.dumps({
+                    "type": "error",
+                    "message": "Frames must be JSON objects"
+                }))
+                continue
+            if message_data.get("type") == "cancel":
+                interrupt.set()
+            else:
+                await inbox.put(message_data)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        # None tells the chat loop the client is gone
+        interrupt.set()
+        await inbox.put(None)
+
+
+async def _stream_reply(websocket: WebSocket, client: ChatOpenAI, messages: list) -> str:
+    full_response = ""
+    async for chunk in _astream_timed(client, messages):
+        if not chunk.content:
+            continue
+        full_response += chunk.content
+        with stage("ws.send"):
+            await websocket.send_text(json.dumps({
+                "type": "stream",
+                "content": chunk.content,
+                "full_content": full_response
+            }))
+    return full_response
+
+
 @app.websocket("/ws/chat")
 async def chat_websocket(websocket: WebSocket):
     await websocket.accept()
-    conversation_history = []
+    # Reconnect with ?session_id=... to resume a conversation from chat_history. Session ids
+    # are server-generated UUIDs, so a client can't address summaries or other chat scopes
+    session_id = str(uuid.uuid4())
+    requested = websocket.query_params.get("session_id")
+    if requested:
+        try:
+            session_id = str(uuid.UUID(requested))
+        except ValueError:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid session_id")
+            return
+    memory = await _load_memory({"session_id": session_id}, f"ws:{session_id}")
+    await websocket.send_text(json.dumps({"type": "session", "session_id": session_id}))
+    inbox: asyncio.Queue = asyncio.Queue()
+    interrupt = asyncio.Event()
+    reader = asyncio.create_task(_read_socket(websocket, inbox, interrupt))
     
     try:
         while True:
             # Receive message
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = await inbox.get()
+            if message_data is None:
+                break
             user_message = message_data.get("message", "")
             
             if not user_message.strip():
@@ -403,50 +920,40 @@ async def chat_websocket(websocket: WebSocket):
                 "status": "AI is thinking..."
             }))
             
-            # Initialize non-streaming client for cleaner responses
-            client = ChatOpenAI(
-                model="gpt-4o-mini",
-                api_key=os.getenv("OPENAI_API_KEY"),
-                max_tokens=500,
-                streaming=False,  # Turn off streaming for cleaner responses
-                temperature=0.7
-            )
+            client = llm.get(GENERAL_CHAT)
             
             # Build messages with proper history
             messages = [
                 SystemMessage(content="You are a helpful assistant. Provide clear, accurate responses.")
             ]
             
-            # Add recent conversation context
-            for msg in conversation_history[-10:]:
-                if msg["role"] == "user":
-                    messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    messages.append(AIMessage(content=msg["content"]))
-            
+            # Summary of older turns plus the recent ones that fit the token budget
+            messages.extend(memory.messages())
             messages.append(HumanMessage(content=user_message))
             
+            # Stream tokens as they arrive; a cancel frame or disconnect aborts the upstream call
+            interrupt.clear()
+            stream_task = asyncio.create_task(_stream_reply(websocket, client, messages))
+            interrupt_task = asyncio.create_task(interrupt.wait())
+            await asyncio.wait({stream_task, interrupt_task}, return_when=asyncio.FIRST_COMPLETED)
+            interrupt_task.cancel()
+
+            if not stream_task.done():
+                stream_task.cancel()
+                try:
+                    await stream_task
+                except asyncio.CancelledError:
+                    pass
+                if reader.done():
+                    break
+                await websocket.send_text(json.dumps({"type": "cancelled"}))
+                continue
+
             try:
-                # Get complete response
-                response = await client.ainvoke(messages)
-                full_response = response.content
-                
-                # Simulate typing effect by sending chunks
-                words = full_response.split()
-                current_text = ""
-                
-                for word in words:
-                    current_text += word + " "
-                    await websocket.send_text(json.dumps({
-                        "type": "stream",
-                        "content": word + " ",
-                        "full_content": current_text.strip()
-                    }))
-                    await asyncio.sleep(0.05)  # Typing effect
+                full_response = stream_task.result()
                 
                 # Add to history
-                conversation_history.append({"role": "user", "content": user_message})
-                conversation_history.append({"role": "assistant", "content": full_response})
+                await memory.add_turn(user_message, full_response)
                 
                 # Send completion
                 await websocket.send_text(json.dumps({
@@ -454,6 +961,8 @@ async def chat_websocket(websocket: WebSocket):
                     "full_response": full_response
                 }))
                 
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 await websocket.send_text(json.dumps({
                     "type": "error",
@@ -461,4 +970,7 @@ async def chat_websocket(websocket: WebSocket):
                 }))
             
     except WebSocketDisconnect:
-        print("Client disconnected")
+        pass
+    finally:
+        reader.cancel()
+        logger.debug(f"WebSocket session {session_id} disconnected")
@@ -0,0 +1,337 @@
+"""Document deletion and garbage collection of orphaned data.
+
+``delete_document_data`` removes everything stored for one document. ``collect_garbage``
+sweeps for data whose document no longer exists (for example after a delete that
+failed halfway, or a worker that finished ingesting a document deleted meanwhile)
+and reports the space it reclaimed. Run it periodically with
+``python maintenance.py --interval 3600`` or once with ``python maintenance.py``.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+
+from chunking import METADATA_PREFIX as CHUNKING_PREFIX
+from compact_vectors import METADATA_PREFIX as VECTORS_PREFIX
+from database import mongo
+from metrics import configure_logging
+from routing import LEGACY_COLLECTION
+from uploads import remove_quietly
+from vectorizer import AsyncDocumentVectorizer
+
+logger = logging.getLogger("maintenance")
+
+# Uploaded files are written before their user_documents row, so young files are never orphans
+UPLOAD_GRACE_SECONDS = 3600
+_UPLOAD_NAME_RE = re.compile(r"^([0-9a-f-]{36})_")
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_file_sync(path: str, dry_run: bool = False) -> int:
+    """Size of the file at ``path`` (0 if it's gone), removing it unless ``dry_run``"""
+    try:
+        size = os.path.getsize(path)
+        if not dry_run:
+            remove_quietly(path)
+    except OSError as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning(f"Could not remove {path}: {e}")
+        return 0
+    return size
+
+
+def _delete_vectors_sync(vectorizer: AsyncDocumentVectorizer, collection_name: str, document_ids) -> int:
+    try:
+        collection = vectorizer.chroma.get_collection(collection_name)
+    except Exception:
+        return 0
+    where = {"document_id": {"$in": list(document_ids)}}
+    ids = collection.get(where=where, include=[])["ids"]
+    if ids:
+        collection.delete(ids=ids)
+    return len(ids)
+
+
+async def delete_document_data(vectorizer: AsyncDocumentVectorizer, record: dict,
+                               file_path: Optional[str] = None) -> dict:
+    """Remove a document's vectors, BM25 segment, file, chat history and ingest jobs.
+
+    ``record`` is the already-deleted ``user_documents`` row. Every step runs even if
+    an earlier one fails; failures are listed under ``errors`` and whatever they left
+    behind is picked up by ``collect_garbage``.
+    """
+    loop = asyncio.get_event_loop()
+    doc_id = record["document_id"]
+    collection_name = record.get("collection", LEGACY_COLLECTION)
+    report = {"document_id": doc_id, "errors": []}
+
+    async def step(name: str, func, *args):
+        try:
+            report[name] = await func(*args)
+        except Exception as e:
+            report["errors"].append(f"{name}: {str(e)}")
+            logger.warning(f"Deleting {name} of {doc_id} failed: {e}")
+
+    # Cancel pending ingestion first so a queued job can't write vectors again
+    jobs = await mongo.ingest_jobs.find({"document_id": doc_id}, {"file_path": 1}).to_list(length=None)
+    file_path = file_path or record.get("path") or next((j["file_path"] for j in jobs if j.get("file_path")), None)
+
+    async def jobs_step():
+        return (await mongo.ingest_jobs.delete_many({"document_id": doc_id})).deleted_count
+
+    async def vectors_step():
+        return await loop.run_in_executor(
+            vectorizer.executor, _delete_vectors_sync, vectorizer, collection_name, [doc_id]
+        )
+
+    async def lexical_step():
+        if vectorizer.lexical_index is None:
+            return 0
+        return await loop.run_in_executor(
+            vectorizer.executor, vectorizer.lexical_index.delete, collection_name, doc_id
+        )
+
+    async def vector_segment_step():
+        if vectorizer.vector_index is None:
+            return 0
+        return await loop.run_in_executor(
+            vectorizer.executor, vectorizer.vector_index.delete, collection_name, doc_id
+        )
+
+    async def file_step():
+        if not file_path:
+            return 0
+        return await loop.run_in_executor(vectorizer.executor, _remove_file_sync, file_path)
+
+    async def chat_step():
+        resp = await mongo.chat_history.delete_many({"$or": [
+            {"doc_id": doc_id},
+            {"kind": "summary", "session_id": {"$regex": f"^doc:{re.escape(doc_id)}:"}},
+        ]})
+        return resp.deleted_count
+
+    await step("jobs_removed", jobs_step)
+    await step("vectors_removed", vectors_step)
+    await step("lexical_bytes", lexical_step)
+    await step("vector_segment_bytes", vector_segment_step)
+    await step("file_bytes", file_step)
+    await step("chat_messages_removed", chat_step)
+    return report
+
+
+def _scan_collections_sync(vectorizer: AsyncDocumentVectorizer, page_size: int = 5000) -> Dict[str, Set[str]]:
+    """document ids present in every Chroma collection"""
+    found = {}
+    for collection in vectorizer.chroma.client.list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        handle = vectorizer.chroma.get_collection(name)
+        doc_ids = set()
+        offset = 0
+        while True:
+            page = handle.get(include=["metadatas"], limit=page_size, offset=offset)
+            doc_ids.update(m.get("document_id") for m in page["metadatas"] if m)
+            if len(page["ids"]) < page_size:
+                break
+            offset += page_size
+        doc_ids.discard(None)
+        found[name] = doc_ids
+    return found
+
+
+def _has_stored_settings(metadata: dict) -> bool:
+    return any(key.startswith((CHUNKING_PREFIX, VECTORS_PREFIX)) for key in metadata)
+
+
+def _drop_empty_collections_sync(vectorizer: AsyncDocumentVectorizer, names) -> list:
+    """Drop empty collections, keeping those with stored chunking or vector settings.
+
+    Settings can be stored with ``chunking.py set`` or ``compact_vectors.py set``
+    before a collection's first upload, and dropping it would lose them.
+    """
+    dropped = []
+    for name in names:
+        if name == LEGACY_COLLECTION:
+            continue
+        if _has_stored_settings(vectorizer.chroma.collection_settings(name)):
+            continue
+        if vectorizer.chroma.get_collection(name).count() == 0:
+            vectorizer.chroma.client.delete_collection(name)
+            vectorizer.chroma.forget_collection(name)
+            dropped.append(name)
+    return dropped
+
+
+def _scan_lexical_sync(root: str) -> Dict[str, Set[str]]:
+    """Segment directory names per collection, skipping segments that are being written"""
+    found = {}
+    if not os.path.isdir(root):
+        return found
+    cutoff = time.time() - UPLOAD_GRACE_SECONDS
+    for collection in os.scandir(root):
+        if not collection.is_dir():
+            continue
+        found[collection.name] = {
+            entry.name for entry in os.scandir(collection.path)
+            if entry.is_dir() and not (".tmp-" in entry.name and entry.stat().st_mtime > cutoff)
+        }
+    return found
+
+
+def _scan_uploads_sync(upload_dir: str) -> Dict[str, list]:
+    """Old upload files grouped by the id in their name (document id or upload session id)"""
+    found: Dict[str, list] = {}
+    cutoff = time.time() - UPLOAD_GRACE_SECONDS
+    if not os.path.isdir(upload_dir):
+        return found
+    for entry in os.scandir(upload_dir):
+        if not entry.is_file() or entry.stat().st_mtime > cutoff:
+            continue
+        if entry.name.endswith(".part"):
+            key = entry.name[:-len(".part")]
+        else:
+            match = _UPLOAD_NAME_RE.match(entry.name)
+            if not match:
+                continue
+            key = match.group(1)
+        found.setdefault(key, []).append(entry.path)
+    return found
+
+
+async def collect_garbage(vectorizer: AsyncDocumentVectorizer, upload_dir: str, dry_run: bool = False) -> dict:
+    """Remove data of documents that no longer exist and report the reclaimed space.
+
+    Candidates are listed before the set of live documents is read. A document's row
+    is inserted before its vectors, segment and chat history exist, so nothing that
+    belongs to a live document can look orphaned.
+    """
+    loop = asyncio.get_event_loop()
+    started = time.perf_counter()
+    lexical_root = vectorizer.lexical_index.root if vectorizer.lexical_index else None
+    vector_root = vectorizer.vector_index.root if vectorizer.vector_index else None
+    chroma_bytes_before = await loop.run_in_executor(None, directory_size, vectorizer.persist_directory)
+
+    vectors = await loop.run_in_executor(vectorizer.executor, _scan_collections_sync, vectorizer)
+    segments = await loop.run_in_executor(None, _scan_lexical_sync, lexical_root) if lexical_root else {}
+    vector_segments = await loop.run_in_executor(None, _scan_lexical_sync, vector_root) if vector_root else {}
+    uploads = await loop.run_in_executor(None, _scan_uploads_sync, upload_dir)
+    chat_doc_ids = set(await mongo.chat_history.distinct("doc_id"))
+    job_doc_ids = set(await mongo.ingest_jobs.distinct("document_id"))
+
+    live = set(await mongo.user_documents.distinct("document_id"))
+    live_uploads = set(await mongo.upload_sessions.distinct("_id"))
+
+    report = {
+        "dry_run": dry_run,
+        "vectors_removed": 0,
+        "collections_dropped": [],
+        "lexical_bytes": 0,
+        "vector_segment_bytes": 0,
+        "upload_bytes": 0,
+        "chat_messages_removed": 0,
+        "jobs_removed": 0,
+        "orphaned_documents": 0,
+    }
+    orphans: Set[str] = set()
+
+    for collection_name, doc_ids in vectors.items():
+        dead = doc_ids - live
+        orphans |= dead
+        if dead and not dry_run:
+            report["vectors_removed"] += await loop.run_in_executor(
+                vectorizer.executor, _delete_vectors_sync, vectorizer, collection_name, dead
+            )
+    if not dry_run:
+        # a collection still assigned to a document may be about to receive its vectors
+        in_use = set(await mongo.user_documents.distinct("collection"))
+        report["collections_dropped"] = await loop.run_in_executor(
+            vectorizer.executor, _drop_empty_collections_sync, vectorizer,
+            [name for name in vectors if name not in in_use]
+        )
+
+    for key, root, found in (("lexical_bytes", lexical_root, segments),
+                             ("vector_segment_bytes", vector_root, vector_segments)):
+        for collection_name, doc_ids in found.items():
+            for name in doc_ids - live:
+                orphans.add(name)
+                path = os.path.join(root, collection_name, name)
+                report[key] += await loop.run_in_executor(None, directory_size, path)
+                if not dry_run:
+                    # also clears the .tmp-/.old- directories of interrupted writes
+                    await loop.run_in_executor(None, partial(shutil.rmtree, path, ignore_errors=True))
+
+    for key, paths in uploads.items():
+        if key in live or key in live_uploads:
+            continue
+        orphans.add(key)
+        for path in paths:
+            # a file removed since the scan counts as 0 bytes instead of aborting the run
+            report["upload_bytes"] += await loop.run_in_executor(None, _remove_file_sync, path, dry_run)
+
+    dead_chats = list(chat_doc_ids - live - {None})
+    dead_jobs = list(job_doc_ids - live)
+    orphans |= set(dead_chats) | set(dead_jobs)
+    if not dry_run:
+        if dead_chats:
+            resp = await mongo.chat_history.delete_many({"doc_id": {"$in": dead_chats}})
+            report["chat_messages_removed"] = resp.deleted_count
+        if dead_jobs:
+            resp = await mongo.ingest_jobs.delete_many({"document_id": {"$in": dead_jobs}})
+            report["jobs_removed"] = resp.deleted_count
+
+    chroma_bytes_after = await loop.run_in_executor(None, directory_size, vectorizer.persist_directory)
+    report.update({
+        "orphaned_documents": len(orphans),
+        "chroma_bytes_before": chroma_bytes_before,
+        "chroma_bytes_after": chroma_bytes_after,
+        "reclaimed_bytes": max(0, chroma_bytes_before - chroma_bytes_after)
+                           + report["lexical_bytes"] + report["vector_segment_bytes"] + report["upload_bytes"],
+        "duration_seconds": round(time.perf_counter() - started, 2),
+        "finished_at": datetime.now(timezone.utc),
+    })
+    if not dry_run:
+        await mongo.maintenance_reports.insert_one(dict(report))
+    return report
+
+
+async def main(upload_dir: str, interval: float, dry_run: bool) -> None:
+    mongo.connect()
+    vectorizer = AsyncDocumentVectorizer.from_env()
+    try:
+        while True:
+            report = await collect_garbage(vectorizer, upload_dir, dry_run=dry_run)
+            logger.info(f"Garbage collection: {report}")
+            if interval <= 0:
+                break
+            await asyncio.sleep(interval)
+    finally:
+        vectorizer.shutdown()
+        await mongo.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Remove data of deleted documents and report reclaimed space")
+    parser.add_argument("--upload-dir", default=os.path.join(os.path.dirname(__file__), "uploads"))
+    parser.add_argument("--interval", type=float, default=0, help="seconds between runs; 0 runs once")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.upload_dir, args.interval, args.dry_run))
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from pymongo.asynchronous.collection import AsyncCollection
+
+from chunking import count_tokens
+from metrics import stage
+
+logger = logging.getLogger("app")
+
+# summarize(previous_summary, evicted_turns) -> new summary
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+# keeps background summaries alive until they finish
+_background_tasks = set()
+
+# attempts to fold turns into a summary that another process keeps changing
+SUMMARY_ATTEMPTS = 3
+
+
+class ConversationMemory:
+    """Token-budgeted window of recent turns plus a rolling summary of older ones.
+
+    Turns are stored in ``chat_history`` with the fields of ``turn_filter`` (e.g.
+    ``{"doc_id": ..., "user_id": ...}`` or ``{"session_id": ...}``); the summary is a
+    ``kind: "summary"`` document in the same collection keyed by ``session_key``.
+    Turns that no longer fit ``token_budget`` are folded into the summary in the
+    background, so a reconnecting client resumes from the summary and a handful of
+    recent turns instead of the full transcript.
+    """
+
+    def __init__(self, collection: AsyncCollection, turn_filter: dict, session_key: str,
+                 summarize: Summarizer, token_budget: int = 1500, max_loaded_turns: int = 50):
+        self.collection = collection
+        self.turn_filter = turn_filter
+        self.session_key = session_key
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.max_loaded_turns = max_loaded_turns
+        self.summary = ""
+        self.turns: List[dict] = []
+        self._summary_lock = asyncio.Lock()
+
+    @property
+    def _summary_filter(self) -> dict:
+        return {"kind": "summary", "session_id": self.session_key}
+
+    def _turn_tokens(self, turn: dict) -> int:
+        if "tokens" not in turn:
+            turn["tokens"] = count_tokens(turn["user_message"]) + count_tokens(turn["ai_response"])
+        return turn["tokens"]
+
+    def _used_tokens(self) -> int:
+        return count_tokens(self.summary) + sum(self._turn_tokens(turn) for turn in self.turns)
+
+    async def load(self) -> "ConversationMemory":
+        with stage("mongo.chat_history"):
+            summary_doc = await self.collection.find_one(self._summary_filter)
+            query = dict(self.turn_filter)
+            if summary_doc:
+                self.summary = summary_doc.get("summary", "")
+                query["timestamp"] = {"$gt": summary_doc["covered_until"]}
+
+            cursor = self.collection.find(
+                query,
+                {"_id": 0, "user_message": 1, "ai_response": 1, "timestamp": 1},
+                sort=[("timestamp", -1)],
+                limit=self.max_loaded_turns,
+            )
+            newest_first = await cursor.to_list(length=self.max_loaded_turns)
+        self.turns = list(reversed(newest_first))
+        self._trim()
+        return self
+
+    @property
+    def empty(self) -> bool:
+        """No earlier turns or summary, so a prompt depends on the question alone"""
+        return not self.summary and not self.turns
+
+    def messages(self) -> List[BaseMessage]:
+        messages: List[BaseMessage] = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        for turn in self.turns:
+            messages.append(HumanMessage(content=turn["user_message"]))
+            messages.append(AIMessage(content=turn["ai_response"]))
+        return messages
+
+    async def add_turn(self, user_message: str, ai_response: str, extra: Optional[dict] = None) -> None:
+        """Persist a turn to chat_history and keep the window within budget"""
+        turn = {
+            **self.turn_filter,
+            **(extra or {}),
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "timestamp": datetime.now(),
+        }
+        try:
+            with stage("mongo.chat_history_insert"):
+                await self.collection.insert_one(dict(turn))
+        except Exception as e:
+            logger.error(f"Error saving chat history to DB: {str(e)}")
+        self.turns.append({k: turn[k] for k in ("user_message", "ai_response", "timestamp")})
+        self._trim()
+
+    def _trim(self) -> None:
+        evicted = []
+        # always keep the latest turn, even if it alone exceeds the budget
+        while len(self.turns) > 1 and self._used_tokens() > self.token_budget:
+            evicted.append(self.turns.pop(0))
+        if evicted:
+            task = asyncio.create_task(self._fold_into_summary(evicted))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    async def _fold_into_summary(self, evicted: List[dict]) -> None:
+        """Fold ``evicted`` into the stored summary.
+
+        The summary is re-read first and only replaced if its ``covered_until`` is
+        still the value that was read, so a summary written meanwhile by another
+        request is built on rather than overwritten.
+        """
+        async with self._summary_lock:
+            for _ in range(SUMMARY_ATTEMPTS):
+                current = await self.collection.find_one(self._summary_filter, {"summary": 1, "covered_until": 1})
+                covered_until = current.get("covered_until") if current else None
+                pending = [turn for turn in evicted if covered_until is None or turn["timestamp"] > covered_until]
+                if not pending:
+                    # another request already folded these turns in
+                    self.summary = current.get("summary", "")
+                    return
+                try:
+                    summary = await self.summarize(current.get("summary", "") if current else "", pending)
+                except Exception as e:
+                    logger.warning(f"Could not summarize conversation {self.session_key}: {e}")
+                    return
+                guard = {"covered_until": covered_until} if current else {"covered_until": {"$exists": False}}
+                resp = await self.collection.update_one(
+                    {**self._summary_filter, **guard},
+                    {"$set": {"summary": summary, "covered_until": pending[-1]["timestamp"],
+                              "updated_at": datetime.now()}},
+                    upsert=current is None,
+                )
+                if resp.matched_count or resp.upserted_id is not None:
+                    self.summary = summary
+                    return
+            logger.warning(f"Summary of {self.session_key} kept changing; {len(evicted)} turns were not folded in")
@@ -0,0 +1,102 @@
+"""Prometheus metrics, OpenTelemetry spans and logging setup.
+
+Wrap each stage of a request in ``stage()``: it records the duration in the
+``rag_stage_seconds`` histogram and opens a tracing span. Spans are no-ops unless
+``OTEL_EXPORTER_OTLP_ENDPOINT`` is set, in which case ``configure_tracing`` exports
+them over OTLP.
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from opentelemetry import trace
+from prometheus_client import Gauge, Histogram, generate_latest, start_http_server
+
+tracer = trace.get_tracer("rag")
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Duration of request and ingestion stages",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+EXECUTOR_QUEUE_DEPTH = Gauge("rag_executor_queue_depth", "Tasks waiting for a thread pool worker", ["executor"])
+INGEST_JOBS = Gauge("rag_ingest_jobs", "Ingest jobs by status", ["status"])
+LLM_IN_FLIGHT = Gauge("rag_llm_in_flight", "Chat completions currently holding a slot")
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a block as ``name`` in the stage histogram and a tracing span"""
+    started = time.perf_counter()
+    with tracer.start_as_current_span(name, attributes=attributes or None):
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record a duration measured elsewhere, e.g. time to the first LLM token"""
+    STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def track_executor(name: str, executor) -> None:
+    # ThreadPoolExecutor keeps pending work in _work_queue
+    EXECUTOR_QUEUE_DEPTH.labels(name).set_function(lambda: executor._work_queue.qsize())
+
+
+def set_ingest_job_counts(counts: dict) -> None:
+    for job_status, count in counts.items():
+        INGEST_JOBS.labels(job_status).set(count)
+
+
+def render() -> bytes:
+    return generate_latest()
+
+
+def start_metrics_server(port: int) -> None:
+    """Expose /metrics from a process without an HTTP app (ingest workers)"""
+    start_http_server(port)
+
+
+def configure_tracing(service_name: str) -> None:
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        span = trace.get_current_span().get_span_context()
+        if span.is_valid:
+            entry["trace_id"] = format(span.trace_id, "032x")
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """Log at LOG_LEVEL (default INFO); LOG_FORMAT=json emits one JSON object per line"""
+    handler = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=(level or os.getenv("LOG_LEVEL", "INFO")).upper(), handlers=[handler], force=True)
@@ -0,0 +1,46 @@
+import base64
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+
+def encode_cursor(sort_value: datetime, object_id: ObjectId) -> str:
+    raw = json.dumps({"t": sort_value.isoformat(), "id": str(object_id)})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Inverse of ``encode_cursor``; raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(data["t"]), ObjectId(data["id"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_filter(field: str, cursor: Optional[str], older: bool) -> dict:
+    """Filter for rows strictly before (``older``) or after the cursor in (field, _id) order"""
+    if not cursor:
+        return {}
+    value, object_id = decode_cursor(cursor)
+    op = "$lt" if older else "$gt"
+    return {"$or": [{field: {op: value}}, {field: value, "_id": {op: object_id}}]}
+
+
+def page_cursor(doc: dict, field: str) -> str:
+    return encode_cursor(doc[field], doc["_id"])
+
+
+async def ndjson_lines(cursor) -> AsyncIterator[str]:
+    """Serialize a Mongo cursor one document per line without materializing it"""
+    async for doc in cursor:
+        doc.pop("_id", None)
+        yield json.dumps(jsonable_encoder(doc)) + "\n"
+
+
+def wants_ndjson(request, format: Optional[str]) -> bool:
+    return format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
@@ -0,0 +1,18 @@
+"""PDF text extraction run inside the parsing process pool.
+
+Kept free of heavy imports so spawned pool processes start quickly.
+"""
+from typing import List, Tuple
+
+from pypdf import PdfReader
+
+
+def pdf_page_count(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract the text of pages ``start`` to ``end - 1`` (zero-based)"""
+    reader = PdfReader(file_path)
+    return [(page_number, reader.pages[page_number].extract_text() or "")
+            for page_number in range(start, min(end, len(reader.pages)))]
@@ -1,18 +1,21 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
 from pydantic import BaseModel
-from database import connec_db
+from pymongo.errors import DuplicateKeyError
+from database import mongo
+from security import get_auth_settings, invalidate_user, validate_token
 import uuid
 import bcrypt
 import jwt 
 import datetime
-import os
+import logging
+import re
 from dotenv import load_dotenv
 
 
 app = FastAPI();
 router = APIRouter()
-db = connec_db()
 load_dotenv()
+logger = logging.getLogger("auth")
 
 class LoginRequest(BaseModel):
     username: str
@@ -23,43 +26,50 @@ class signupRequest(BaseModel):
     email: str
     password: str
 
+class PasswordChangeRequest(BaseModel):
+    current_password: str
+    new_password: str
+
+class AccountDeleteRequest(BaseModel):
+    password: str
+
 @router.post("/login")
 async def login(login_request: LoginRequest):
     try:
-        user = db.users.find_one({"$or": [
+        user = await mongo.users.find_one({"$or": [
         {"username": login_request.username},
         {"email": login_request.username}
                 ]})
-        print(login_request.username)
         
         if not user:
             return {"message": "User not found"}
         if bcrypt.checkpw(login_request.password.encode('utf-8'), user['password']):
+            settings = get_auth_settings()
             paylod = {
                 "user_id": user['id'],
                 "email": user['email'],
-                "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=30) 
+                "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=settings.token_minutes) 
             }
             token = jwt.encode(
                 paylod, 
-                os.getenv("JWT_SECRET_KEY"), 
-                algorithm=os.getenv("ALGORITHM")
+                settings.secret_key, 
+                algorithm=settings.algorithm
                 )
             return {"token":token,"message": "Login successful"}
         else:
             return {"message": "Invalid credentials"}
     except Exception as ex:
-        print(ex)
+        logger.exception(f"Login failed: {ex}")
         return {"message": "An error occurred during login"}
 
 @router.post("/register")
 async def register(signup_request: signupRequest):
     try:
-        user = db.users.find_one({"email": signup_request.email})
+        user = await mongo.users.find_one({"email": signup_request.email})
         if user:
             return {"message": "User already exists"}
         
-        resp = db.users.insert_one({
+        resp = await mongo.users.insert_one({
             "id": str(uuid.uuid4()),
             "username": signup_request.username,
             "email": signup_request.email,
@@ -69,6 +79,49 @@ async def register(signup_request: signupRequest):
             return {"message": "Registration failed"}
         else:
             return {"message": "Registration successful"}
+    except DuplicateKeyError:
+        # a concurrent registration with the same email got in first
+        return {"message": "User already exists"}
+    except Exception as ex:
+        logger.exception(f"Registration failed: {ex}")
+        return {"message": "An error occurred during registration"}
+
+@router.post("/password")
+async def change_password(change_request: PasswordChangeRequest, decoded_token: dict = Depends(validate_token)):
+    try:
+        user_id = decoded_token["user_id"]
+        user = await mongo.users.find_one({"id": user_id})
+        if not user or not bcrypt.checkpw(change_request.current_password.encode('utf-8'), user['password']):
+            return {"message": "Invalid credentials"}
+        await mongo.users.update_one({"id": user_id}, {"$set": {
+            "password": bcrypt.hashpw(change_request.new_password.encode('utf-8'), bcrypt.gensalt(5))
+        }})
+        invalidate_user(user_id)
+        return {"message": "Password changed"}
+    except Exception as ex:
+        logger.exception(f"Password change failed: {ex}")
+        return {"message": "An error occurred during password change"}
+
+@router.delete("/me")
+async def delete_account(delete_request: AccountDeleteRequest, decoded_token: dict = Depends(validate_token)):
+    """Delete the caller's account and chat history. Their documents are unregistered
+    here; the garbage collector reclaims their vectors, segments and files."""
+    try:
+        user_id = decoded_token["user_id"]
+        user = await mongo.users.find_one({"id": user_id})
+        if not user or not bcrypt.checkpw(delete_request.password.encode('utf-8'), user['password']):
+            return {"message": "Invalid credentials"}
+        await mongo.users.delete_one({"id": user_id})
+        # drop the cached verification first so the deleted account's tokens stop working here
+        invalidate_user(user_id)
+        await mongo.user_documents.delete_many({"user_id": user_id})
+        await mongo.upload_sessions.delete_many({"user_id": user_id})
+        # document and all-documents summaries are keyed "doc:<doc_id>:<user_id>" and "all:<user_id>"
+        await mongo.chat_history.delete_many({"$or": [
+            {"user_id": user_id},
+            {"kind": "summary", "session_id": {"$regex": f":{re.escape(user_id)}$"}},
+        ]})
+        return {"message": "Account deleted"}
     except Exception as ex:
-        print(ex)
-        return {"message": "An error occurred during registration"}
\ No newline at end of file
+        logger.exception(f"Account deletion failed: {ex}")
+        return {"message": "An error occurred during account deletion"}
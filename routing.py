@@ -0,0 +1,36 @@
+import hashlib
+import os
+
+# Collection that held every document before per-tenant collections were introduced
+LEGACY_COLLECTION = "default"
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+class CollectionRouter:
+    """Maps users and documents to Chroma collections.
+
+    Every user gets ``shards_per_tenant`` collections of their own, and a document
+    lives in the shard chosen by hashing its id. The chosen name is stored with the
+    document, so per-document queries touch one small collection and per-user queries
+    fan out over that user's shards only; query cost depends on the size of the
+    tenant rather than on the number of tenants.
+    """
+
+    def __init__(self, shards_per_tenant: int = 1, prefix: str = "tenant"):
+        self.shards_per_tenant = max(1, shards_per_tenant)
+        self.prefix = prefix
+
+    @classmethod
+    def from_env(cls) -> "CollectionRouter":
+        return cls(shards_per_tenant=int(os.getenv("CHROMA_SHARDS_PER_TENANT", "1")))
+
+    def _name(self, user_id: str, shard: int) -> str:
+        # Chroma names: 3-63 characters of [a-zA-Z0-9._-]
+        return f"{self.prefix}_{_digest(user_id)[:16]}_{shard}"
+
+    def for_document(self, user_id: str, document_id: str) -> str:
+        shard = int(_digest(document_id)[:8], 16) % self.shards_per_tenant
+        return self._name(user_id, shard)
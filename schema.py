@@ -0,0 +1,198 @@
+"""Mongo schema bootstrap: declared indexes, migrations and query plan checks.
+
+``ensure_schema`` is run from the app lifespan and by ingest workers at startup.
+Pending migrations run first, so they can clean up data a new unique index would
+reject. Index creation is idempotent, so running it on every start is cheap.
+"""
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+
+logger = logging.getLogger("schema")
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        # login looks users up by username or email
+        IndexModel([("username", ASCENDING)], name="username"),
+    ],
+    "user_documents": [
+        IndexModel([("document_id", ASCENDING)], unique=True, name="document_id_unique"),
+        IndexModel([("user_id", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)], name="user_upload_date_id"),
+        # startup warms the Chroma collections of the latest uploads
+        IndexModel([("upload_date", DESCENDING)], name="upload_date"),
+    ],
+    "chat_history": [
+        IndexModel([("doc_id", ASCENDING), ("user_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+                   name="doc_user_timestamp_id"),
+        # websocket turns and conversation summaries are keyed by session
+        IndexModel([("session_id", ASCENDING), ("timestamp", ASCENDING)], name="session_timestamp",
+                   partialFilterExpression={"session_id": {"$exists": True}}),
+        # all-documents chat turns are keyed by user and scope
+        IndexModel([("user_id", ASCENDING), ("scope", ASCENDING), ("timestamp", ASCENDING)],
+                   name="user_scope_timestamp"),
+    ],
+    "ingest_jobs": [
+        IndexModel([("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+                   name="claim_order"),
+        IndexModel([("document_id", ASCENDING), ("created_at", DESCENDING)], name="document_jobs"),
+        # at most one queued or running job per document
+        IndexModel([("document_id", ASCENDING)], unique=True, name="one_active_job_per_document",
+                   partialFilterExpression={"active": True}),
+        # duplicate uploads look for completed jobs of the same file
+        IndexModel([("file_hash", ASCENDING), ("status", ASCENDING)], name="file_hash_status"),
+    ],
+    "upload_sessions": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # abandoned resumable uploads are removed after a week
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600, name="expire_stale"),
+    ],
+}
+
+
+class MigrationError(RuntimeError):
+    """A migration can't proceed without an operator fixing the data first"""
+
+
+Migration = Callable[[AsyncDatabase], Awaitable[None]]
+MIGRATIONS: List[Tuple[int, str, Migration]] = []
+
+
+def migration(version: int, description: str):
+    """Register a one-off data migration; each version runs once per database"""
+    def register(func: Migration) -> Migration:
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+@migration(1, "Key all-documents chat turns by user_id and scope instead of session_id")
+async def scope_all_document_turns(db: AsyncDatabase) -> None:
+    # turns stored as session_id "all:<user_id>" could be read by any client sending that session id
+    await db.chat_history.update_many(
+        {"session_id": {"$regex": "^all:"}, "kind": {"$exists": False}},
+        [
+            {"$set": {
+                "scope": "all_documents",
+                "user_id": {"$substrCP": ["$session_id", 4, {"$subtract": [{"$strLenCP": "$session_id"}, 4]}]},
+            }},
+            {"$unset": "session_id"},
+        ],
+    )
+
+
+async def _duplicates(collection: AsyncCollection, field: str) -> List[dict]:
+    """Groups of rows sharing a value of ``field`` (missing counts as null), oldest row first"""
+    pipeline = [
+        {"$group": {"_id": {"$ifNull": [f"${field}", None]}, "rows": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ]
+    groups = [group async for group in await collection.aggregate(pipeline)]
+    for group in groups:
+        group["rows"].sort()
+    return groups
+
+
+@migration(2, "Resolve duplicate user ids and check emails before the unique indexes are built")
+async def deduplicate_users(db: AsyncDatabase) -> None:
+    now = datetime.now(timezone.utc)
+    for group in await _duplicates(db.users, "id"):
+        if group["_id"] is None:
+            # rows without an id can't log in; give each its own so the index can be built
+            for row_id in group["rows"]:
+                await db.users.update_one({"_id": row_id}, {"$set": {"id": str(uuid.uuid4())}})
+            logger.warning(f"Assigned ids to {len(group['rows'])} users that had none")
+            continue
+        # the same id twice is a double-submitted registration: keep the oldest row
+        extra = group["rows"][1:]
+        async for row in db.users.find({"_id": {"$in": extra}}):
+            await db.users_duplicates.insert_one({**row, "duplicate_of": "id", "moved_at": now})
+        await db.users.delete_many({"_id": {"$in": extra}})
+        logger.warning(f"Moved {len(extra)} duplicate rows of user {group['_id']} to users_duplicates")
+
+    # separate accounts sharing an email: which one keeps it is an operator's call, and
+    # renaming the others would lock them out, so stop until they are resolved
+    collisions = await _duplicates(db.users, "email")
+    if collisions:
+        details = "; ".join(f"{group['_id']!r}: users {', '.join(str(row) for row in group['rows'])}"
+                            for group in collisions)
+        raise MigrationError(f"Users share an email, so the unique email index can't be built. Change or "
+                             f"merge these accounts and restart: {details}")
+
+
+async def ensure_indexes(db: AsyncDatabase) -> None:
+    for collection_name, indexes in INDEXES.items():
+        await db[collection_name].create_indexes(indexes)
+
+
+async def run_migrations(db: AsyncDatabase) -> List[int]:
+    applied = {doc["_id"] async for doc in db.schema_migrations.find({}, {"_id": 1})}
+    ran = []
+    for version, description, func in MIGRATIONS:
+        if version in applied:
+            continue
+        await func(db)
+        await db.schema_migrations.insert_one({
+            "_id": version,
+            "description": description,
+            "applied_at": datetime.now(timezone.utc),
+        })
+        ran.append(version)
+    return ran
+
+
+async def ensure_schema(db: AsyncDatabase) -> List[int]:
+    """Apply pending migrations, then create the declared indexes"""
+    ran = await run_migrations(db)
+    await ensure_indexes(db)
+    return ran
+
+
+# The queries on the request path, as (collection, filter, sort)
+HOT_QUERIES = {
+    "login": ("users", {"$or": [{"username": "u"}, {"email": "u"}]}, None),
+    "validate_token": ("users", {"id": "u"}, None),
+    "list_documents": ("user_documents", {"user_id": "u"}, [("upload_date", DESCENDING), ("_id", DESCENDING)]),
+    "document_lookup": ("user_documents", {"document_id": "d"}, None),
+    "chat_history": ("chat_history", {"doc_id": "d", "user_id": "u"}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    "claim_job": ("ingest_jobs", {"status": "queued"}, [("priority", DESCENDING), ("created_at", ASCENDING)]),
+    "active_job": ("ingest_jobs", {"document_id": "d", "status": {"$in": ["queued", "running"]}}, None),
+    "duplicate_file": ("ingest_jobs", {"file_hash": "h", "status": "completed"}, None),
+    "all_documents_chat": ("chat_history", {"user_id": "u", "scope": "all_documents"}, [("timestamp", DESCENDING)]),
+    "session_chat": ("chat_history", {"session_id": "s"}, [("timestamp", DESCENDING)]),
+}
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return [stage for stage in stages if stage]
+
+
+async def explain_stages(db: AsyncDatabase, collection_name: str, query: dict, sort=None) -> List[str]:
+    """Stages of the winning plan, e.g. ['FETCH', 'IXSCAN']"""
+    command = {"find": collection_name, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    explained = await db.command({"explain": command, "verbosity": "queryPlanner"})
+    return _plan_stages(explained["queryPlanner"]["winningPlan"])
+
+
+async def check_query_plans(db: AsyncDatabase) -> Dict[str, dict]:
+    """Explain every hot query; ``uses_index`` is False when a collection scan is planned"""
+    report = {}
+    for name, (collection_name, query, sort) in HOT_QUERIES.items():
+        stages = await explain_stages(db, collection_name, query, sort)
+        report[name] = {"stages": stages, "uses_index": "COLLSCAN" not in stages}
+    return report
@@ -0,0 +1,120 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import jwt
+from fastapi import HTTPException, Request, status
+
+from database import mongo
+from metrics import stage
+
+
+@dataclass(frozen=True)
+class AuthSettings:
+    secret_key: str
+    algorithm: str
+    token_minutes: int = 30
+
+
+_settings: Optional[AuthSettings] = None
+
+
+def load_auth_settings() -> AuthSettings:
+    """Read the JWT settings from the environment (called once at startup)"""
+    global _settings
+    _settings = AuthSettings(
+        secret_key=os.getenv("JWT_SECRET_KEY"),
+        algorithm=os.getenv("ALGORITHM"),
+        token_minutes=int(os.getenv("JWT_TOKEN_MINUTES", "30")),
+    )
+    verified_users.ttl_seconds = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60"))
+    verified_users.max_entries = int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "10000"))
+    return _settings
+
+
+def get_auth_settings() -> AuthSettings:
+    return _settings or load_auth_settings()
+
+
+class VerifiedUserCache:
+    """Bounded, short-lived set of user ids known to exist.
+
+    An entry never outlives the token it was verified with, and ``invalidate``
+    removes a user immediately (call it when a user is changed or deleted). Other
+    API processes drop their entry within ``ttl_seconds``.
+    """
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+
+    def contains(self, user_id: str) -> bool:
+        expires_at = self._entries.get(user_id)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            del self._entries[user_id]
+            return False
+        self._entries.move_to_end(user_id)
+        return True
+
+    def add(self, user_id: str, token_exp: Optional[float] = None) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        self._entries[user_id] = expires_at
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+
+
+verified_users = VerifiedUserCache()
+
+
+def invalidate_user(user_id: str) -> None:
+    verified_users.invalidate(user_id)
+
+
+def decode_token(token: str) -> dict:
+    settings = get_auth_settings()
+    try:
+        return jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {str(e)}")
+
+
+async def validate_token(request: Request) -> dict:
+    """FastAPI dependency: verify the bearer token and return its claims.
+
+    The signature and expiry are checked on every request; the user lookup in Mongo
+    only happens when the user id isn't in the verified-user cache.
+    """
+    with stage("auth"):
+        auth_header = request.headers.get("Authorization")
+        if not auth_header:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing Authorization header")
+
+        parts = auth_header.split()
+        if len(parts) != 2 or parts[0].lower() != "bearer":
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Authorization header")
+
+        decoded_token = decode_token(parts[1])
+        user_id = decoded_token.get("user_id")
+        if not user_id:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+
+        if not verified_users.contains(user_id):
+            with stage("mongo.user_lookup"):
+                user = await mongo.users.find_one({"id": user_id}, {"_id": 1})
+            if not user:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+            verified_users.add(user_id, decoded_token.get("exp"))
+        return decoded_token
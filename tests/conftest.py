@@ -0,0 +1,30 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mongo_database():
+    """(uri, name) of a throwaway database on the mongod at MONGO_URI; skips when none is reachable.
+
+    Async clients are bound to the event loop that uses them, so each test opens its own.
+    """
+    pymongo = pytest.importorskip("pymongo")
+
+    uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+    client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        client.close()
+        pytest.skip(f"no mongod reachable at {uri}")
+
+    name = f"test_{uuid.uuid4().hex[:8]}"
+    yield uri, name
+    client.drop_database(name)
+    client.close()
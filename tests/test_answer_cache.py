@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+import answer_cache
+from answer_cache import AnswerCache, normalize_question
+
+
+def test_exact_lookup_ignores_case_spacing_and_punctuation():
+    cache = AnswerCache()
+    cache.store("doc", "What is the warranty period?", [1.0, 0.0], {"content": "Two years"})
+    assert normalize_question("  what IS the   warranty period ") == "what is the warranty period"
+    assert cache.lookup_exact("doc", "what is the warranty  period") == {"content": "Two years"}
+    assert cache.lookup_exact("other", "What is the warranty period?") is None
+
+
+def test_semantic_lookup_needs_the_similarity_threshold():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.store("doc", "How long is the warranty?", [1.0, 0.0, 0.0], {"content": "Two years"})
+    cache.store("doc", "Who makes the pump?", [0.0, 1.0, 0.0], {"content": "Acme"})
+    assert cache.lookup_similar("doc", [0.99, 0.05, 0.0]) == {"content": "Two years"}
+    assert cache.lookup_similar("doc", [0.7, 0.7, 0.0]) is None
+    assert cache.lookup_similar("empty", [1.0, 0.0, 0.0]) is None
+    stats = cache.stats()
+    assert (stats["semantic_hits"], stats["misses"]) == (1, 2)
+    assert stats["hit_rate"] == pytest.approx(1 / 3, abs=1e-4)
+
+
+def test_new_generation_and_invalidate_drop_a_documents_answers():
+    cache = AnswerCache()
+    cache.store("doc", "q", [1.0], {"content": "old"}, generation=1)
+    assert cache.lookup_exact("doc", "q", generation=2) is None
+    cache.store("doc", "q", [1.0], {"content": "new"}, generation=2)
+    assert cache.lookup_exact("doc", "q", generation=2) == {"content": "new"}
+    cache.invalidate("doc")
+    assert cache.lookup_exact("doc", "q", generation=2) is None
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(ttl_seconds=60)
+    cache.store("doc", "q", [1.0], {"content": "a"})
+    now[0] += 59
+    assert cache.lookup_exact("doc", "q") == {"content": "a"}
+    now[0] += 1
+    assert cache.lookup_exact("doc", "q") is None
+    assert cache.lookup_similar("doc", [1.0]) is None
+
+
+def test_least_recently_used_entries_and_documents_are_evicted():
+    cache = AnswerCache(max_entries_per_doc=2, max_docs=2)
+    cache.store("doc", "a", [1.0], {"content": "a"})
+    cache.store("doc", "b", [1.0], {"content": "b"})
+    cache.lookup_exact("doc", "a")
+    cache.store("doc", "c", [1.0], {"content": "c"})
+    assert cache.lookup_exact("doc", "b") is None
+    assert cache.lookup_exact("doc", "a") == {"content": "a"}
+
+    cache.store("second", "q", [1.0], {"content": "q"})
+    cache.store("third", "q", [1.0], {"content": "q"})
+    assert cache.lookup_exact("doc", "a") is None
+    assert cache.stats()["documents"] == 2
+    assert cache.stats()["evictions"] == 2
@@ -0,0 +1,110 @@
+import pytest
+
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain")
+
+from langchain_core.documents import Document
+
+from chunking import (STRATEGIES, ChunkingConfig, SectionChunker, SentenceWindowChunker, build_chunker,
+                      count_tokens, is_heading, is_table_line, sentence_spans, split_sentences)
+
+PAGE = """1. Scope
+This manual covers the installation of the pump. Read it before starting.
+
+2. Specifications
+Model      Flow     Pressure
+P-100      20 l/m   4 bar
+P-200      35 l/m   6 bar
+
+3. Maintenance
+Inspect the seals every spring. Replace the filter after 500 hours.
+"""
+
+
+def page(text=PAGE, **metadata):
+    return Document(page_content=text, metadata={"page": 1, **metadata})
+
+
+def test_config_roundtrips_through_collection_metadata():
+    config = ChunkingConfig.for_strategy("sentence_window", window=2)
+    metadata = config.to_metadata()
+    assert all(key.startswith("chunking_") for key in metadata)
+    assert ChunkingConfig.from_metadata({**metadata, "hnsw:space": "l2"}) == config
+    assert ChunkingConfig.from_metadata({"hnsw:space": "l2"}) is None
+    assert ChunkingConfig.from_metadata(None) is None
+
+
+def test_config_rejects_unknown_strategies_and_fills_defaults():
+    with pytest.raises(ValueError):
+        ChunkingConfig(strategy="semantic")
+    assert ChunkingConfig.for_strategy("token") == ChunkingConfig("token", 512, 64, 3)
+    assert ChunkingConfig.for_strategy("recursive", chunk_overlap=0).chunk_overlap == 0
+
+
+def test_small_chunk_sizes_scale_the_default_overlap():
+    assert ChunkingConfig.for_strategy("pdf_section", chunk_size=40).chunk_overlap == 5
+    assert ChunkingConfig.for_strategy("recursive", chunk_size=100).chunk_overlap == 20
+    assert ChunkingConfig.for_strategy("token", chunk_size=2048).chunk_overlap == 64
+
+
+@pytest.mark.parametrize("size, overlap, window", [(40, 40, 3), (40, 64, 3), (0, 0, 3), (40, -1, 3), (40, 0, -1)])
+def test_config_rejects_sizes_the_splitters_cannot_use(size, overlap, window):
+    with pytest.raises(ValueError):
+        ChunkingConfig("token", size, overlap, window)
+    with pytest.raises(ValueError):
+        ChunkingConfig.from_metadata(ChunkingConfig("token").to_metadata() | {
+            "chunking_chunk_size": size, "chunking_chunk_overlap": overlap, "chunking_window": window})
+
+
+def test_sentence_spans_exclude_whitespace():
+    text = "  First one.  Second one!\nThird line without stop"
+    assert [text[start:end] for start, end in sentence_spans(text)] == split_sentences(text)
+    assert split_sentences(text) == ["First one.", "Second one!", "Third line without stop"]
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_every_strategy_records_start_index_of_its_text(strategy):
+    config = ChunkingConfig.for_strategy(strategy, chunk_size=40 if strategy != "recursive" else 120,
+                                         chunk_overlap=0 if strategy == "sentence_window" else 10)
+    chunks = build_chunker(config).split_documents([page(document_id="doc")])
+    assert len(chunks) > 1
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert PAGE[start:start + len(chunk.page_content)] == chunk.page_content
+        assert chunk.metadata["document_id"] == "doc"
+
+
+def test_headings_and_tables_are_detected():
+    assert is_heading("2. Specifications")
+    assert is_heading("CHAPTER IV")
+    assert not is_heading("Inspect the seals every spring.")
+    assert is_table_line("P-100      20 l/m   4 bar")
+    assert not is_table_line("Inspect the seals every spring.")
+
+
+def test_section_chunker_keeps_tables_whole_and_records_sections():
+    chunks = SectionChunker(ChunkingConfig.for_strategy("pdf_section", chunk_size=40)).split_documents([page()])
+    table = [c for c in chunks if "P-100" in c.page_content]
+    assert len(table) == 1
+    assert "P-200" in table[0].page_content
+    assert table[0].metadata["section"] == "2. Specifications"
+    assert all(count_tokens(c.page_content) <= 40 for c in chunks)
+
+
+def test_section_chunker_packs_small_sections_but_not_across_pages():
+    config = ChunkingConfig.for_strategy("pdf_section", chunk_size=512)
+    chunks = SectionChunker(config).split_documents([page(), page("Another page.", page=2)])
+    assert [c.metadata["page"] for c in chunks] == [1, 2]
+    assert chunks[0].page_content == PAGE.strip()
+
+
+def test_sentence_window_chunks_carry_their_window():
+    text = " ".join(f"Sentence number {i} is here." for i in range(8))
+    config = ChunkingConfig.for_strategy("sentence_window", chunk_size=8, window=2)
+    chunks = SentenceWindowChunker(config).split_documents([page(text)])
+    sentences = split_sentences(text)
+    assert [c.page_content for c in chunks] == sentences
+    middle = chunks[4].metadata
+    assert middle["window"] == " ".join(sentences[2:7])
+    assert text[middle["window_start"]:].startswith(middle["window"])
+    assert chunks[0].metadata["window"] == " ".join(sentences[0:3])
@@ -0,0 +1,96 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from compact_vectors import (VectorConfig, VectorIndex, VectorSegment, VectorSegmentBuilder, quantize_binary,
+                             quantize_int8, truncate)
+
+
+def unit_vectors(count, dimensions=64, seed=0):
+    return truncate(np.random.default_rng(seed).normal(size=(count, dimensions)))
+
+
+def write_segment(path, vectors, config):
+    builder = VectorSegmentBuilder(config)
+    builder.add([f"c{i}" for i in range(len(vectors))], vectors)
+    builder.write(path)
+    return VectorSegment(path)
+
+
+def test_config_validates_quantization():
+    with pytest.raises(ValueError):
+        VectorConfig(dimensions=100, quantization="binary")
+    with pytest.raises(ValueError):
+        VectorConfig(quantization="float16")
+    assert VectorConfig(dimensions=0, quantization="binary").compact
+    assert not VectorConfig().compact
+
+
+def test_config_roundtrips_through_collection_metadata():
+    config = VectorConfig(256, "int8", 8)
+    assert VectorConfig.from_metadata({**config.to_metadata(), "chunking_strategy": "token"}) == config
+    assert VectorConfig.from_metadata({"chunking_strategy": "token"}) is None
+
+
+def test_truncate_renormalizes_the_prefix():
+    vectors = truncate(np.array([[3.0, 4.0, 12.0], [0.0, 0.0, 0.0]]), dimensions=2)
+    assert vectors.shape == (2, 2)
+    assert np.allclose(vectors[0], [0.6, 0.8])
+    assert np.allclose(vectors[1], [0.0, 0.0])
+
+
+def test_int8_codes_reconstruct_the_vectors():
+    vectors = unit_vectors(10)
+    codes, scales = quantize_int8(vectors)
+    assert codes.dtype == np.int8 and np.abs(codes).max() == 127
+    assert np.allclose(codes * scales[:, None], vectors, atol=scales.max())
+
+
+def test_binary_codes_pack_sign_bits():
+    codes = quantize_binary(np.array([[1.0, -1.0, 0.5, -0.5, 0.0, 2.0, -2.0, 1.0]]))
+    assert codes.tolist() == [[0b10100101]]
+
+
+@pytest.mark.parametrize("config", [VectorConfig(32, "int8"), VectorConfig(32, "binary"), VectorConfig(0, "int8")])
+def test_search_with_rescoring_recovers_exact_neighbours(tmp_path, config):
+    vectors = unit_vectors(300)
+    segment = write_segment(str(tmp_path / "doc"), vectors, config)
+    rng = np.random.default_rng(1)
+    hits = 0
+    for row in range(0, 300, 10):
+        query = truncate(vectors[row] + rng.normal(scale=0.02, size=vectors.shape[1]))
+        exact = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+        found = segment.search(query, k=5, rescore_factor=config.rescore_factor)
+        assert found[0][0] == f"c{row}"
+        assert found[0][1] == pytest.approx(float(((vectors[row] - query) ** 2).sum()), rel=1e-4)
+        hits += len({f"c{i}" for i in exact} & {chunk_id for chunk_id, _ in found})
+    if not config.dimensions:
+        # int8 codes of the full vectors barely change the ranking
+        assert hits / (30 * 5) >= 0.9
+
+
+def test_rescore_and_vectors_for_use_full_precision_rows(tmp_path):
+    vectors = unit_vectors(20)
+    segment = write_segment(str(tmp_path / "doc"), vectors, VectorConfig(16, "none"))
+    assert segment.codes is None
+    assert segment.search(vectors[0], k=3) == []
+    distances = segment.rescore(vectors[3], ["c3", "missing", "c4"])
+    assert distances[0] == pytest.approx(0.0, abs=1e-6)
+    assert distances[1] is None
+    assert distances[2] == pytest.approx(float(((vectors[4] - vectors[3]) ** 2).sum()), rel=1e-5)
+    assert segment.rescore(vectors[3], ["missing"]) == [None]
+    assert np.allclose(segment.vectors_for(["c5", "c1"]), vectors[[5, 1]])
+
+
+def test_vector_index_loads_the_current_segment(tmp_path):
+    index = VectorIndex(root=str(tmp_path))
+    assert index.load_vectors("tenant", "doc") == {}
+    builder = VectorSegmentBuilder(VectorConfig(0, "binary"))
+    vectors = unit_vectors(4)
+    builder.add(["a", "b", "c", "d"], vectors)
+    index.write("tenant", "doc", builder)
+    loaded = index.load_vectors("tenant", "doc")
+    assert sorted(loaded) == ["a", "b", "c", "d"]
+    assert np.allclose(loaded["c"], vectors[2])
+    index.delete("tenant", "doc")
+    assert index.load_vectors("tenant", "doc") == {}
@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain")
+
+from context_builder import ContextBuilder, _text_overlap, compress_text
+
+TEXT = ("The pump must be inspected every spring. Seals are replaced after ten years. "
+        "The valve housing is cast iron. Warranty claims need the serial number. "
+        "Hoses are not covered by the warranty.")
+
+
+def hit(content, start=None, page=1, document_id="doc", **metadata):
+    metadata = {"document_id": document_id, "page": page, **metadata}
+    if start is not None:
+        metadata["start_index"] = start
+    return {"content": content, "metadata": metadata}
+
+
+def test_overlapping_start_index_chunks_merge_into_the_source_text():
+    first, second = hit(TEXT[0:90], start=0), hit(TEXT[60:160], start=60)
+    passages = ContextBuilder().merge_overlapping([second, first])
+    assert len(passages) == 1
+    assert passages[0]["content"] == TEXT[0:160]
+    assert passages[0]["rank"] == 0
+    assert len(passages[0]["chunks"]) == 2
+
+
+def test_contained_chunk_does_not_extend_the_passage():
+    passages = ContextBuilder().merge_overlapping([hit(TEXT[0:120], start=0), hit(TEXT[20:80], start=20)])
+    assert [p["content"] for p in passages] == [TEXT[0:120]]
+
+
+def test_chunks_with_a_gap_stay_separate():
+    passages = ContextBuilder().merge_overlapping([hit(TEXT[0:40], start=0), hit(TEXT[41:80], start=41)])
+    assert [p["content"] for p in passages] == [TEXT[0:40], TEXT[41:80]]
+
+
+def test_chunks_on_other_pages_or_documents_are_not_merged():
+    chunks = [hit(TEXT[0:90], start=0), hit(TEXT[60:160], start=60, page=2),
+              hit(TEXT[60:160], start=60, document_id="other")]
+    assert len(ContextBuilder().merge_overlapping(chunks)) == 3
+
+
+def test_chunks_without_start_index_merge_on_text_overlap():
+    passages = ContextBuilder().merge_overlapping([hit(TEXT[60:160]), hit(TEXT[0:90])])
+    assert [p["content"] for p in passages] == [TEXT[0:160]]
+
+
+def test_text_overlap_ignores_short_coincidences():
+    assert _text_overlap("ends with the pump", "the pump starts here") == 0
+    assert _text_overlap(TEXT[:90], TEXT[60:]) == 30
+
+
+def test_near_duplicates_of_a_better_passage_are_dropped():
+    builder = ContextBuilder(duplicate_threshold=0.8)
+    passages = [{"content": TEXT, "chunks": [], "rank": 0},
+                {"content": TEXT[:120], "chunks": [], "rank": 1},
+                {"content": "Completely different text about invoices and payment terms.", "chunks": [], "rank": 2}]
+    assert [p["rank"] for p in builder.drop_duplicates(passages)] == [0, 2]
+
+
+def test_build_stays_within_the_token_budget():
+    chunks = [hit(f"Passage {i} mentions warranty terms number {i}. " * 5, page=i) for i in range(10)]
+    context = ContextBuilder(token_budget=60).build(chunks, "warranty")
+    assert 0 < context["context_tokens"] <= 60
+    assert context["input_tokens"] > context["context_tokens"]
+    assert context["chunks"][0]["metadata"]["page"] == 0
+    assert all("rank" not in chunk for chunk in context["chunks"])
+
+
+def test_build_sends_the_sentence_window_instead_of_the_match():
+    chunks = [hit("Seals are replaced after ten years.", window=TEXT, window_start=0, start_index=41)]
+    context = ContextBuilder().build(chunks, "seals")
+    assert context["full_content"] == TEXT
+
+
+def test_compress_text_keeps_matching_sentences_in_order():
+    compressed = compress_text(TEXT, {"warranty"}, max_tokens=18)
+    assert compressed == "Warranty claims need the serial number. Hoses are not covered by the warranty."
+    assert compress_text("Single sentence.", {"other"}, max_tokens=1) == "Single sentence."
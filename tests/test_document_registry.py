@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from pymongo import AsyncMongoClient  # noqa: E402
+
+from document_registry import DocumentRegistry  # noqa: E402
+from jobs import COMPLETED, QUEUED  # noqa: E402
+
+
+def test_restore_undoes_a_replaced_file_unless_replaced_again(mongo_database):
+    uri, name = mongo_database
+
+    async def run():
+        async with AsyncMongoClient(uri) as client:
+            registry = DocumentRegistry(client[name].user_documents)
+            await registry.register("d1", "u1", "old.txt", "/uploads/d1_old.txt", "tenant_0")
+            await registry.set_status("d1", COMPLETED, chunk_count=3)
+            previous = await registry.get("d1")
+
+            await registry.replace_file("d1", "new.txt", "/uploads/d1_new.txt")
+            assert (await registry.get("d1"))["status"] == QUEUED
+            await registry.restore(previous, "/uploads/d1_new.txt")
+            restored = await registry.get("d1")
+
+            await registry.replace_file("d1", "newer.txt", "/uploads/d1_newer.txt")
+            # a rollback of an older attempt must not undo a later update
+            await registry.restore(previous, "/uploads/d1_new.txt")
+            return restored, await registry.get("d1")
+
+    restored, current = asyncio.run(run())
+    assert (restored["filename"], restored["path"], restored["status"], restored["chunk_count"]) == \
+        ("old.txt", "/uploads/d1_old.txt", COMPLETED, 3)
+    assert (current["path"], current["status"]) == ("/uploads/d1_newer.txt", QUEUED)
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+
+def test_eviction_runs_every_n_inserts(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite"), max_entries=2, evict_every=3)
+    cache.put_many({"a": [0.1]})  # first insert is due: nothing to trim yet
+    cache.put_many({"b": [0.2]})
+    cache.put_many({"c": [0.3]})
+    assert cache.stats()["entries"] == 3
+    cache.put_many({"d": [0.4]})  # three inserts since the last check
+    assert cache.stats()["entries"] == 2
+    assert set(cache.get_many(["a", "b", "c", "d"])) == {"c", "d"}
+
+
+def test_counters_are_exact_under_threads(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite"))
+    cache.put_many({"a": [0.1]})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: cache.get_many(["a", "missing"]), range(200)))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (200, 200)
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from lexical_index import LexicalIndex, Segment, SegmentBuilder, reciprocal_rank_fusion, tokenize
+
+
+def write_segment(path, texts):
+    builder = SegmentBuilder()
+    builder.add([f"c{i}" for i in range(len(texts))], texts)
+    builder.write(path)
+    return Segment(path)
+
+
+def test_tokenize_keeps_compound_tokens_and_their_parts():
+    assert tokenize("Part AB-123.4 ships") == ["part", "ab-123.4", "ab", "123", "4", "ships"]
+
+
+def test_bm25_ranks_rare_terms_and_short_chunks_first(tmp_path):
+    segment = write_segment(str(tmp_path / "doc"), [
+        "the invoice total is due",
+        "the warranty covers the pump and the valve and the hose and the seal",
+        "the warranty covers the pump",
+        "nothing relevant here",
+    ])
+    hits = segment.search("warranty pump", k=10)
+    assert [chunk_id for chunk_id, _ in hits] == ["c2", "c1"]
+    assert hits[0][1] > hits[1][1] > 0
+    assert [chunk_id for chunk_id, _ in segment.search("warranty pump", k=1)] == ["c2"]
+
+
+def test_search_matches_exact_part_numbers(tmp_path):
+    segment = write_segment(str(tmp_path / "doc"), ["replace AB-123.4 yearly", "replace AB-999.1 monthly"])
+    assert [chunk_id for chunk_id, _ in segment.search("AB-123.4", k=5)][0] == "c0"
+
+
+def test_empty_segment_returns_no_hits(tmp_path):
+    segment = write_segment(str(tmp_path / "doc"), [])
+    assert segment.search("anything", k=5) == []
+
+
+def test_rewrite_replaces_segment_and_delete_frees_it(tmp_path):
+    index = LexicalIndex(root=str(tmp_path))
+    first = SegmentBuilder()
+    first.add(["a"], ["alpha beta"])
+    index.write("tenant", "doc", first)
+    assert [chunk_id for chunk_id, _ in index.search("tenant", "doc", "alpha", 5)] == ["a"]
+
+    second = SegmentBuilder()
+    second.add(["b"], ["gamma delta"])
+    index.write("tenant", "doc", second)
+    assert index.search("tenant", "doc", "alpha", 5) == []
+    assert [chunk_id for chunk_id, _ in index.search("tenant", "doc", "gamma", 5)] == ["b"]
+    assert not [name for name in os.listdir(tmp_path / "tenant") if name != "doc"]
+
+    assert index.delete("tenant", "doc") > 0
+    assert index.search("tenant", "doc", "gamma", 5) == []
+    assert index.delete("tenant", "doc") == 0
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]], k=60)
+    # "c" is never first but is found by both rankings, so it beats "a"
+    assert sorted(fused, key=fused.get, reverse=True) == ["b", "c", "a", "d"]
+    assert fused["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert fused["d"] == pytest.approx(1 / 63)
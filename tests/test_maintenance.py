@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("pymongo")
+
+from chunking import ChunkingConfig
+from compact_vectors import VectorConfig
+from maintenance import _drop_empty_collections_sync, _remove_file_sync
+from vectorizer import AsyncDocumentVectorizer
+
+
+@pytest.fixture
+def vectorizer(tmp_path):
+    vectorizer = AsyncDocumentVectorizer(openai_api_key="test", persist_directory=str(tmp_path / "chroma"))
+    yield vectorizer
+    vectorizer.shutdown()
+    vectorizer.chroma.close()
+
+
+def test_empty_collections_with_stored_settings_are_kept(vectorizer):
+    chroma = vectorizer.chroma
+    chroma.get_collection("tenant_a_0", create=True)
+    chroma.set_chunking_config("tenant_b_0", ChunkingConfig.for_strategy("pdf_section"))
+    chroma.set_vector_config("tenant_c_0", VectorConfig(256, "int8"))
+    chroma.get_collection("tenant_d_0", create=True).add(ids=["x"], embeddings=[[0.1, 0.2]], metadatas=[{"document_id": "d"}])
+
+    names = ["tenant_a_0", "tenant_b_0", "tenant_c_0", "tenant_d_0"]
+    assert _drop_empty_collections_sync(vectorizer, names) == ["tenant_a_0"]
+    assert chroma.get_chunking_config("tenant_b_0").strategy == "pdf_section"
+    assert chroma.get_vector_config("tenant_c_0") == VectorConfig(256, "int8")
+
+
+def test_remove_file_reports_its_size_and_tolerates_missing_files(tmp_path):
+    path = tmp_path / "upload.txt"
+    path.write_bytes(b"12345")
+    assert _remove_file_sync(str(path), dry_run=True) == 5
+    assert path.exists()
+    assert _remove_file_sync(str(path)) == 5
+    assert not path.exists()
+    assert _remove_file_sync(str(path)) == 0
@@ -0,0 +1,89 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from pymongo import AsyncMongoClient  # noqa: E402
+
+from schema import HOT_QUERIES, INDEXES, MigrationError, check_query_plans, ensure_schema  # noqa: E402
+
+
+async def _seed(db) -> None:
+    now = datetime.now(timezone.utc)
+    # enough rows that the planner has something to choose between
+    await db.users.insert_many([{"id": str(uuid.uuid4()), "username": f"user{i}", "email": f"user{i}@example.com"}
+                                for i in range(50)])
+    await db.user_documents.insert_many([{"document_id": str(uuid.uuid4()), "user_id": f"u{i % 5}",
+                                          "upload_date": now - timedelta(minutes=i)} for i in range(50)])
+    await db.chat_history.insert_many([{"doc_id": f"d{i % 5}", "user_id": f"u{i % 5}", "timestamp": now}
+                                       for i in range(50)])
+    await db.ingest_jobs.insert_many([{"_id": str(uuid.uuid4()), "document_id": f"d{i}", "status": "completed",
+                                       "file_hash": f"h{i}", "priority": 0, "created_at": now} for i in range(50)])
+
+
+def test_hot_queries_use_an_index(mongo_database):
+    uri, name = mongo_database
+
+    async def run():
+        async with AsyncMongoClient(uri) as client:
+            db = client[name]
+            await ensure_schema(db)
+            await _seed(db)
+            return await check_query_plans(db)
+
+    report = asyncio.run(run())
+    assert set(report) == set(HOT_QUERIES)
+    scans = {name: plan["stages"] for name, plan in report.items() if not plan["uses_index"]}
+    assert not scans, f"collection scans planned: {scans}"
+
+
+def test_duplicate_user_ids_are_resolved_before_unique_indexes(mongo_database):
+    uri, name = mongo_database
+
+    async def run():
+        async with AsyncMongoClient(uri) as client:
+            return await resolve(client[name])
+
+    async def resolve(db):
+        await db.users.insert_many([
+            {"id": "a", "username": "first", "email": "first@example.com"},
+            {"id": "a", "username": "first-again", "email": "first@example.com"},
+            {"username": "legacy-1", "email": "legacy1@example.com"},
+            {"username": "legacy-2", "email": "legacy2@example.com"},
+        ])
+        await ensure_schema(db)
+        users = await db.users.find({}, {"_id": 0}).to_list(length=None)
+        parked = await db.users_duplicates.count_documents({})
+        indexes = await db.users.index_information()
+        return users, parked, indexes
+
+    users, parked, indexes = asyncio.run(run())
+    assert parked == 1
+    assert [u["username"] for u in users if u["email"] == "first@example.com"] == ["first"]
+    assert len({u["id"] for u in users}) == len(users) == 3
+    assert {index.document["name"] for index in INDEXES["users"]} <= set(indexes)
+
+
+def test_shared_emails_stop_the_migration_without_changing_accounts(mongo_database):
+    uri, name = mongo_database
+
+    async def run():
+        async with AsyncMongoClient(uri) as client:
+            db = client[name]
+            await db.users.insert_many([
+                {"id": "a", "username": "first", "email": "same@example.com"},
+                {"id": "b", "username": "second", "email": "same@example.com"},
+            ])
+            with pytest.raises(MigrationError, match="same@example.com"):
+                await ensure_schema(db)
+            users = await db.users.find({}, {"_id": 0, "username": 1, "email": 1}).to_list(length=None)
+            applied = await db.schema_migrations.distinct("_id")
+            return users, applied
+
+    users, applied = asyncio.run(run())
+    assert users == [{"username": "first", "email": "same@example.com"},
+                     {"username": "second", "email": "same@example.com"}]
+    assert 2 not in applied
@@ -0,0 +1,81 @@
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+pytest.importorskip("pymongo")
+pytest.importorskip("jwt")
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import security
+from database import mongo
+from router.auth import router
+from security import VerifiedUserCache, invalidate_user, load_auth_settings, validate_token
+
+
+def test_invalidate_drops_a_verified_user():
+    cache = VerifiedUserCache(ttl_seconds=60)
+    cache.add("u1")
+    cache.add("u2")
+    cache.invalidate("u1")
+    cache.invalidate("missing")
+    assert not cache.contains("u1")
+    assert cache.contains("u2")
+
+
+def test_entries_never_outlive_the_token():
+    cache = VerifiedUserCache(ttl_seconds=60)
+    cache.add("u1", token_exp=time.time() - 1)
+    assert not cache.contains("u1")
+
+
+def test_invalidate_user_clears_the_shared_cache():
+    security.verified_users.add("u1")
+    invalidate_user("u1")
+    assert not security.verified_users.contains("u1")
+
+
+def test_password_change_and_account_deletion_invalidate_the_user(mongo_database, monkeypatch):
+    uri, name = mongo_database
+    monkeypatch.setenv("MONGO_URI", uri)
+    monkeypatch.setenv("MONGO_DB_NAME", name)
+    monkeypatch.setenv("JWT_SECRET_KEY", "test-secret")
+    monkeypatch.setenv("ALGORITHM", "HS256")
+    load_auth_settings()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        mongo.connect()
+        yield
+        await mongo.close()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router, prefix="/auth")
+
+    @app.get("/whoami")
+    async def whoami(decoded_token: dict = Depends(validate_token)):
+        return decoded_token
+
+    with TestClient(app) as client:
+        client.post("/auth/register", json={"username": "ann", "email": "ann@example.com", "password": "old"})
+        token = client.post("/auth/login", json={"username": "ann", "password": "old"}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        user_id = client.get("/whoami", headers=headers).json()["user_id"]
+        assert security.verified_users.contains(user_id)
+
+        changed = client.post("/auth/password", headers=headers,
+                              json={"current_password": "old", "new_password": "new"})
+        assert changed.json() == {"message": "Password changed"}
+        assert not security.verified_users.contains(user_id)
+        assert client.post("/auth/login", json={"username": "ann", "password": "old"}).json() == \
+            {"message": "Invalid credentials"}
+        assert client.get("/whoami", headers=headers).status_code == 200
+
+        wrong = client.request("DELETE", "/auth/me", headers=headers, json={"password": "old"})
+        assert wrong.json() == {"message": "Invalid credentials"}
+        deleted = client.request("DELETE", "/auth/me", headers=headers, json={"password": "new"})
+        assert deleted.json() == {"message": "Account deleted"}
+        assert not security.verified_users.contains(user_id)
+        assert client.get("/whoami", headers=headers).status_code == 401
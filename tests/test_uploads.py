@@ -0,0 +1,15 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from uploads import part_path, stored_size  # noqa: E402
+
+
+def test_stored_size_tells_a_missing_part_from_an_empty_one(tmp_path):
+    path = part_path(str(tmp_path), "u1")
+    assert stored_size(path) is None
+    open(path, "wb").close()
+    assert stored_size(path) == 0
+    with open(path, "ab") as f:
+        f.write(b"abc")
+    assert stored_size(path) == 3
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("pymongo")
+
+from vectorizer import ChromaRegistry
+
+
+@pytest.fixture
+def chroma(tmp_path):
+    registry = ChromaRegistry(str(tmp_path / "chroma"))
+    yield registry
+    registry.close()
+
+
+def test_first_collection_lookup_opens_the_client(chroma):
+    collection = chroma.get_collection("tenant_a_0", create=True)
+    assert chroma.get_collection("tenant_a_0") is collection
+    assert chroma.health()["collections_cached"] == ["tenant_a_0"]
+
+
+def test_warm_up_reports_missing_collections_without_failing(chroma):
+    chroma.get_collection("tenant_a_0", create=True).add(ids=["x"], embeddings=[[0.1, 0.2]])
+    assert chroma.warm_up(["tenant_a_0", "missing_collection"]) == {"tenant_a_0": 1}
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("pymongo")
+
+from jobs import QUEUED, RUNNING  # noqa: E402
+from worker import convert_to_vector, run_worker  # noqa: E402
+
+
+class FakeQueue:
+    """In-memory stand-in for IngestJobQueue that records what the worker did"""
+
+    max_attempts = 5
+
+    def __init__(self, jobs, lease_seconds=3, renews=True):
+        self.jobs = list(jobs)
+        self.lease = timedelta(seconds=lease_seconds)
+        self.renews = renews
+        self.calls = []
+
+    async def claim(self, worker_id):
+        return self.jobs.pop(0) if self.jobs else None
+
+    async def renew_lease(self, job_id, worker_id):
+        return self.renews
+
+    async def release(self, job_id, worker_id):
+        self.calls.append(("release", job_id))
+        return True
+
+    async def complete(self, job_id, result):
+        self.calls.append(("complete", job_id))
+
+    async def fail(self, job, error):
+        self.calls.append(("fail", job["_id"]))
+        return QUEUED
+
+
+class FakeRegistry:
+    def __init__(self):
+        self.statuses = []
+
+    async def get(self, doc_id):
+        return None
+
+    async def set_status(self, doc_id, new_status, chunk_count=None, error=None):
+        self.statuses.append(new_status)
+        return True
+
+
+class SlowVectorizer:
+    async def vectorize_document_async(self, **kwargs):
+        await asyncio.sleep(30)
+        return {"success": True, "chunks_created": 1}
+
+
+def _job(job_id="j1"):
+    return {"_id": job_id, "document_id": "d1", "file_path": "/tmp/d1.txt", "attempts": 1}
+
+
+def test_job_stops_without_touching_state_when_the_lease_is_lost():
+    queue, registry = FakeQueue([], renews=False), FakeRegistry()
+
+    status = asyncio.run(asyncio.wait_for(
+        convert_to_vector(queue, SlowVectorizer(), _job(), "w1", registry), timeout=10))
+
+    assert status == RUNNING
+    assert queue.calls == []
+    assert registry.statuses == [RUNNING]
+
+
+def test_stopping_worker_releases_unfinished_jobs():
+    queue, registry = FakeQueue([_job()]), FakeRegistry()
+
+    async def run():
+        stop = asyncio.Event()
+        worker = asyncio.create_task(run_worker(SlowVectorizer(), queue, concurrency=1, poll_interval=0.01,
+                                                stop=stop, registry=registry, stop_grace_seconds=0.1))
+        while RUNNING not in registry.statuses:
+            await asyncio.sleep(0.01)
+        stop.set()
+        await asyncio.wait_for(worker, timeout=10)
+
+    asyncio.run(run())
+    assert queue.calls == [("release", "j1")]
+    assert registry.statuses == [RUNNING, QUEUED]
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import os
+import re
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class BodyTooLarge(HTTPException):
+    # an HTTPException so FastAPI's body parsing passes it through instead of answering 400
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                         detail=f"Request body exceeds the {max_bytes} byte limit")
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware that guards upload routes before their body is read.
+
+    FastAPI parses (and spools) a multipart body before the handler and its
+    dependencies run, so limits checked in the handler come too late. For requests
+    matching ``routes`` (method, path regex) this rejects a missing or invalid bearer
+    token and a Content-Length over ``max_bytes`` up front, and stops a chunked body
+    as soon as it grows past ``max_bytes``.
+    """
+
+    def __init__(self, app, max_bytes: int, routes: List[Tuple[str, str]],
+                 check_token: Optional[Callable[[str], dict]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.routes = [(method, re.compile(pattern)) for method, pattern in routes]
+        self.check_token = check_token
+
+    def _guarded(self, scope) -> bool:
+        return scope["type"] == "http" and any(
+            scope["method"] == method and pattern.fullmatch(scope["path"]) for method, pattern in self.routes
+        )
+
+    async def __call__(self, scope, receive, send):
+        if not self._guarded(scope):
+            return await self.app(scope, receive, send)
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        if self.check_token is not None:
+            parts = headers.get("authorization", "").split()
+            if len(parts) != 2 or parts[0].lower() != "bearer":
+                return await self._reject(scope, receive, send, status.HTTP_401_UNAUTHORIZED,
+                                          "Missing or invalid Authorization header")
+            try:
+                self.check_token(parts[1])
+            except HTTPException as e:
+                return await self._reject(scope, receive, send, e.status_code, e.detail)
+
+        content_length = headers.get("content-length")
+        if content_length is not None and (not content_length.isdigit() or int(content_length) > self.max_bytes):
+            return await self._reject(scope, receive, send, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                      f"Request body exceeds the {self.max_bytes} byte limit")
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise BodyTooLarge(self.max_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except BodyTooLarge as e:
+            if response_started:
+                raise
+            await self._reject(scope, receive, send, e.status_code, e.detail)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail) -> None:
+        response = JSONResponse({"detail": detail}, status_code=status_code, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+
+def _write_chunk(out_f, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    out_f.write(chunk)
+
+
+def _open_at(dest_path: str, offset: int):
+    if offset == 0:
+        return open(dest_path, "wb")
+    out_f = open(dest_path, "r+b")
+    # drop any bytes past the acknowledged offset left by an interrupted write
+    out_f.seek(offset)
+    out_f.truncate()
+    return out_f
+
+
+async def write_stream(chunks: AsyncIterator[bytes], dest_path: str, max_bytes: int,
+                       offset: int = 0, keep_partial: bool = False) -> Tuple[int, str]:
+    """Write an async byte stream to disk off the event loop, starting at ``offset``.
+
+    Hashes and counts bytes as they arrive and stops as soon as the file would grow
+    past ``max_bytes``. On failure the file is removed unless ``keep_partial`` is set
+    (resumable uploads keep what arrived). Returns the number of bytes written and
+    the sha256 of those bytes.
+    """
+    loop = asyncio.get_event_loop()
+    digest = hashlib.sha256()
+    written = 0
+    out_f = await loop.run_in_executor(None, _open_at, dest_path, offset)
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if offset + written + len(chunk) > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+            await loop.run_in_executor(None, _write_chunk, out_f, digest, chunk)
+            written += len(chunk)
+    except BaseException:
+        await loop.run_in_executor(None, out_f.close)
+        if not keep_partial:
+            await loop.run_in_executor(None, remove_quietly, dest_path)
+        raise
+    await loop.run_in_executor(None, out_f.close)
+    return written, digest.hexdigest()
+
+
+async def iter_upload_file(file, chunk_size: int) -> AsyncIterator[bytes]:
+    """Read a Starlette UploadFile in fixed-size chunks (reads run in the threadpool)"""
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        await file.close()
+
+
+def part_path(upload_dir: str, upload_id: str) -> str:
+    return os.path.join(upload_dir, f"{upload_id}.part")
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def stored_size(path: str) -> Optional[int]:
+    """Size of the file at ``path``, or None when it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+
+
+def remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
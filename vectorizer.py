@@ -1,111 +1,668 @@
-from concurrent.futures import ThreadPoolExecutor
-from typing import List
-from langchain_community.document_loaders import TextLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from langchain_community.document_loaders import TextLoader
 from langchain_openai.embeddings import OpenAIEmbeddings
 from langchain_core.documents import Document
-from dotenv import load_dotenv
 import os
 import chromadb
+import numpy as np
 from pathlib import Path
 import asyncio
+import hashlib
+import logging
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+import openai
+from embedding_cache import EmbeddingCache, file_sha256
+from pdf_pages import extract_page_range, pdf_page_count
+from lexical_index import LexicalIndex, SegmentBuilder, reciprocal_rank_fusion
+from chunking import LEGACY_CHUNKING, ChunkingConfig, build_chunker, count_tokens
+from compact_vectors import VectorConfig, VectorIndex, VectorSegmentBuilder, truncate
+from metrics import stage
+
+logger = logging.getLogger("vectorizer")
+
+
+class ChromaRegistry:
+    """Process-wide Chroma client with cached collection handles.
+
+    chromadb clients are thread safe, so one registry is shared by the event loop
+    and the vectorizer's executor threads; the lock only guards handle creation.
+    """
+
+    def __init__(self, path: str = "./chroma_db"):
+        self.path = path
+        self._client = None
+        self._collections: Dict[str, "chromadb.Collection"] = {}
+        # reentrant: creating a collection handle may create the client under the same lock
+        self._lock = threading.RLock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = chromadb.PersistentClient(path=self.path)
+        return self._client
+
+    def get_collection(self, collection_name: str, create: bool = False):
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(collection_name)
+                if collection is None:
+                    if create:
+                        collection = self.client.get_or_create_collection(collection_name)
+                    else:
+                        collection = self.client.get_collection(collection_name)
+                    self._collections[collection_name] = collection
+        return collection
+
+    def collection_settings(self, collection_name: str) -> dict:
+        # read fresh rather than from the cached handle: settings can change from another process
+        try:
+            return dict(self.client.get_collection(collection_name).metadata or {})
+        except Exception:
+            return {}
+
+    def update_collection_settings(self, collection_name: str, settings: dict) -> None:
+        """Merge ``settings`` into the collection's metadata, creating the collection if needed"""
+        with self._lock:
+            collection = self.client.get_or_create_collection(collection_name, metadata=settings)
+            metadata = {key: value for key, value in (collection.metadata or {}).items()
+                        if not key.startswith("hnsw:")}
+            if any(metadata.get(key) != value for key, value in settings.items()):
+                collection.modify(metadata={**metadata, **settings})
+            self._collections.pop(collection_name, None)
+
+    def get_chunking_config(self, collection_name: str) -> Optional[ChunkingConfig]:
+        return ChunkingConfig.from_metadata(self.collection_settings(collection_name))
+
+    def set_chunking_config(self, collection_name: str, config: ChunkingConfig) -> None:
+        self.update_collection_settings(collection_name, config.to_metadata())
+
+    def get_vector_config(self, collection_name: str) -> Optional[VectorConfig]:
+        return VectorConfig.from_metadata(self.collection_settings(collection_name))
+
+    def set_vector_config(self, collection_name: str, config: VectorConfig) -> None:
+        """Store ``config``; the stored dimension can't change once the collection holds vectors"""
+        current = self.get_vector_config(collection_name) or VectorConfig()
+        if current.dimensions != config.dimensions:
+            try:
+                populated = self.client.get_collection(collection_name).count() > 0
+            except Exception:
+                populated = False
+            if populated:
+                raise ValueError(f"Collection {collection_name} already stores {current.dimensions or 'full'}-"
+                                 f"dimension vectors; use a new collection for {config.dimensions or 'full'}")
+        self.update_collection_settings(collection_name, config.to_metadata())
+
+    def warm_up(self, collection_names: List[str]) -> dict:
+        """Open the collections and load their HNSW segments before the first request"""
+        warmed = {}
+        for name in collection_names:
+            try:
+                collection = self.get_collection(name)
+                sample = collection.peek(limit=1)
+                if len(sample["ids"]) > 0:
+                    # a query is what loads the vector segment into memory
+                    collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1)
+                warmed[name] = collection.count()
+            except Exception as e:
+                logger.warning(f"Could not warm up collection {name}: {str(e)}")
+        return warmed
+
+    def health(self) -> dict:
+        try:
+            started = time.perf_counter()
+            self.client.heartbeat()
+            return {
+                "status": "ok",
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+                "collections_cached": sorted(self._collections),
+            }
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+    def forget_collection(self, collection_name: str) -> None:
+        """Drop cached handles, e.g. after the collection was deleted"""
+        with self._lock:
+            self._collections.pop(collection_name, None)
+
+    def close(self) -> None:
+        with self._lock:
+            self._collections.clear()
+            self._client = None
+
+
+_chroma_registries: Dict[str, ChromaRegistry] = {}
+_chroma_registries_lock = threading.Lock()
+
+
+def get_chroma_registry(path: str = "./chroma_db") -> ChromaRegistry:
+    """Return the shared registry for a persist directory"""
+    key = os.path.abspath(path)
+    with _chroma_registries_lock:
+        registry = _chroma_registries.get(key)
+        if registry is None:
+            registry = ChromaRegistry(path)
+            _chroma_registries[key] = registry
+        return registry
+
 
 class AsyncDocumentVectorizer:
-    def __init__(self, openai_api_key: str, persist_directory: str = "./chroma_db"):
+    def __init__(self, openai_api_key: str, persist_directory: str = "./chroma_db",
+                 embed_batch_size: int = 64, embed_concurrency: int = 4,
+                 embed_queue_size: int = 8, embed_max_retries: int = 6,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 parse_processes: int = 2, pages_per_task: int = 16, parse_window: int = 4,
+                 lexical_index: Optional[LexicalIndex] = None,
+                 chunking: Optional[ChunkingConfig] = None,
+                 vectors: Optional[VectorConfig] = None,
+                 vector_index: Optional[VectorIndex] = None):
         self.embeddings = OpenAIEmbeddings(
             openai_api_key=openai_api_key,
-            model="text-embedding-3-large"
+            model="text-embedding-3-large",
+            # rate limits are retried by the ingest pipeline with backoff
+            max_retries=0
         )
         self.persist_directory = persist_directory
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
+        self.chroma = get_chroma_registry(persist_directory)
+        # Chunking settings for collections that don't have their own yet
+        self.chunking = chunking or ChunkingConfig()
+        self._chunkers: Dict[ChunkingConfig, object] = {}
         # Create thread pool for blocking operations
         self.executor = ThreadPoolExecutor(max_workers=4)
+
+        # Embedding pipeline settings. The semaphore is shared by every upload, and
+        # asyncio wakes waiters in FIFO order, so batches of concurrent uploads interleave.
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.embed_queue_size = embed_queue_size
+        self.embed_max_retries = embed_max_retries
+        self._embed_slots = asyncio.Semaphore(embed_concurrency)
+        self.embedding_cache = embedding_cache
+
+        # PDF parsing runs page ranges in a process pool (created on first use);
+        # at most ``parse_window`` ranges are in flight per document.
+        self.parse_processes = parse_processes
+        self.pages_per_task = pages_per_task
+        self.parse_window = parse_window
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+
+        # BM25 segments written alongside the vectors for hybrid retrieval
+        self.lexical_index = lexical_index
+
+        # Vector storage for collections that don't have their own settings yet; compact
+        # collections keep full-precision vectors for rescoring in ``vector_index``
+        self.vectors = vectors or VectorConfig()
+        self.vector_index = vector_index
+
+    @classmethod
+    def from_env(cls, persist_directory: str = "./chroma_db") -> "AsyncDocumentVectorizer":
+        """Vectorizer configured from environment variables (API and ingest workers share this)"""
+        return cls(
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            persist_directory=persist_directory,
+            embed_batch_size=int(os.getenv("EMBED_BATCH_SIZE", "64")),
+            embed_concurrency=int(os.getenv("EMBED_CONCURRENCY", "4")),
+            embed_queue_size=int(os.getenv("EMBED_QUEUE_SIZE", "8")),
+            embedding_cache=EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite"),
+                max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")),
+            ),
+            parse_processes=int(os.getenv("PARSE_PROCESSES", "2")),
+            pages_per_task=int(os.getenv("PARSE_PAGES_PER_TASK", "16")),
+            parse_window=int(os.getenv("PARSE_WINDOW", "4")),
+            lexical_index=LexicalIndex(root=os.getenv("LEXICAL_INDEX_DIR", "./lexical_index")),
+            chunking=ChunkingConfig.from_env(),
+            vectors=VectorConfig.from_env(),
+            vector_index=VectorIndex(root=os.getenv("VECTOR_INDEX_DIR", "./vector_index")),
+        )
+
+    @property
+    def parse_pool(self) -> ProcessPoolExecutor:
+        if self._parse_pool is None:
+            # spawn: forking a process that runs an event loop and client threads is unsafe
+            self._parse_pool = ProcessPoolExecutor(
+                max_workers=self.parse_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._parse_pool
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False, cancel_futures=True)
     
-    def _load_document_sync(self, file_path: str) -> List[Document]:
-        """Synchronous document loading"""
+    def _load_text_sync(self, file_path: str) -> List[Document]:
+        """Synchronous text file loading"""
+        return TextLoader(file_path, encoding='utf-8').load()
+
+    async def _iter_pages(self, file_path: str) -> AsyncIterator[List[Document]]:
+        """Yield the document as page batches, in order, while later pages are still parsing"""
+        loop = asyncio.get_event_loop()
         file_extension = Path(file_path).suffix.lower()
-        
 
-        print(file_extension)
-        if file_extension == '.pdf':
-            loader = PyPDFLoader(file_path)
-        elif file_extension == '.txt':
-            loader = TextLoader(file_path, encoding='utf-8')
-        else:
+        if file_extension == '.txt':
+            yield await loop.run_in_executor(self.executor, self._load_text_sync, file_path)
+            return
+        if file_extension != '.pdf':
             raise ValueError(f"Unsupported file type: {file_extension}")
-        
-        return loader.load()
+
+        total_pages = await loop.run_in_executor(self.parse_pool, pdf_page_count, file_path)
+        ranges = deque(range(0, total_pages, self.pages_per_task))
+        in_flight = deque()
+        try:
+            while ranges or in_flight:
+                while ranges and len(in_flight) < self.parse_window:
+                    start = ranges.popleft()
+                    in_flight.append(loop.run_in_executor(
+                        self.parse_pool, extract_page_range, file_path, start, start + self.pages_per_task
+                    ))
+                pages = await in_flight.popleft()
+                yield [
+                    Document(
+                        page_content=text,
+                        metadata={"source": file_path, "page": page_number, "total_pages": total_pages},
+                    )
+                    for page_number, text in pages
+                ]
+        finally:
+            for future in in_flight:
+                future.cancel()
     
-    def _process_and_store_sync(self, documents: List[Document], 
-                               collection_name: str, document_id: str) -> dict:
-        """Synchronous processing and storage"""
+    def collection_configs_sync(self, collection_name: str) -> Tuple[ChunkingConfig, VectorConfig]:
+        """The collection's chunking and vector settings; a new or empty collection adopts the defaults.
+
+        Collections that hold chunks from before per-collection settings keep the
+        original character splitter and full vectors, so re-ingesting their documents
+        keeps chunk ids and the collection's dimension.
+        """
+        settings = self.chroma.collection_settings(collection_name)
+        chunking = ChunkingConfig.from_metadata(settings)
+        vectors = VectorConfig.from_metadata(settings)
+        if chunking is not None and vectors is not None:
+            return chunking, vectors
         try:
-            # Add metadata
-            for doc in documents:
-                doc.metadata.update({
-                    "document_id": document_id,
-                    "source_file": Path(doc.metadata.get("source", "")).name,
-                })
-            
-            # Split into chunks
-            chunks = self.text_splitter.split_documents(documents)
-            
-            # Create vector store
-            vector_store = Chroma(
-                collection_name=collection_name,
-                embedding_function=self.embeddings,
-                persist_directory=self.persist_directory
-            )
-            
-            # Add documents (synchronous operation)
-            chunk_ids = vector_store.add_documents(chunks)
-            
-            return {
-                "success": True,
+            populated = self.chroma.get_collection(collection_name).count() > 0
+        except Exception:
+            populated = False
+        if populated:
+            return chunking or LEGACY_CHUNKING, vectors or VectorConfig()
+        chunking, vectors = chunking or self.chunking, vectors or self.vectors
+        self.chroma.update_collection_settings(collection_name, {**chunking.to_metadata(), **vectors.to_metadata()})
+        return chunking, vectors
+
+    def chunker_for(self, config: ChunkingConfig):
+        chunker = self._chunkers.get(config)
+        if chunker is None:
+            chunker = self._chunkers[config] = build_chunker(config)
+        return chunker
+
+    def _split_documents_sync(self, documents: List[Document], document_id: str,
+                              file_hash: Optional[str] = None, chunker=None) -> List[Document]:
+        """Synchronous metadata tagging and splitting"""
+        # Add metadata
+        for doc in documents:
+            doc.metadata.update({
                 "document_id": document_id,
-                "chunks_created": len(chunks),
-                "chunk_ids": chunk_ids,
-                "collection": collection_name
-            }
-            
-        except Exception as e:
-            return {
-                "success": False,
-                "error": str(e),
-                "document_id": document_id
-            }
-    
+                "source_file": Path(doc.metadata.get("source", "")).name,
+            })
+            if file_hash:
+                doc.metadata["file_hash"] = file_hash
+        
+        # Split into chunks; the content hash gives each chunk a stable id
+        chunks = (chunker or self.chunker_for(self.chunking)).split_documents(documents)
+        for chunk in chunks:
+            chunk.metadata["chunk_hash"] = chunk_hash(chunk.page_content)
+        return chunks
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch, serving repeated chunk texts from the embedding cache"""
+        if self.embedding_cache is None:
+            return await self._embed_with_retry(texts)
+
+        loop = asyncio.get_event_loop()
+        model = self.embeddings.model
+        keys = [EmbeddingCache.key(model, text) for text in texts]
+        cached = await loop.run_in_executor(self.executor, self.embedding_cache.get_many, keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = await self._embed_with_retry(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            await loop.run_in_executor(self.executor, self.embedding_cache.put_many, fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    async def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, backing off exponentially on rate limits and transient errors"""
+        for attempt in range(self.embed_max_retries + 1):
+            try:
+                async with self._embed_slots:
+                    with stage("embed.batch", texts=len(texts)):
+                        return await self.embeddings.aembed_documents(texts)
+            except (openai.RateLimitError, openai.APITimeoutError,
+                    openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.embed_max_retries:
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                response = getattr(e, "response", None)
+                retry_after = response.headers.get("retry-after") if response is not None else None
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                logger.warning(f"Embedding batch failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _store_batch_sync(self, collection_name: str, batch: List[Document],
+                          vectors: List[List[float]], dimensions: int = 0) -> List[str]:
+        ids = [chunk_id(chunk.metadata) for chunk in batch]
+        if dimensions:
+            vectors = truncate(vectors, dimensions).tolist()
+        records = dict(
+            ids=ids,
+            embeddings=vectors,
+            documents=[chunk.page_content for chunk in batch],
+            metadatas=[_clean_metadata(chunk.metadata) for chunk in batch],
+        )
+        try:
+            self.chroma.get_collection(collection_name, create=True).upsert(**records)
+        except Exception:
+            # the cached handle is stale if garbage collection dropped the empty collection
+            self.chroma.forget_collection(collection_name)
+            self.chroma.get_collection(collection_name, create=True).upsert(**records)
+        return ids
+
+    def _update_metadata_sync(self, collection_name: str, batch: List[Document]) -> None:
+        self.chroma.get_collection(collection_name, create=True).update(
+            ids=[chunk_id(chunk.metadata) for chunk in batch],
+            metadatas=[_clean_metadata(chunk.metadata) for chunk in batch],
+        )
+
+    def _existing_chunk_ids_sync(self, collection_name: str, document_id: str) -> Set[str]:
+        try:
+            collection = self.chroma.get_collection(collection_name)
+        except Exception:
+            return set()
+        return set(collection.get(where={"document_id": document_id}, include=[])["ids"])
+
+    async def _embed_and_store(self, chunk_stream: AsyncIterator[List[Document]],
+                               collection_name: str,
+                               lexical: Optional[SegmentBuilder] = None,
+                               existing_ids: Optional[Set[str]] = None,
+                               compact: Optional[VectorSegmentBuilder] = None,
+                               previous_vectors: Optional[dict] = None,
+                               dimensions: int = 0) -> Tuple[List[str], List[str]]:
+        """Embed streamed chunks in batches with bounded concurrency and write them as they finish.
+
+        Batches flow through a bounded queue so only ``embed_queue_size`` batches are
+        waiting at any time, which also throttles parsing. Chunks whose id is in
+        ``existing_ids`` are already stored and only get their metadata refreshed.
+        Chroma gets vectors truncated to ``dimensions`` (0 keeps them whole); ``compact``
+        collects the full ones, and already stored chunks take theirs from ``previous_vectors``.
+        Returns (all chunk ids, ids that were embedded and added). If a batch fails for
+        good the vectors added for this document are removed again.
+        """
+        loop = asyncio.get_event_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.embed_queue_size)
+        existing_ids = existing_ids or set()
+        previous_vectors = previous_vectors or {}
+        chunk_ids: List[str] = []
+        stored_ids: List[str] = []
+
+        async def produce():
+            pending: List[Document] = []
+            seen = set()
+            async for chunks in chunk_stream:
+                # repeated text within a document (headers, boilerplate) is stored once
+                for chunk in chunks:
+                    if chunk.metadata["chunk_hash"] not in seen:
+                        seen.add(chunk.metadata["chunk_hash"])
+                        pending.append(chunk)
+                while len(pending) >= self.embed_batch_size:
+                    await queue.put(pending[:self.embed_batch_size])
+                    pending = pending[self.embed_batch_size:]
+            if pending:
+                await queue.put(pending)
+            for _ in range(self.embed_concurrency):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                known = [chunk for chunk in batch if chunk_id(chunk.metadata) in existing_ids]
+                fresh = [chunk for chunk in batch if chunk_id(chunk.metadata) not in existing_ids]
+                if fresh:
+                    vectors = await self._embed_batch([chunk.page_content for chunk in fresh])
+                    ids = await loop.run_in_executor(
+                        self.executor, self._store_batch_sync, collection_name, fresh, vectors, dimensions
+                    )
+                    stored_ids.extend(ids)
+                    if compact is not None:
+                        compact.add(ids, vectors)
+                if known:
+                    await loop.run_in_executor(self.executor, self._update_metadata_sync, collection_name, known)
+                    if compact is not None:
+                        await self._add_known_vectors(compact, known, previous_vectors)
+                ids = [chunk_id(chunk.metadata) for chunk in batch]
+                chunk_ids.extend(ids)
+                if lexical is not None:
+                    texts = [chunk.page_content for chunk in batch]
+                    await loop.run_in_executor(self.executor, lexical.add, ids, texts)
+
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(consume()) for _ in range(self.embed_concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            if stored_ids:
+                collection = self.chroma.get_collection(collection_name, create=True)
+                await loop.run_in_executor(self.executor, partial(collection.delete, ids=stored_ids))
+            raise
+        return chunk_ids, stored_ids
+
+    async def _add_known_vectors(self, compact: VectorSegmentBuilder, known: List[Document],
+                                 previous_vectors: dict) -> None:
+        """Full vectors of already stored chunks, for the document's new segment.
+
+        Chroma only holds the truncated ones, so chunks missing from the previous
+        segment are embedded again (usually an embedding cache hit) but not re-stored.
+        """
+        ids = [chunk_id(chunk.metadata) for chunk in known]
+        missing = [chunk for chunk, id_ in zip(known, ids) if id_ not in previous_vectors]
+        if missing:
+            vectors = await self._embed_batch([chunk.page_content for chunk in missing])
+            compact.add([chunk_id(chunk.metadata) for chunk in missing], vectors)
+        reused = [id_ for id_ in ids if id_ in previous_vectors]
+        if reused:
+            compact.add(reused, [previous_vectors[id_] for id_ in reused])
+
+    def _copy_existing_vectors_sync(self, collection_name: str, file_hash: str, document_id: str,
+                                    completed_documents: Optional[Set[str]] = None) -> Optional[dict]:
+        """Reuse the vectors of an identical file that was ingested before.
+
+        Only documents in ``completed_documents`` are copied from: vectors are stored
+        batch by batch, so a document still being ingested has a partial set.
+        """
+        sources = sorted(set(completed_documents or ()) - {document_id})
+        if not sources:
+            return None
+        try:
+            collection = self.chroma.get_collection(collection_name)
+        except Exception:
+            return None
+        match = collection.get(
+            where={"$and": [{"file_hash": file_hash}, {"document_id": {"$in": sources}}]},
+            limit=1,
+            include=["metadatas"],
+        )
+        if not match["ids"]:
+            return None
+        source_document_id = match["metadatas"][0]["document_id"]
+
+        existing = collection.get(
+            where={"document_id": source_document_id},
+            include=["embeddings", "documents", "metadatas"],
+        )
+        metadatas = [{**metadata, "document_id": document_id} for metadata in existing["metadatas"]]
+        ids = [chunk_id(metadata) for metadata in metadatas]
+
+        compact = None
+        config = VectorConfig.from_metadata(self.chroma.collection_settings(collection_name)) or VectorConfig()
+        if config.compact and self.vector_index is not None:
+            # Chroma only has the truncated vectors; without the source segment embed from scratch
+            source = self.vector_index.load_vectors(collection_name, source_document_id)
+            if any(id_ not in source for id_ in existing["ids"]):
+                return None
+            compact = VectorSegmentBuilder(config)
+            compact.add(ids, [source[id_] for id_ in existing["ids"]])
+
+        for start in range(0, len(ids), self.embed_batch_size):
+            end = start + self.embed_batch_size
+            collection.upsert(
+                ids=ids[start:end],
+                embeddings=existing["embeddings"][start:end],
+                documents=existing["documents"][start:end],
+                metadatas=metadatas[start:end],
+            )
+        # an updated document may have had other chunks before
+        stale = list(self._existing_chunk_ids_sync(collection_name, document_id) - set(ids))
+        if stale:
+            collection.delete(ids=stale)
+        if self.lexical_index is not None:
+            lexical = SegmentBuilder()
+            lexical.add(ids, existing["documents"])
+            self.lexical_index.write(collection_name, document_id, lexical)
+        if compact is not None:
+            self.vector_index.write(collection_name, document_id, compact)
+        return {"chunk_ids": ids, "reused_from": source_document_id, "chunks_removed": len(stale)}
+
     async def vectorize_document_async(self, file_path: str, 
                                      collection_name: str, 
-                                     document_id: str) -> dict:
-        """Main async vectorization function"""
+                                     document_id: str,
+                                     file_hash: Optional[str] = None,
+                                     completed_documents: Optional[Set[str]] = None) -> dict:
+        """Main async vectorization function.
+
+        ``completed_documents`` are the documents with this file hash whose ingestion
+        finished; the vectors of one of them are copied instead of embedding again.
+        """
         loop = asyncio.get_event_loop()
         
         try:
-            # Step 1: Load document asynchronously
-            documents = await loop.run_in_executor(
-                self.executor, 
-                self._load_document_sync, 
-                file_path
-            )
-            
-            print(f"✅ Loaded {len(documents)} pages from {file_path}")
-            
-            # Step 2: Process and store asynchronously
-            result = await loop.run_in_executor(
+            # Duplicate uploads reuse the stored vectors of the first copy
+            if file_hash is None:
+                file_hash = await loop.run_in_executor(self.executor, file_sha256, file_path)
+            reused = await loop.run_in_executor(
                 self.executor,
-                self._process_and_store_sync,
-                documents,
+                self._copy_existing_vectors_sync,
                 collection_name,
-                document_id
+                file_hash,
+                document_id,
+                completed_documents
             )
-            
-            print(f"✅ Vectorization completed: {result}")
+            if reused:
+                logger.info(f"Reused vectors of {reused['reused_from']} for {document_id}")
+                return {
+                    "success": True,
+                    "document_id": document_id,
+                    "chunks_created": len(reused["chunk_ids"]),
+                    "chunk_ids": reused["chunk_ids"],
+                    "collection": collection_name,
+                    "reused_from": reused["reused_from"],
+                    "chunks_embedded": 0,
+                    "chunks_removed": reused["chunks_removed"]
+                }
+
+            # Every document of a collection is chunked with the collection's settings
+            config, vectors = await loop.run_in_executor(self.executor, self.collection_configs_sync, collection_name)
+            chunker = self.chunker_for(config)
+
+            async def chunk_stream():
+                # Parse pages in the process pool and split each batch as it arrives,
+                # so embedding starts before the whole file has been parsed
+                async for pages in self._iter_pages(file_path):
+                    yield await loop.run_in_executor(
+                        self.executor,
+                        self._split_documents_sync,
+                        pages,
+                        document_id,
+                        file_hash,
+                        chunker
+                    )
+
+            # Re-ingesting an updated file only embeds chunks whose content is new
+            existing_ids = await loop.run_in_executor(
+                self.executor, self._existing_chunk_ids_sync, collection_name, document_id
+            )
+            compact, previous_vectors = None, None
+            if vectors.compact and self.vector_index is not None:
+                compact = VectorSegmentBuilder(vectors)
+                if existing_ids:
+                    previous_vectors = await loop.run_in_executor(
+                        self.executor, self.vector_index.load_vectors, collection_name, document_id
+                    )
+            started = time.perf_counter()
+            lexical = SegmentBuilder() if self.lexical_index is not None else None
+            chunk_ids, added_ids = await self._embed_and_store(
+                chunk_stream(), collection_name, lexical, existing_ids, compact, previous_vectors,
+                vectors.dimensions
+            )
+            elapsed = time.perf_counter() - started
+
+            removed_ids = list(existing_ids - set(chunk_ids))
+            if removed_ids:
+                collection = self.chroma.get_collection(collection_name)
+                await loop.run_in_executor(self.executor, partial(collection.delete, ids=removed_ids))
+
+            if lexical is not None:
+                try:
+                    await loop.run_in_executor(
+                        self.executor, self.lexical_index.write, collection_name, document_id, lexical
+                    )
+                except OSError as e:
+                    # vector search still works without the segment
+                    logger.warning(f"Could not write lexical index for {document_id}: {str(e)}")
+            if compact is not None:
+                try:
+                    await loop.run_in_executor(
+                        self.executor, self.vector_index.write, collection_name, document_id, compact
+                    )
+                except OSError as e:
+                    # queries fall back to the truncated vectors stored in Chroma
+                    logger.warning(f"Could not write vector segment for {document_id}: {str(e)}")
+
+            result = {
+                "success": True,
+                "document_id": document_id,
+                "chunks_created": len(chunk_ids),
+                "chunk_ids": chunk_ids,
+                "collection": collection_name,
+                "chunks_embedded": len(added_ids),
+                "chunks_removed": len(removed_ids),
+                "chunking": config.strategy,
+                "vector_dimensions": vectors.dimensions or None,
+                "quantization": vectors.quantization,
+                "chunks_per_second": round(len(chunk_ids) / elapsed, 2) if elapsed > 0 else None
+            }
+            logger.info(f"Vectorization completed: {len(chunk_ids)} chunks for {document_id} "
+                        f"({len(added_ids)} embedded, {len(removed_ids)} removed)")
             return result
             
         except Exception as e:
@@ -115,29 +672,314 @@ class AsyncDocumentVectorizer:
                 "document_id": document_id
             }
 
+    async def similarity_search_async(self, collection_name: str, document_id: str, query: str,
+                                      k: int = 4, use_mmr: bool = False, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, max_context_tokens: int = 2000,
+                                      query_embedding: List[float] = None, hybrid: bool = False):
+        """Embed the question once and run the per-document similarity query off the event loop.
+
+        With ``hybrid`` the vector hits are fused with BM25 hits from the document's
+        lexical segment (documents ingested before segments existed use vectors only).
+        """
+        if query_embedding is None:
+            with stage("embed.query"):
+                query_embedding = await self.embeddings.aembed_query(query)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            partial(
+                query_document_chunks,
+                collection_name,
+                document_id,
+                query_embedding,
+                chroma=self.chroma,
+                k=k,
+                use_mmr=use_mmr,
+                fetch_k=fetch_k,
+                lambda_mult=lambda_mult,
+                max_context_tokens=max_context_tokens,
+                lexical_index=self.lexical_index if hybrid else None,
+                query_text=query,
+                vector_index=self.vector_index,
+            )
+        )
+
+    async def search_collections_async(self, targets: Dict[str, Optional[dict]], query: str,
+                                       k: int = 4, max_context_tokens: int = 2000,
+                                       query_embedding: List[float] = None):
+        """Query several collections in parallel and merge the hits by distance.
+
+        ``targets`` maps a collection name to an optional ``where`` filter. Returns the
+        same shape as ``query_document_chunks`` or None when nothing matched.
+        """
+        if query_embedding is None:
+            with stage("embed.query"):
+                query_embedding = await self.embeddings.aembed_query(query)
+        loop = asyncio.get_event_loop()
+        per_collection = await asyncio.gather(*[
+            loop.run_in_executor(
+                self.executor,
+                partial(query_collection_chunks, name, query_embedding, k=k, where=where,
+                        chroma=self.chroma, vector_index=self.vector_index)
+            )
+            for name, where in targets.items()
+        ])
+        hits = sorted((hit for hits in per_collection for hit in hits), key=lambda hit: hit["distance"])
+
+        chunks_info = []
+        used_tokens = 0
+        for hit in hits[:k]:
+            chunk_tokens = count_tokens(hit["content"])
+            if chunks_info and used_tokens + chunk_tokens > max_context_tokens:
+                break
+            used_tokens += chunk_tokens
+            chunks_info.append(hit)
+        if not chunks_info:
+            return None
+        return {
+            "document_ids": sorted({c["metadata"].get("document_id") for c in chunks_info}),
+            "full_content": "\n\n".join(c["content"] for c in chunks_info),
+            "chunks": chunks_info,
+            "total_chunks": len(chunks_info),
+            "context_tokens": used_tokens,
+        }
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def chunk_id(metadata: dict) -> str:
+    """Stable id from the document and the chunk content; chunks stored before hashing keep a random id"""
+    if "chunk_hash" not in metadata:
+        return str(uuid.uuid4())
+    return f"{metadata['document_id']}:{metadata['chunk_hash']}"
+
+
+def _clean_metadata(metadata: dict) -> dict:
+    """Chroma only stores scalar metadata values"""
+    return {
+        key: value for key, value in metadata.items()
+        if isinstance(value, (str, int, float, bool))
+    }
+
 
 
 def get_chroma_client():
-    return chromadb.PersistentClient(path="./chroma_db")
+    return get_chroma_registry().client
+
+
+def _mmr_select(query_embedding, candidate_embeddings, k: int, lambda_mult: float) -> List[int]:
+    """Maximal marginal relevance: pick k candidates trading relevance for diversity"""
+    if len(candidate_embeddings) == 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    candidates = candidates / np.clip(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12, None)
+
+    relevance = candidates @ query
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(candidates)):
+        redundancy = (candidates @ candidates[selected].T).max(axis=1)
+        mmr_scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        mmr_scores[selected] = -np.inf
+        selected.append(int(np.argmax(mmr_scores)))
+    return selected
+
+
+def query_document_chunks(collection_name: str, document_id: str, query_embedding: List[float],
+                          k: int = 4, use_mmr: bool = False, fetch_k: int = 20,
+                          lambda_mult: float = 0.5, max_context_tokens: int = 2000,
+                          chroma: Optional[ChromaRegistry] = None,
+                          lexical_index: Optional[LexicalIndex] = None, query_text: Optional[str] = None,
+                          vector_index: Optional[VectorIndex] = None):
+    """Top-k similarity search restricted to the chunks of one document.
+
+    Returns the selected chunks (id, text, metadata, score) in relevance order,
+    trimmed so their combined text stays within ``max_context_tokens``. When a
+    ``lexical_index`` is given, vector and BM25 rankings are merged with reciprocal
+    rank fusion; chunks found only by BM25 have no distance or score.
+
+    In compact collections the document's vector segment supplies the final
+    distances: quantized codes are scanned instead of querying Chroma, otherwise
+    extra candidates come from the truncated vectors in Chroma and are rescored.
+    """
+    try:
+        collection = (chroma or get_chroma_registry()).get_collection(collection_name)
+
+        lexical_ids = []
+        if lexical_index is not None and query_text:
+            with stage("lexical.search"):
+                lexical_ids = [chunk_id for chunk_id, _ in
+                               lexical_index.search(collection_name, document_id, query_text, max(fetch_k, k))]
+        hybrid = bool(lexical_ids)
+
+        config = VectorConfig.from_metadata(collection.metadata) or VectorConfig()
+        segment = None
+        if vector_index is not None and config.compact:
+            segment = vector_index.get(collection_name, document_id)
+        n_results = max(fetch_k, k) if use_mmr or hybrid else k
+
+        # rows of (id, text, metadata, distance, embedding used for MMR)
+        if segment is not None and segment.codes is not None:
+            with stage("vectors.scan"):
+                hits = segment.search(query_embedding, n_results, config.rescore_factor)
+            with stage("chroma.get"):
+                fetched = collection.get(ids=[chunk_id for chunk_id, _ in hits], include=["documents", "metadatas"])
+            stored = dict(zip(fetched["ids"], zip(fetched["documents"], fetched["metadatas"])))
+            hits = [(chunk_id, distance) for chunk_id, distance in hits if chunk_id in stored]
+            embeddings = segment.vectors_for([chunk_id for chunk_id, _ in hits]) if use_mmr else [None] * len(hits)
+            rows = [(chunk_id, *stored[chunk_id], distance, embedding)
+                    for (chunk_id, distance), embedding in zip(hits, embeddings)]
+            mmr_query = query_embedding
+        else:
+            mmr_query = truncate(query_embedding, config.dimensions).tolist() if config.dimensions else query_embedding
+            include = ["documents", "metadatas", "distances"]
+            if use_mmr:
+                include.append("embeddings")
+            with stage("chroma.query"):
+                results = collection.query(
+                    query_embeddings=[mmr_query],
+                    n_results=n_results * config.rescore_factor if segment is not None else n_results,
+                    where={"document_id": document_id},
+                    include=include,
+                )
+            embeddings = results["embeddings"][0] if use_mmr else [None] * len(results["ids"][0])
+            rows = list(zip(results["ids"][0], results["documents"][0], results["metadatas"][0],
+                            results["distances"][0], embeddings))
+            if segment is not None and rows:
+                with stage("vectors.rescore"):
+                    exact = segment.rescore(query_embedding, [row[0] for row in rows])
+                rows = [row if distance is None else (*row[:3], distance, row[4])
+                        for row, distance in zip(rows, exact)]
+                rows = sorted(rows, key=lambda row: row[3])[:n_results]
+
+        ids = [row[0] for row in rows]
+        if not ids and not hybrid:
+            logger.debug(f"No chunks found for document ID: {document_id}")
+            return None
+
+        order = list(range(len(ids)))
+        if use_mmr:
+            order = _mmr_select(mmr_query, [row[4] for row in rows], k, lambda_mult)
 
+        candidates = {row[0]: (row[1], row[2], row[3]) for row in rows}
+        ranked = [ids[i] for i in order]
+        if hybrid:
+            fused = reciprocal_rank_fusion([ranked, lexical_ids])
+            ranked = sorted(fused, key=fused.get, reverse=True)
+            missing = [chunk_id for chunk_id in ranked[:k] if chunk_id not in candidates]
+            if missing:
+                with stage("chroma.get"):
+                    extra = collection.get(ids=missing, include=["documents", "metadatas"])
+                for chunk_id, content, metadata in zip(extra["ids"], extra["documents"], extra["metadatas"]):
+                    candidates[chunk_id] = (content, metadata, None)
+
+        chunks_info = []
+        used_tokens = 0
+        for chunk_id in ranked[:k]:
+            if chunk_id not in candidates:
+                continue  # stale lexical entry
+            chunk_content, metadata, distance = candidates[chunk_id]
+            chunk_tokens = count_tokens(chunk_content)
+            if chunks_info and used_tokens + chunk_tokens > max_context_tokens:
+                break
+            used_tokens += chunk_tokens
+            chunks_info.append({
+                "chunk_id": chunk_id,
+                "content": chunk_content,
+                "metadata": metadata,
+                "distance": distance,
+                # collections use squared L2; OpenAI embeddings are unit length so this is cosine similarity
+                "score": 1 - distance / 2 if distance is not None else None,
+            })
+
+        if not chunks_info:
+            logger.debug(f"No chunks found for document ID: {document_id}")
+            return None
+
+        return {
+            "document_id": document_id,
+            "full_content": "\n\n".join(c["content"] for c in chunks_info),
+            "chunks": chunks_info,
+            "total_chunks": len(chunks_info),
+            "context_tokens": used_tokens,
+        }
+    except Exception as e:
+        logger.exception(f"Error querying document {document_id}: {str(e)}")
+        return None
 
 
-def get_chroma_collections(collection_name: str, document_id: str):
+def query_collection_chunks(collection_name: str, query_embedding: List[float], k: int = 4,
+                            where: Optional[dict] = None,
+                            chroma: Optional[ChromaRegistry] = None,
+                            vector_index: Optional[VectorIndex] = None) -> List[dict]:
+    """Top-k chunks of one collection; a missing collection yields no hits.
+
+    Compact collections are queried with the truncated query vector and, when
+    ``vector_index`` is given, the extra candidates are rescored per document.
+    """
     try:
-        client = get_chroma_client()
-        collection = client.get_collection(collection_name)
-        results = collection.get(
-            where={"document_id": document_id},
+        collection = (chroma or get_chroma_registry()).get_collection(collection_name)
+    except Exception:
+        return []
+    config = VectorConfig.from_metadata(collection.metadata) or VectorConfig()
+    rescore = vector_index is not None and config.compact
+    with stage("chroma.query"):
+        results = collection.query(
+            query_embeddings=[truncate(query_embedding, config.dimensions).tolist()
+                              if config.dimensions else query_embedding],
+            n_results=k * config.rescore_factor if rescore else k,
+            where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+    hits = [
+        {
+            "chunk_id": chunk_id,
+            "content": content,
+            "metadata": metadata,
+            "distance": distance,
+        }
+        for chunk_id, content, metadata, distance in zip(
+            results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
         )
-     
+    ]
+    if rescore:
+        by_document: Dict[str, List[dict]] = {}
+        for hit in hits:
+            by_document.setdefault(hit["metadata"].get("document_id"), []).append(hit)
+        with stage("vectors.rescore"):
+            for document_id, document_hits in by_document.items():
+                segment = vector_index.get(collection_name, document_id)
+                if segment is None:
+                    continue
+                exact = segment.rescore(query_embedding, [hit["chunk_id"] for hit in document_hits])
+                for hit, distance in zip(document_hits, exact):
+                    if distance is not None:
+                        hit["distance"] = distance
+        hits = sorted(hits, key=lambda hit: hit["distance"])[:k]
+    for hit in hits:
+        hit["score"] = 1 - hit["distance"] / 2
+    return hits
+
+
+def get_chroma_collections(collection_name: str, document_id: str,
+                           chroma: Optional[ChromaRegistry] = None):
+    try:
+        collection = (chroma or get_chroma_registry()).get_collection(collection_name)
+        with stage("chroma.get"):
+            results = collection.get(
+                where={"document_id": document_id},
+            )
+
         if not results["documents"]:
-            print(f"❌ No document found with ID: {document_id}")
+            logger.debug(f"No document found with ID: {document_id}")
             return None
 
         full_content = ""
         chunks_info = []
         for i in range(len(results["documents"])):
-            print(results["documents"][i])
             chunk_content = results["documents"][i]
             chunk_metadata = results["metadatas"][i]
             chunk_id = results["ids"][i]
@@ -150,14 +992,12 @@ def get_chroma_collections(collection_name: str, document_id: str):
 
             full_content += chunk_content + "\n\n"
 
-            return {
-                "document_id": document_id,
-                "full_content": full_content.strip(),
-                "chunks": chunks_info,
-                "total_chunks": len(results["documents"])
-            }
+        return {
+            "document_id": document_id,
+            "full_content": full_content.strip(),
+            "chunks": chunks_info,
+            "total_chunks": len(results["documents"])
+        }
     except Exception as e:
-        print(f"❌ Error getting document: {str(e)}")
+        logger.exception(f"Error getting document {document_id}: {str(e)}")
         return None
-        
-        
\ No newline at end of file
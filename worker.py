@@ -0,0 +1,227 @@
+"""Ingestion worker: claims jobs from the ingest_jobs queue and vectorizes them.
+
+Run one or more of these next to the API, e.g. ``python worker.py --concurrency 2``.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from database import mongo
+from document_registry import DocumentRegistry
+from jobs import IngestJobQueue, COMPLETED, DEAD, QUEUED, RUNNING
+from maintenance import delete_document_data
+from metrics import configure_logging, configure_tracing, stage, start_metrics_server, track_executor
+from schema import ensure_schema
+from vectorizer import AsyncDocumentVectorizer
+
+logger = logging.getLogger("worker")
+
+
+def build_job_queue() -> IngestJobQueue:
+    return IngestJobQueue(
+        mongo.ingest_jobs,
+        max_attempts=int(os.getenv("INGEST_MAX_ATTEMPTS", "5")),
+        lease_seconds=int(os.getenv("INGEST_LEASE_SECONDS", "600")),
+        retry_base_seconds=int(os.getenv("INGEST_RETRY_BASE_SECONDS", "30")),
+    )
+
+
+async def _keep_lease(queue: IngestJobQueue, job_id: str, worker_id: str, holder: asyncio.Task):
+    """Renew the job's lease until cancelled; cancel ``holder`` and return if the lease was lost"""
+    interval = max(1.0, queue.lease.total_seconds() / 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            renewed = await queue.renew_lease(job_id, worker_id)
+        except Exception as e:
+            # the lease is still valid for a while, try again on the next tick
+            logger.warning(f"Could not renew the lease on job {job_id}: {e}")
+            continue
+        if not renewed:
+            logger.warning(f"Lost the lease on job {job_id}, another worker took it over")
+            holder.cancel()
+            return
+
+
+async def _reusable_documents(queue: IngestJobQueue, registry: DocumentRegistry, job: dict) -> set:
+    """Finished documents with the job's file hash, whose vectors the job may copy"""
+    if not job.get("file_hash"):
+        return set()
+    reusable = set()
+    for doc_id in await queue.completed_documents(job["file_hash"]):
+        record = await registry.get(doc_id)
+        if doc_id != job["document_id"] and record and record["status"] == COMPLETED:
+            reusable.add(doc_id)
+    return reusable
+
+
+async def convert_to_vector(queue: IngestJobQueue, vectorizer: AsyncDocumentVectorizer,
+                            job: dict, worker_id: str, registry: DocumentRegistry) -> str:
+    """Vectorize one claimed job, record the outcome on the job and the document, and return its status.
+
+    The job stops if its lease is lost, leaving the job to the worker that took it
+    over. Cancelling the task hands the job back to the queue.
+    """
+    lease = asyncio.create_task(_keep_lease(queue, job["_id"], worker_id, asyncio.current_task()))
+    new_status = error = None
+    try:
+        if job["attempts"] > job.get("max_attempts", queue.max_attempts):
+            # a worker died holding this job on its last attempt
+            error = job.get("last_error") or "lease expired"
+            new_status = await queue.fail(job, error)
+        elif not await registry.set_status(job["document_id"], RUNNING):
+            # deleted before ingestion started
+            await queue.complete(job["_id"], {})
+            return COMPLETED
+        else:
+            reusable = await _reusable_documents(queue, registry, job)
+            with stage("ingest.vectorize"):
+                result = await vectorizer.vectorize_document_async(
+                    file_path=job["file_path"],
+                    collection_name=job.get("collection", "default"),
+                    document_id=job["document_id"],
+                    file_hash=job.get("file_hash"),
+                    completed_documents=reusable,
+                )
+            if result["success"]:
+                await queue.complete(job["_id"], result)
+                if not await registry.set_status(job["document_id"], COMPLETED, chunk_count=result["chunks_created"]):
+                    # the document was deleted while it was being ingested
+                    await delete_document_data(vectorizer, {
+                        "document_id": job["document_id"],
+                        "collection": job.get("collection", "default"),
+                    }, file_path=job["file_path"])
+                return COMPLETED
+            error = result["error"]
+            new_status = await queue.fail(job, error)
+            logger.warning(f"Job {job['_id']} for {job['document_id']} failed: {error}")
+    except asyncio.CancelledError:
+        if lease.done():
+            # the lease keeper gave up: the job and the document status belong to the new worker
+            return RUNNING
+        # the worker is stopping: let another worker pick the job up right away
+        if await queue.release(job["_id"], worker_id):
+            await registry.set_status(job["document_id"], QUEUED)
+            logger.info(f"Released job {job['_id']} for {job['document_id']}")
+        raise
+    except Exception as e:
+        error = str(e)
+        new_status = await queue.fail(job, error)
+        logger.exception(f"Job {job['_id']} for {job['document_id']} crashed")
+    finally:
+        lease.cancel()
+
+    # a retry shows as queued again; dead-lettered documents keep the last error
+    await registry.set_status(job["document_id"], new_status, error=error)
+
+    if new_status == DEAD:
+        logger.error(f"Job {job['_id']} for {job['document_id']} moved to dead-letter")
+    return new_status
+
+
+async def _free_slot(slots: asyncio.Semaphore, stop: asyncio.Event) -> bool:
+    """Take a slot once one is free; returns False without one if ``stop`` is set first"""
+    acquire = asyncio.create_task(slots.acquire())
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait({acquire, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    stopped.cancel()
+    if not acquire.done():
+        acquire.cancel()
+        return False
+    if stop.is_set():
+        slots.release()
+        return False
+    return True
+
+
+async def run_worker(vectorizer: AsyncDocumentVectorizer, queue: IngestJobQueue,
+                     concurrency: int = 2, poll_interval: float = 1.0,
+                     stop: asyncio.Event = None, registry: Optional[DocumentRegistry] = None,
+                     stop_grace_seconds: float = 30) -> None:
+    """Claim and run up to ``concurrency`` jobs at a time until ``stop`` is set.
+
+    Once stopped, running jobs get ``stop_grace_seconds`` to finish; the rest are
+    cancelled and released back to the queue.
+    """
+    registry = registry or DocumentRegistry.from_env(mongo.user_documents)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    stop = stop or asyncio.Event()
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+    logger.info(f"Ingest worker {worker_id} started with concurrency {concurrency}")
+
+    while not stop.is_set():
+        if not await _free_slot(slots, stop):
+            # stopped while waiting for a free slot: don't start another job
+            break
+        try:
+            job = await queue.claim(worker_id)
+        except Exception as e:
+            slots.release()
+            logger.warning(f"Could not claim a job: {e}")
+            job = None
+        else:
+            if job is None:
+                slots.release()
+
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        task = asyncio.create_task(convert_to_vector(queue, vectorizer, job, worker_id, registry))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        task.add_done_callback(lambda _: slots.release())
+
+    if running:
+        _, unfinished = await asyncio.wait(set(running), timeout=stop_grace_seconds)
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+
+
+async def main(concurrency: int, poll_interval: float, metrics_port: int) -> None:
+    mongo.connect()
+    queue = build_job_queue()
+    await ensure_schema(mongo.async_db)
+    vectorizer = AsyncDocumentVectorizer.from_env()
+    if metrics_port:
+        track_executor("vectorizer", vectorizer.executor)
+        start_metrics_server(metrics_port)
+    # SIGTERM (e.g. from the container runtime) stops claiming and releases unfinished jobs
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C still interrupts, expired leases are picked up again
+    try:
+        await run_worker(vectorizer, queue, concurrency=concurrency, poll_interval=poll_interval, stop=stop,
+                         stop_grace_seconds=float(os.getenv("INGEST_STOP_GRACE_SECONDS", "30")))
+    finally:
+        vectorizer.shutdown()
+        await mongo.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    configure_logging()
+    configure_tracing("rag-worker")
+    parser = argparse.ArgumentParser(description="Run the document ingestion worker")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("INGEST_CONCURRENCY", "2")))
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("WORKER_METRICS_PORT", "0")),
+                        help="serve Prometheus metrics on this port; 0 disables")
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.poll_interval, args.metrics_port))